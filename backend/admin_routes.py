@@ -1,6 +1,7 @@
 # Admin Dashboard API Routes
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import FileResponse
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 import jwt
@@ -9,10 +10,17 @@ import os
 from pydantic import BaseModel
 
 from models import (
-    AdminUser, AdminLog, Competition, Video, User, AlgorithmConfig,
-    CompetitionStatus, VideoStatus, CreditTransaction
+    AdminUser, AdminLog, Competition, User, AlgorithmConfig,
+    CompetitionStatus, VideoStatus, CreditTransaction, CompetitionJob
 )
-from algorithm import VideoRecommendationEngine
+from algorithm import bump_config_revision
+from cache import competition_cache, ACTIVE_COMPETITION_KEY
+from blob_store import release_blob
+from storage import get_storage
+from media import remove_video_media
+from competition_jobs import request_competition_end, job_status
+from db_indexes import index_report
+from leaderboard import remove_from_leaderboard
 
 admin_router = APIRouter(prefix="/api/admin", tags=["admin"])
 security = HTTPBearer()
@@ -66,6 +74,11 @@ def get_db():
     from server import db
     return db
 
+# The app's recommendation engine, shared with the API routes
+async def get_engine():
+    from server import get_algorithm_engine
+    return await get_algorithm_engine()
+
 # Dependency functions
 async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security), db=Depends(get_db)):
     try:
@@ -302,6 +315,7 @@ async def create_competition(
     
     result = await db.competitions.insert_one(competition.dict())
     competition_id = str(result.inserted_id)
+    competition_cache.invalidate(ACTIVE_COMPETITION_KEY)
     
     # Log admin action
     await log_admin_action(
@@ -311,7 +325,7 @@ async def create_competition(
     
     return {"message": "Competition created successfully", "competition_id": competition_id}
 
-@admin_router.put("/competitions/{competition_id}/end")
+@admin_router.put("/competitions/{competition_id}/end", status_code=status.HTTP_202_ACCEPTED)
 async def end_competition(
     competition_id: str,
     admin: AdminUser = Depends(get_current_admin),
@@ -320,68 +334,63 @@ async def end_competition(
     competition = await db.competitions.find_one({"id": competition_id})
     if not competition:
         raise HTTPException(status_code=404, detail="Competition not found")
+    if competition.get("status") == "ended":
+        raise HTTPException(status_code=400, detail="Competition already ended")
     
-    # Calculate final results
-    algorithm = VideoRecommendationEngine(db)
-    
-    # Get all videos from this competition
-    videos = await db.videos.find({
-        "competition_round": competition_id,
-        "is_paid": True,
-        "status": "active"
-    }).to_list(None)
-    
-    # Calculate final scores and rankings
-    scored_videos = []
-    for video_data in videos:
-        video = Video(**video_data)
-        score = await algorithm.calculate_composite_score(video, competition_id)
-        scored_videos.append({
-            "video_id": video.id,
-            "user_id": video.user_id,
-            "score": score.total_score,
-            "view_count": video.view_count
-        })
-    
-    # Sort by score
-    scored_videos.sort(key=lambda x: x["score"], reverse=True)
-    
-    # Determine winners
-    winners = []
-    for i, video in enumerate(scored_videos[:competition["winner_count"]], 1):
-        is_special = i <= competition["special_winner_count"]
-        winners.append({
-            "rank": i,
-            "video_id": video["video_id"],
-            "user_id": video["user_id"],
-            "score": video["score"],
-            "is_special_winner": is_special
-        })
-    
-    # Update competition
-    await db.competitions.update_one(
-        {"id": competition_id},
-        {
-            "$set": {
-                "status": "ended",
-                "end_date": datetime.utcnow(),
-                "winners": winners
-            }
-        }
-    )
+    # Scoring and ranking run as a background job; poll GET .../end for progress
+    job = await request_competition_end(db, competition_id, admin.id)
     
     # Log admin action
     await log_admin_action(
         db, admin.id, "end_competition", "competition", competition_id,
-        {"winner_count": len(winners), "total_participants": len(videos)}
+        {"job_id": job.id, "snapshot_id": job.snapshot_id}
     )
     
     return {
-        "message": "Competition ended successfully",
-        "winners": winners[:20],  # Return top 20 winners
-        "total_winners": len(winners)
+        "message": "Competition finalization started",
+        "job": job_status(job)
     }
 
+@admin_router.get("/competitions/{competition_id}/end")
+async def get_competition_end_status(
+    competition_id: str,
+    admin: AdminUser = Depends(get_current_admin),
+    db=Depends(get_db)
+):
+    job_doc = await db.competition_jobs.find_one({"competition_id": competition_id}, sort=[("created_at", -1)])
+    if not job_doc:
+        raise HTTPException(status_code=404, detail="Competition has not been ended")
+    
+    result = {"job": job_status(CompetitionJob(**job_doc))}
+    
+    if job_doc["status"] == "completed":
+        competition = await db.competitions.find_one({"id": competition_id}, {"_id": 0, "winners": 1})
+        winners = (competition or {}).get("winners", [])
+        result["winners"] = winners[:20]  # Return top 20 winners
+        result["total_winners"] = len(winners)
+    
+    return result
+
+@admin_router.get("/competitions/{competition_id}/snapshot")
+async def download_competition_snapshot(
+    competition_id: str,
+    admin: AdminUser = Depends(get_current_admin),
+    db=Depends(get_db)
+):
+    """Frozen metrics the final scores were computed from, for offline audit"""
+    job_doc = await db.competition_jobs.find_one(
+        {"competition_id": competition_id, "snapshot_path": {"$ne": None}},
+        sort=[("created_at", -1)]
+    )
+    if not job_doc or not os.path.exists(job_doc["snapshot_path"]):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    
+    return FileResponse(
+        job_doc["snapshot_path"],
+        media_type="application/octet-stream",
+        filename=f"competition-{competition_id}-{job_doc['snapshot_id']}.npz"
+    )
+
 # Video management
 @admin_router.get("/videos")
 async def get_videos(
@@ -427,7 +436,8 @@ async def get_videos(
 async def moderate_videos(
     moderation: VideoModerationAction,
     admin: AdminUser = Depends(get_current_admin),
-    db=Depends(get_db)
+    db=Depends(get_db),
+    engine=Depends(get_engine)
 ):
     if moderation.action not in ["suspend", "approve", "feature", "remove_feature"]:
         raise HTTPException(status_code=400, detail="Invalid moderation action")
@@ -448,6 +458,9 @@ async def moderate_videos(
         {"$set": update_data}
     )
     
+    # Suspended videos leave the score index, approved ones come back
+    await engine.update_score_index(moderation.video_ids)
+    
     # Log admin action
     for video_id in moderation.video_ids:
         await log_admin_action(
@@ -542,7 +555,7 @@ async def moderate_users(
 # Algorithm management
 @admin_router.get("/algorithm/config")
 async def get_algorithm_config(admin: AdminUser = Depends(get_current_admin), db=Depends(get_db)):
-    config = await db.algorithm_configs.find_one({"is_active": True})
+    config = await db.algorithm_configs.find_one({"is_active": True}, {"_id": 0}, sort=[("created_at", -1)])
     if not config:
         raise HTTPException(status_code=404, detail="No active algorithm configuration found")
     
@@ -560,16 +573,20 @@ async def update_algorithm_config(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid configuration: {str(e)}")
     
-    # Deactivate current config
+    # Create new active config first so readers always find one
+    updated_config.created_at = datetime.utcnow()
+    updated_config.is_active = True
+    result = await db.algorithm_configs.insert_one(updated_config.dict())
+    
+    # Switch running workers over in the same write that bumps the revision
+    await bump_config_revision(db, updated_config.id)
+    
+    # Deactivate previous configs
     await db.algorithm_configs.update_many(
-        {"is_active": True},
+        {"is_active": True, "id": {"$ne": updated_config.id}},
         {"$set": {"is_active": False}}
     )
     
-    # Create new active config
-    updated_config.created_at = datetime.utcnow()
-    result = await db.algorithm_configs.insert_one(updated_config.dict())
-    
     # Log admin action
     await log_admin_action(
         db, admin.id, "update_algorithm_config", "algorithm", str(result.inserted_id),
@@ -824,20 +841,23 @@ async def delete_video(
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    # Delete video file from filesystem
-    import os
-    from pathlib import Path
-    if video.get("file_path") and os.path.exists(video["file_path"]):
-        try:
-            os.remove(video["file_path"])
-        except Exception as e:
-            print(f"Error deleting video file: {e}")
+    # Delete video file once no other video shares it
+    try:
+        await release_blob(db, get_storage(), video.get("storage_key"), video.get("file_path"))
+    except Exception as e:
+        print(f"Error deleting video file: {e}")
+    try:
+        await remove_video_media(get_storage(), video_id)
+    except Exception as e:
+        print(f"Error deleting video media: {e}")
     
     # Delete from database
     await db.videos.delete_one({"id": video_id})
     
-    # Delete related interactions
+    # Delete related interactions and scores
     await db.video_interactions.delete_many({"video_id": video_id})
+    await db.algorithm_scores.delete_many({"video_id": video_id})
+    await remove_from_leaderboard(db, [video_id])
     
     # Log action
     await log_admin_action(
@@ -1041,6 +1061,17 @@ async def update_system_settings(
     return {"message": "System settings updated successfully"}
 
 # Statistics and Analytics
+@admin_router.get("/system/indexes")
+async def get_index_report(admin: AdminUser = Depends(get_current_admin), db=Depends(get_db)):
+    """Missing, undeclared and unused indexes; usage counts reset when MongoDB restarts"""
+    return {"collections": await index_report(db)}
+
+@admin_router.get("/system/interaction-buffer")
+async def get_interaction_buffer_stats(admin: AdminUser = Depends(get_current_admin)):
+    """Queued and dropped interaction events of the worker that answers"""
+    from server import get_interaction_buffer
+    return (await get_interaction_buffer()).stats()
+
 @admin_router.get("/analytics/users")
 async def get_user_analytics(
     days: int = Query(30, le=365),
@@ -1,35 +1,435 @@
 # Advanced Video Recommendation Algorithm
+import asyncio
+import logging
 import math
 import random
+import uuid
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple, Iterable
 from collections import defaultdict
 
-from models import Video, User, VideoInteraction, AlgorithmScore, AlgorithmConfig, UserPreference
+import numpy as np
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+
+from cache import competition_cache, ACTIVE_COMPETITION_KEY
+from leases import claim_lease, release_lease
+from models import PRIVATE_VIDEO_FIELDS, Video, VideoInteraction, AlgorithmScore, AlgorithmConfig, UserPreference
+
+logger = logging.getLogger(__name__)
+
+# Video counters incremented by each interaction type
+COUNTER_FIELDS = {
+    "view": "view_count",
+    "like": "like_count",
+    "comment": "comment_count",
+    "share": "share_count"
+}
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Interaction types that teach user preferences
+PREFERENCE_INTERACTIONS = {"like", "comment", "share", "watch_time"}
+
+def collect_metric_updates(interactions: Iterable[VideoInteraction]) -> Dict[str, Dict]:
+    """Group interactions into per-video counter deltas and watch times"""
+    updates = {}
+    for interaction in interactions:
+        field = COUNTER_FIELDS.get(interaction.interaction_type)
+        watch_time = interaction.interaction_type == "watch_time" and interaction.value
+        if not field and not watch_time:
+            continue
+        
+        update = updates.setdefault(interaction.video_id, {"counts": defaultdict(int), "watch_times": []})
+        if field:
+            update["counts"][field] += 1
+        else:
+            update["watch_times"].append(interaction.value)
+    return updates
+
+def metric_update_pipeline(counts: Dict[str, int], watch_times: List[float], now: datetime) -> List[Dict]:
+    """Build a server-side update pipeline applying counter deltas and watch times"""
+    pipeline = []
+    
+    # Counters
+    count_stage = {"last_updated": now}
+    for field, delta in counts.items():
+        count_stage[field] = {"$add": [{"$ifNull": [f"${field}", 0]}, delta]}
+    pipeline.append({"$set": count_stage})
+    
+    # Completion moving average, one stage per watch event in arrival order. The
+    # ratio is capped at 1, so watch events leave replay_rate as it is.
+    has_duration = {"$gt": [{"$ifNull": ["$duration", 0]}, 0]}
+    for value in watch_times:
+        watched_ratio = {"$divide": [value, "$duration"]}
+        pipeline.append({"$set": {
+            "completion_rate": {"$cond": [
+                has_duration,
+                {"$divide": [{"$add": [{"$ifNull": ["$completion_rate", 0]}, {"$min": [watched_ratio, 1.0]}]}, 2]},
+                {"$ifNull": ["$completion_rate", 0]}
+            ]}
+        }})
+    
+    # Engagement rate from the updated counters
+    if counts:
+        pipeline.append({"$set": {
+            "engagement_rate": {"$cond": [
+                {"$gt": [{"$ifNull": ["$view_count", 0]}, 0]},
+                {"$divide": [
+                    {"$add": [
+                        {"$ifNull": ["$like_count", 0]},
+                        {"$ifNull": ["$comment_count", 0]},
+                        {"$multiply": [{"$ifNull": ["$share_count", 0]}, 2]}
+                    ]},
+                    "$view_count"
+                ]},
+                {"$ifNull": ["$engagement_rate", 0.0]}
+            ]}
+        }})
+    
+    return pipeline
+
+# Video fields read when learning preferences
+PREFERENCE_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "hashtags": 1, "duration": 1}
+
+def apply_preference_interaction(user_pref: UserPreference, video: Dict, interaction_type: str, value: Optional[float] = None):
+    """Update learned preferences in place for one interaction"""
+    hashtags = video.get("hashtags", [])
+    duration = video.get("duration")
+    
+    # Update preferences based on positive interactions
+    if interaction_type in ["like", "comment", "share"]:
+        # Learn hashtag preferences
+        for hashtag in hashtags:
+            if hashtag not in user_pref.preferred_hashtags:
+                user_pref.preferred_hashtags.append(hashtag)
+                
+            # Remove from skipped if previously skipped
+            if hashtag in user_pref.skipped_hashtags:
+                user_pref.skipped_hashtags.remove(hashtag)
+        
+        # Learn user preferences
+        if video["user_id"] not in user_pref.preferred_users:
+            user_pref.preferred_users.append(video["user_id"])
+    
+    elif interaction_type == "watch_time" and value and duration:
+        # Learn duration preferences
+        if value / duration < 0.3:  # Watched less than 30%
+            # Add hashtags to skipped list
+            for hashtag in hashtags:
+                if hashtag not in user_pref.skipped_hashtags:
+                    user_pref.skipped_hashtags.append(hashtag)
+        else:
+            # Update preferred duration (moving average)
+            if user_pref.preferred_duration:
+                user_pref.preferred_duration = (user_pref.preferred_duration + duration) / 2
+            else:
+                user_pref.preferred_duration = duration
+
+# Default competition weights (used when a competition has none)
+DEFAULT_COMPETITION_WEIGHTS = {
+    "view_weight": 0.4,
+    "like_weight": 0.2,
+    "comment_weight": 0.2,
+    "share_weight": 0.1,
+    "completion_weight": 0.1
+}
+
+def competition_weights(competition: Optional[Dict]) -> Dict[str, float]:
+    """Get scoring weights of a competition document"""
+    if not competition:
+        return dict(DEFAULT_COMPETITION_WEIGHTS)
+    return {
+        name: competition.get(name, default)
+        for name, default in DEFAULT_COMPETITION_WEIGHTS.items()
+    }
+
+def user_reputation_score(user: Optional[Dict]) -> float:
+    """Calculate creator reputation score from a user document"""
+    if not user:
+        return 50.0  # Default score for new users
+    
+    score = 50.0  # Base score
+    
+    # Verified user bonus
+    if user.get("is_verified", False):
+        score += 15
+        
+    # Follower count bonus (logarithmic)
+    follower_count = user.get("follower_count", 0)
+    if follower_count > 0:
+        follower_boost = min(math.log10(follower_count + 1) * 5, 20)
+        score += follower_boost
+        
+    # Average engagement bonus
+    total_views = user.get("total_views", 0)
+    if total_views > 0:
+        avg_engagement = user.get("total_likes", 0) / total_views
+        if avg_engagement > 0.05:  # 5% average engagement
+            score += 15
+            
+    return min(score, 100.0)
+
+# Video fields read by the batch scoring path
+SCORING_FIELDS = {
+    "_id": 0, "id": 1, "user_id": 1, "competition_round": 1, "status": 1, "is_paid": 1,
+    "view_count": 1, "like_count": 1, "comment_count": 1, "share_count": 1,
+    "completion_rate": 1, "replay_rate": 1, "duration": 1, "upload_date": 1
+}
+
+# User fields read by user_reputation_score
+REPUTATION_FIELDS = {"_id": 0, "id": 1, "is_verified": 1, "follower_count": 1, "total_likes": 1, "total_views": 1}
+
+def is_scoreable(video: Dict) -> bool:
+    """Check whether a video takes part in its competition ranking"""
+    return video.get("is_paid", False) and video.get("status", "active") == "active"
+
+class ScoringContext:
+    """Data prefetched once and shared by every video scored for a competition"""
+    
+    def __init__(self, competition_id: str, weights: Dict[str, float], config: AlgorithmConfig, users: Dict[str, Dict]):
+        self.competition_id = competition_id
+        self.weights = weights
+        self.config = config
+        self.users = users
+        self._user_scores = {}
+    
+    def user_score(self, user_id: str) -> float:
+        """Get creator reputation score from the prefetched users"""
+        if user_id not in self._user_scores:
+            self._user_scores[user_id] = user_reputation_score(self.users.get(user_id))
+        return self._user_scores[user_id]
+    
+    def user_scores(self, video_docs: List[Dict]) -> np.ndarray:
+        """Get creator reputation scores for many video documents"""
+        return np.fromiter(
+            (self.user_score(doc["user_id"]) for doc in video_docs),
+            dtype=np.float64,
+            count=len(video_docs)
+        )
+
+def build_metric_columns(video_docs: List[Dict]) -> Dict[str, np.ndarray]:
+    """Load the scoring metrics of many video documents into NumPy columns"""
+    count = len(video_docs)
+    
+    def column(field: str, default: float = 0.0) -> np.ndarray:
+        values = (doc.get(field) for doc in video_docs)
+        return np.fromiter(
+            (default if value is None else value for value in values),
+            dtype=np.float64,
+            count=count
+        )
+    
+    return {
+        "view_count": column("view_count"),
+        "like_count": column("like_count"),
+        "comment_count": column("comment_count"),
+        "share_count": column("share_count"),
+        "completion_rate": column("completion_rate"),
+        "replay_rate": column("replay_rate"),
+        "duration": column("duration", np.nan),  # Missing duration gets no bonus
+        "upload_date": np.array(
+            [doc.get("upload_date") for doc in video_docs],
+            dtype="datetime64[us]"
+        )
+    }
+
+def score_metric_columns(
+    columns: Dict[str, np.ndarray],
+    weights: Dict[str, float],
+    config: AlgorithmConfig,
+    user_scores: np.ndarray,
+    now: Optional[datetime] = None
+) -> Dict[str, np.ndarray]:
+    """Vectorized equivalent of the calculate_*_score functions for many videos"""
+    now = now or datetime.utcnow()
+    views = columns["view_count"]
+    completion = columns["completion_rate"]
+    has_views = views > 0
+    
+    # View score: logarithmic scaling, capped at 100
+    view_score = np.zeros_like(views)
+    np.log10(views + 1, out=view_score, where=has_views)
+    view_score = np.where(has_views, np.minimum(view_score * 20, 100.0), 0.0)
+    
+    # Engagement score: shares worth 2x, logarithmic scaling
+    engagements = columns["like_count"] + columns["comment_count"] + (columns["share_count"] * 2)
+    engagement_rate = np.divide(engagements, views, out=np.zeros_like(views), where=has_views)
+    has_engagement = engagement_rate > 0
+    engagement_score = np.zeros_like(views)
+    np.log10(engagement_rate * 100 + 1, out=engagement_score, where=has_engagement)
+    engagement_score = np.where(has_engagement, np.minimum(engagement_score * 25, 100.0), 0.0)
+    engagement_score = np.where(completion > 0.7, engagement_score * 1.2, engagement_score)
+    engagement_score = np.minimum(engagement_score, 100.0)
+    
+    # Recency score: exponential decay based on half-life
+    age = np.datetime64(now, "us") - columns["upload_date"]
+    age_days = (age.astype(np.int64) / 10**6) / 86400
+    decay_factor = np.power(0.5, age_days / config.half_life_days)
+    recency_score = np.minimum(decay_factor * config.recency_factor * 100, 100.0)
+    
+    # Quality score: completion, replay and duration bonus
+    duration = columns["duration"]
+    duration_bonus = np.where(
+        (duration >= 15) & (duration <= 60), 20.0,
+        np.where((duration > 60) & (duration <= 120), 10.0, 0.0)
+    )
+    quality_score = completion * 50 + columns["replay_rate"] * 30 + duration_bonus
+    quality_score = np.minimum(quality_score, 100.0)
+    
+    total_score = (
+        view_score * weights["view_weight"] +
+        engagement_score * (weights["like_weight"] + weights["comment_weight"] + weights["share_weight"]) +
+        quality_score * weights["completion_weight"] +
+        recency_score * 0.2 +  # 20% recency weight
+        user_scores * 0.1      # 10% user reputation weight
+    )
+    
+    return {
+        "view_score": view_score,
+        "engagement_score": engagement_score,
+        "recency_score": recency_score,
+        "quality_score": quality_score,
+        "user_score": user_scores,
+        "total_score": np.minimum(total_score, 100.0)
+    }
+
+# Revision counter and id of the active algorithm config, switched together
+CONFIG_REVISION_FILTER = {"type": "algorithm_config_revision"}
+
+async def bump_config_revision(db, config_id: str):
+    """Make a config the active one for every worker process in a single write"""
+    await db.system_settings.update_one(
+        CONFIG_REVISION_FILTER,
+        {"$inc": {"revision": 1}, "$set": {"config_id": config_id, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+# Leases keeping full-round rescoring to one worker at a time
+SCORE_SWEEP_LEASE = {"type": "score_index_sweep"}
+SCORE_INDEX_BUILD_LEASE = {"type": "score_index_build"}
+SCORE_INDEX_BUILD_LEASE_SECONDS = 600
+SCORE_INDEX_BUILD_RETRY_SECONDS = 30
+
+class AlgorithmConfigProvider:
+    """Active algorithm configuration, hot-reloaded when admins change it"""
+    
+    def __init__(self, db, poll_interval_seconds: float = 5.0):
+        self.db = db
+        self.poll_interval_seconds = poll_interval_seconds
+        self._active: Optional[Tuple[int, AlgorithmConfig]] = None
+        self._load_lock = asyncio.Lock()
+    
+    async def get_active(self) -> Tuple[int, AlgorithmConfig]:
+        """Get the (revision, config) pair currently in use"""
+        if self._active is None:
+            async with self._load_lock:
+                if self._active is None:
+                    await self.reload()
+        return self._active
+    
+    async def get_config(self) -> AlgorithmConfig:
+        """Get current active algorithm configuration"""
+        revision, config = await self.get_active()
+        return config
+    
+    async def reload(self):
+        """Load the active config and swap it in with a single assignment"""
+        doc = await self.read_revision_doc()
+        revision = doc.get("revision", 0)
+        config = None
+        if doc.get("config_id"):
+            config = await self.db.algorithm_configs.find_one({"id": doc["config_id"]})
+        if config is None:
+            # Before the first switch, the newest active config
+            config = await self.db.algorithm_configs.find_one({"is_active": True}, sort=[("created_at", -1)])
+        if config:
+            self._active = (revision, AlgorithmConfig(**config))
+        elif self._active is None:
+            # Create default config
+            default_config = AlgorithmConfig(
+                name="Default Recommendation Algorithm",
+                version="1.0"
+            )
+            await self.db.algorithm_configs.insert_one(default_config.dict())
+            self._active = (revision, default_config)
+    
+    async def read_revision_doc(self) -> Dict:
+        return await self.db.system_settings.find_one(CONFIG_REVISION_FILTER, {"_id": 0, "revision": 1, "config_id": 1}) or {}
+    
+    async def read_revision(self) -> int:
+        """Read the shared config revision counter"""
+        return (await self.read_revision_doc()).get("revision", 0)
+    
+    async def watch(self):
+        """Reload when the revision document changes, polling it when change streams are unavailable"""
+        # Only the revision document switches configs; inserting or
+        # deactivating configs on their own doesn't
+        pipeline = [{"$match": {"fullDocument.type": CONFIG_REVISION_FILTER["type"]}}]
+        while True:
+            try:
+                async with self.db.system_settings.watch(pipeline, full_document="updateLookup") as stream:
+                    # Pick up anything that changed before the stream opened
+                    await self.reload()
+                    async for change in stream:
+                        await self.reload()
+            except OperationFailure as e:
+                # Standalone servers don't support change streams
+                logger.info(f"Algorithm config change stream unavailable, polling instead: {str(e)}")
+                await self.poll()
+                return
+            except PyMongoError as e:
+                logger.warning(f"Algorithm config change stream failed: {str(e)}")
+                await asyncio.sleep(self.poll_interval_seconds)
+    
+    async def poll(self):
+        """Reload whenever the revision counter moves"""
+        while True:
+            await asyncio.sleep(self.poll_interval_seconds)
+            try:
+                revision = await self.read_revision()
+                if self._active is None or revision != self._active[0]:
+                    await self.reload()
+            except PyMongoError as e:
+                logger.warning(f"Algorithm config poll failed: {str(e)}")
 
 class VideoRecommendationEngine:
-    def __init__(self, db):
+    def __init__(self, db, config_provider: Optional[AlgorithmConfigProvider] = None):
         self.db = db
-        self.current_config = None
+        self.config_provider = config_provider or AlgorithmConfigProvider(db)
+        self.owner = uuid.uuid4().hex
+        self._index_builds: Dict[str, asyncio.Task] = {}
+        self._dirty_scores: Set[str] = set()  # Videos whose metrics changed since the last rescore
         
     async def get_algorithm_config(self) -> AlgorithmConfig:
         """Get current active algorithm configuration"""
-        if not self.current_config:
-            config = await self.db.algorithm_configs.find_one({"is_active": True})
-            if config:
-                self.current_config = AlgorithmConfig(**config)
-            else:
-                # Create default config
-                self.current_config = AlgorithmConfig(
-                    name="Default Recommendation Algorithm",
-                    version="1.0"
-                )
-                await self.db.algorithm_configs.insert_one(self.current_config.dict())
-        return self.current_config
+        return await self.config_provider.get_config()
     
-    async def calculate_recency_score(self, video: Video) -> float:
+    async def build_scoring_context(
+        self,
+        competition_id: str,
+        user_ids: Iterable[str],
+        competition: Optional[Dict] = None,
+        config: Optional[AlgorithmConfig] = None
+    ) -> ScoringContext:
+        """Prefetch competition weights and creators needed to score videos"""
+        config = config or await self.get_algorithm_config()
+        
+        if competition is None:
+            competition = await self.db.competitions.find_one({"id": competition_id})
+        
+        # Bulk-load all creators with a single query
+        users = {}
+        user_ids = list(set(user_ids))
+        if user_ids:
+            async for user in self.db.users.find({"id": {"$in": user_ids}}, REPUTATION_FIELDS):
+                users[user["id"]] = user
+        
+        return ScoringContext(competition_id, competition_weights(competition), config, users)
+    
+    async def calculate_recency_score(self, video: Video, context: Optional[ScoringContext] = None) -> float:
         """Calculate score based on how recent the video is"""
-        config = await self.get_algorithm_config()
+        config = context.config if context else await self.get_algorithm_config()
         
         now = datetime.utcnow()
         age_days = (now - video.upload_date).total_seconds() / 86400  # Convert to days
@@ -94,59 +494,35 @@ class VideoRecommendationEngine:
                 
         return min(quality_score, 100.0)
     
-    async def calculate_user_score(self, video: Video) -> float:
+    async def calculate_user_score(self, video: Video, context: Optional[ScoringContext] = None) -> float:
         """Calculate score based on user's historical performance"""
-        # Get user data
-        user = await self.db.users.find_one({"id": video.user_id})
-        if not user:
-            return 50.0  # Default score for new users
-        
-        user_obj = User(**user)
+        if context:
+            return context.user_score(video.user_id)
         
-        score = 50.0  # Base score
-        
-        # Verified user bonus
-        if user_obj.is_verified:
-            score += 15
-            
-        # Follower count bonus (logarithmic)
-        if user_obj.follower_count > 0:
-            follower_boost = min(math.log10(user_obj.follower_count + 1) * 5, 20)
-            score += follower_boost
-            
-        # Average engagement bonus
-        if user_obj.total_views > 0:
-            avg_engagement = user_obj.total_likes / user_obj.total_views
-            if avg_engagement > 0.05:  # 5% average engagement
-                score += 15
-                
-        return min(score, 100.0)
+        user = await self.db.users.find_one({"id": video.user_id}, REPUTATION_FIELDS)
+        return user_reputation_score(user)
     
-    async def calculate_composite_score(self, video: Video, competition_id: str) -> AlgorithmScore:
+    async def calculate_composite_score(self, video: Video, competition_id: str, context: Optional[ScoringContext] = None) -> AlgorithmScore:
         """Calculate final composite score for video"""
         
         # Get competition weights
-        competition = await self.db.competitions.find_one({"id": competition_id})
-        if not competition:
-            # Use default weights
-            view_weight = 0.4
-            like_weight = 0.2
-            comment_weight = 0.2
-            share_weight = 0.1
-            completion_weight = 0.1
+        if context:
+            weights = context.weights
         else:
-            view_weight = competition.get("view_weight", 0.4)
-            like_weight = competition.get("like_weight", 0.2)
-            comment_weight = competition.get("comment_weight", 0.2)  
-            share_weight = competition.get("share_weight", 0.1)
-            completion_weight = competition.get("completion_weight", 0.1)
+            competition = await self.db.competitions.find_one({"id": competition_id})
+            weights = competition_weights(competition)
+        view_weight = weights["view_weight"]
+        like_weight = weights["like_weight"]
+        comment_weight = weights["comment_weight"]
+        share_weight = weights["share_weight"]
+        completion_weight = weights["completion_weight"]
         
         # Calculate individual scores
         view_score = await self.calculate_view_score(video)
         engagement_score = await self.calculate_engagement_score(video)
-        recency_score = await self.calculate_recency_score(video)
+        recency_score = await self.calculate_recency_score(video, context)
         quality_score = await self.calculate_quality_score(video)
-        user_score = await self.calculate_user_score(video)
+        user_score = await self.calculate_user_score(video, context)
         
         # Calculate weighted total
         total_score = (
@@ -168,12 +544,23 @@ class VideoRecommendationEngine:
             total_score=min(total_score, 100.0)
         )
     
-    async def get_personalized_feed(self, user_id: Optional[str], limit: int = 10) -> List[Dict]:
+    async def calculate_batch_scores(self, video_docs: List[Dict], competition_id: str, context: Optional[ScoringContext] = None) -> Dict[str, np.ndarray]:
+        """Calculate composite scores for many videos in one vectorized pass"""
+        if context is None:
+            context = await self.build_scoring_context(competition_id, (doc["user_id"] for doc in video_docs))
+        
+        columns = build_metric_columns(video_docs)
+        return score_metric_columns(columns, context.weights, context.config, context.user_scores(video_docs))
+    
+    async def get_personalized_feed(self, user_id: Optional[str], limit: int = 10, config: Optional[AlgorithmConfig] = None) -> List[Dict]:
         """Get personalized video feed for user"""
-        config = await self.get_algorithm_config()
+        config = config or await self.get_algorithm_config()
         
         # Get current active competition
-        current_competition = await self.db.competitions.find_one({"status": "active"})
+        current_competition = await competition_cache.get_or_load(
+            ACTIVE_COMPETITION_KEY,
+            lambda: self.db.competitions.find_one({"status": "active"})
+        )
         if not current_competition:
             return []
         
@@ -189,56 +576,217 @@ class VideoRecommendationEngine:
             follows = await self.db.user_follows.find({"follower_id": user_id}).to_list(None)
             following_ids = [f["following_id"] for f in follows]
         
-        # Get active videos from current competition
+        # Only a bounded candidate set is loaded and scored
+        competition_id = current_competition["id"]
+        videos = await self.get_feed_candidates(current_competition, config, following_ids)
+        if not videos:
+            return []
+        
+        # Calculate scores for all candidates in one vectorized pass
+        context = await self.build_scoring_context(
+            competition_id,
+            (video["user_id"] for video in videos),
+            competition=current_competition,
+            config=config
+        )
+        scores = await self.calculate_batch_scores(videos, competition_id, context)
+        final_scores = scores["total_score"]
+        
+        # Apply personalization boosts
+        if user_preferences:
+            following = set(following_ids)
+            preferred_hashtags = set(user_preferences.preferred_hashtags)
+            skipped_hashtags = set(user_preferences.skipped_hashtags)
+            
+            # Boost for followed users
+            followed = np.array([video.get("user_id") in following for video in videos])
+            final_scores = np.where(followed, final_scores * config.follow_boost, final_scores)
+            
+            # Boost for preferred hashtags
+            preferred = np.array([not preferred_hashtags.isdisjoint(video.get("hashtags", [])) for video in videos])
+            final_scores = np.where(preferred, final_scores * config.hashtag_boost, final_scores)
+            
+            # Reduce for skipped hashtags
+            skipped = np.array([not skipped_hashtags.isdisjoint(video.get("hashtags", [])) for video in videos])
+            final_scores = np.where(skipped, final_scores * 0.5, final_scores)
+        
+        # Sort by score, keeping candidate order for ties
+        ranking = np.argsort(-final_scores, kind="stable")
+        
+        # Build feed items lazily, diversity rules only consume what they need
+        def scored_videos():
+            for index in ranking:
+                video = Video(**videos[index])
+                score = AlgorithmScore(
+                    video_id=video.id,
+                    competition_id=competition_id,
+                    **{name: float(values[index]) for name, values in scores.items()}
+                )
+                yield {
+                    "video": video.dict(exclude=PRIVATE_VIDEO_FIELDS),
+                    "score": float(final_scores[index]),
+                    "algorithm_data": score.dict()
+                }
+        
+        # Apply diversity rules
+        final_feed = self.apply_diversity_rules(scored_videos(), config, limit)
+        
+        return final_feed
+    
+    async def get_feed_candidates(self, competition: Dict, config: AlgorithmConfig, following_ids: List[str]) -> List[Dict]:
+        """Collect feed candidates: top precomputed scores, recent uploads and followed creators"""
+        competition_id = competition["id"]
         query = {
-            "competition_round": current_competition["id"],
+            "competition_round": competition_id,
             "status": "active",
             "is_paid": True
         }
         
-        videos = await self.db.videos.find(query).to_list(None)
+        score_docs = await self.get_top_scores(competition_id, config.candidate_pool_size)
+        recent_count = config.recent_candidate_count
+        if not score_docs:
+            # Index not built yet for this round; build it in the background
+            # and score a larger set of recent uploads meanwhile
+            self.schedule_index_build(competition_id, competition)
+            recent_count += config.candidate_pool_size
+        
+        top_ids = [score["video_id"] for score in score_docs]
+        top_query = self.db.videos.find({**query, "id": {"$in": top_ids}}).to_list(None)
+        recent_query = self.db.videos.find(query).sort("upload_date", -1).limit(recent_count).to_list(recent_count)
+        
+        if following_ids:
+            followed_query = self.db.videos.find({**query, "user_id": {"$in": following_ids}}).sort("upload_date", -1).limit(
+                config.follow_candidate_count
+            ).to_list(config.follow_candidate_count)
+            top_videos, recent_videos, followed_videos = await asyncio.gather(top_query, recent_query, followed_query)
+        else:
+            top_videos, recent_videos = await asyncio.gather(top_query, recent_query)
+            followed_videos = []
         
-        # Calculate scores for all videos
-        scored_videos = []
-        for video_data in videos:
-            video = Video(**video_data)
-            score = await self.calculate_composite_score(video, current_competition["id"])
-            
-            # Apply personalization boosts
-            final_score = score.total_score
-            
-            if user_preferences:
-                # Boost for followed users
-                if video.user_id in following_ids:
-                    final_score *= config.follow_boost
-                
-                # Boost for preferred hashtags
-                for hashtag in video.hashtags:
-                    if hashtag in user_preferences.preferred_hashtags:
-                        final_score *= config.hashtag_boost
-                        break
-                
-                # Reduce for skipped hashtags
-                for hashtag in video.hashtags:
-                    if hashtag in user_preferences.skipped_hashtags:
-                        final_score *= 0.5
-                        break
-            
-            scored_videos.append({
-                "video": video.dict(),
-                "score": final_score,
-                "algorithm_data": score.dict()
-            })
+        # Merge sources without duplicates, best precomputed scores first
+        top_map = {video["id"]: video for video in top_videos}
+        candidates = {video_id: top_map[video_id] for video_id in top_ids if video_id in top_map}
+        for video in recent_videos + followed_videos:
+            candidates.setdefault(video["id"], video)
         
-        # Sort by score
-        scored_videos.sort(key=lambda x: x["score"], reverse=True)
+        return list(candidates.values())
+    
+    def schedule_index_build(self, competition_id: str, competition: Optional[Dict] = None):
+        """Start building a round's score index unless a build is already running here"""
+        task = self._index_builds.get(competition_id)
+        if task is None or task.done():
+            self._index_builds[competition_id] = asyncio.create_task(self.build_score_index(competition_id, competition))
+    
+    async def build_score_index(self, competition_id: str, competition: Optional[Dict] = None):
+        """Build a missing score index, unless another worker is already building one"""
+        try:
+            if not await claim_lease(self.db, SCORE_INDEX_BUILD_LEASE, self.owner, SCORE_INDEX_BUILD_LEASE_SECONDS):
+                # Another worker is building it; requests here keep the fallback until this wakes
+                await asyncio.sleep(SCORE_INDEX_BUILD_RETRY_SECONDS)
+                return
+            try:
+                if not await self.get_top_scores(competition_id, 1):
+                    await self.refresh_score_index(competition_id, competition)
+            finally:
+                await release_lease(self.db, SCORE_INDEX_BUILD_LEASE, self.owner)
+        except Exception as e:
+            logger.error(f"Building score index of {competition_id} failed: {str(e)}")
+        finally:
+            self._index_builds.pop(competition_id, None)
+    
+    async def update_score_index(self, video_ids: List[str]):
+        """Rescore videos and refresh their entries in the score index"""
+        videos = await self.db.videos.find({"id": {"$in": list(video_ids)}}, SCORING_FIELDS).to_list(None)
+        
+        # Only active paid videos are ranked, drop entries of everything else
+        stale_ids = [video["id"] for video in videos if not is_scoreable(video)]
+        stale_ids += list(set(video_ids) - {video["id"] for video in videos})
+        if stale_ids:
+            await self.db.algorithm_scores.delete_many({"video_id": {"$in": stale_ids}})
+        
+        rounds = defaultdict(list)
+        for video in videos:
+            if is_scoreable(video):
+                rounds[video["competition_round"]].append(video)
+        
+        for competition_id, round_videos in rounds.items():
+            await self.write_scores(competition_id, round_videos)
+    
+    async def rescore_dirty(self):
+        """Bring the score index up to date with every video whose metrics changed since the last pass"""
+        if not self._dirty_scores:
+            return
+        video_ids, self._dirty_scores = list(self._dirty_scores), set()
+        try:
+            await self.update_score_index(video_ids)
+        except Exception:
+            self._dirty_scores.update(video_ids)
+            raise
+    
+    async def refresh_score_index(self, competition_id: str, competition: Optional[Dict] = None, batch_size: int = 1000):
+        """Recompute every score of a competition (periodic recency sweep)"""
+        if competition is None:
+            competition = await self.db.competitions.find_one({"id": competition_id})
         
-        # Apply diversity rules
-        final_feed = self.apply_diversity_rules(scored_videos, config, limit)
+        sweep_started = datetime.utcnow()
+        query = {
+            "competition_round": competition_id,
+            "status": "active",
+            "is_paid": True
+        }
         
-        return final_feed
+        batch = []
+        async for video in self.db.videos.find(query, SCORING_FIELDS).sort("id", 1):
+            batch.append(video)
+            if len(batch) >= batch_size:
+                await self.write_scores(competition_id, batch, competition)
+                batch = []
+        if batch:
+            await self.write_scores(competition_id, batch, competition)
+        
+        # Entries not touched by this sweep belong to videos that left the round
+        await self.db.algorithm_scores.delete_many({
+            "competition_id": competition_id,
+            "calculated_at": {"$lt": sweep_started}
+        })
     
-    def apply_diversity_rules(self, scored_videos: List[Dict], config: AlgorithmConfig, limit: int) -> List[Dict]:
+    async def write_scores(self, competition_id: str, video_docs: List[Dict], competition: Optional[Dict] = None):
+        """Score videos of one competition and upsert them into the score index"""
+        context = await self.build_scoring_context(
+            competition_id,
+            (video["user_id"] for video in video_docs),
+            competition=competition
+        )
+        scores = await self.calculate_batch_scores(video_docs, competition_id, context)
+        
+        now = datetime.utcnow()
+        operations = []
+        for index, video in enumerate(video_docs):
+            score = AlgorithmScore(
+                video_id=video["id"],
+                competition_id=competition_id,
+                calculated_at=now,
+                algorithm_version=context.config.version,
+                **{name: float(values[index]) for name, values in scores.items()}
+            ).dict()
+            score_id = score.pop("id")
+            operations.append(UpdateOne(
+                {"competition_id": competition_id, "video_id": video["id"]},
+                {"$set": score, "$setOnInsert": {"id": score_id}},
+                upsert=True
+            ))
+        
+        if operations:
+            await self.db.algorithm_scores.bulk_write(operations, ordered=False)
+    
+    async def get_top_scores(self, competition_id: str, limit: int) -> List[Dict]:
+        """Get the highest non-personalized scores of a competition"""
+        return await self.db.algorithm_scores.find(
+            {"competition_id": competition_id},
+            {"_id": 0}
+        ).sort("total_score", -1).limit(limit).to_list(limit)
+    
+    def apply_diversity_rules(self, scored_videos: Iterable[Dict], config: AlgorithmConfig, limit: int) -> List[Dict]:
         """Apply diversity rules to prevent feed from being too repetitive"""
         final_feed = []
         user_video_count = defaultdict(int)
@@ -276,99 +824,90 @@ class VideoRecommendationEngine:
     
     async def update_video_metrics(self, video_id: str, interaction_type: str, value: Optional[float] = None):
         """Update video metrics based on user interactions"""
-        
-        # Get current video
-        video_data = await self.db.videos.find_one({"id": video_id})
-        if not video_data:
+        interaction = VideoInteraction(video_id=video_id, interaction_type=interaction_type, value=value)
+        await self.apply_metric_updates(collect_metric_updates([interaction]))
+    
+    async def apply_metric_updates(self, updates: Dict[str, Dict]):
+        """Apply grouped metric updates for many videos in one bulk write"""
+        if not updates:
             return
         
-        update_data = {"last_updated": datetime.utcnow()}
-        
-        if interaction_type == "view":
-            update_data["view_count"] = video_data["view_count"] + 1
-        elif interaction_type == "like":
-            update_data["like_count"] = video_data["like_count"] + 1
-        elif interaction_type == "comment":
-            update_data["comment_count"] = video_data["comment_count"] + 1
-        elif interaction_type == "share":
-            update_data["share_count"] = video_data["share_count"] + 1
-        elif interaction_type == "watch_time" and value:
-            # Update completion and replay rates
-            if video_data.get("duration", 0) > 0:
-                completion_rate = min(value / video_data["duration"], 1.0)
-                if completion_rate > 1.0:  # User replayed
-                    replay_rate = completion_rate - 1.0
-                    update_data["replay_rate"] = (video_data.get("replay_rate", 0) + replay_rate) / 2
-                    update_data["completion_rate"] = 1.0
-                else:
-                    current_completion = video_data.get("completion_rate", 0)
-                    # Moving average of completion rates
-                    update_data["completion_rate"] = (current_completion + completion_rate) / 2
-        
-        # Update engagement rate
-        if any(key in update_data for key in ["like_count", "comment_count", "share_count"]):
-            total_engagements = (
-                video_data.get("like_count", 0) + 
-                video_data.get("comment_count", 0) + 
-                video_data.get("share_count", 0) * 2
-            )
-            if video_data.get("view_count", 0) > 0:
-                update_data["engagement_rate"] = total_engagements / video_data["view_count"]
-        
-        await self.db.videos.update_one({"id": video_id}, {"$set": update_data})
+        # Atomic server-side updates, no read-modify-write of the video document
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"id": video_id}, metric_update_pipeline(update["counts"], update["watch_times"], now))
+            for video_id, update in updates.items()
+        ]
+        await self.db.videos.bulk_write(operations, ordered=False)
+        
+        # Rescored off the interaction path by rescore_dirty
+        self._dirty_scores.update(updates)
     
     async def learn_user_preferences(self, user_id: str, video_id: str, interaction_type: str, value: Optional[float] = None):
         """Learn and update user preferences based on interactions"""
+        interaction = VideoInteraction(video_id=video_id, user_id=user_id, interaction_type=interaction_type, value=value)
+        await self.learn_user_preferences_batch([interaction])
+    
+    async def learn_user_preferences_batch(self, interactions: Iterable[VideoInteraction]):
+        """Learn preferences from many interactions with grouped reads and one bulk write"""
+        events = [
+            interaction for interaction in interactions
+            if interaction.user_id and interaction.interaction_type in PREFERENCE_INTERACTIONS
+        ]
+        if not events:
+            return
         
         # Get video data for learning
-        video_data = await self.db.videos.find_one({"id": video_id})
-        if not video_data:
-            return
+        video_ids = list({event.video_id for event in events})
+        videos = {
+            video["id"]: video
+            async for video in self.db.videos.find({"id": {"$in": video_ids}}, PREFERENCE_FIELDS)
+        }
         
-        video = Video(**video_data)
+        # Get existing user preferences
+        user_ids = list({event.user_id for event in events})
+        preferences = {
+            pref["user_id"]: UserPreference(**pref)
+            async for pref in self.db.user_preferences.find({"user_id": {"$in": user_ids}})
+        }
         
-        # Get or create user preferences
-        user_pref_data = await self.db.user_preferences.find_one({"user_id": user_id})
-        if user_pref_data:
-            user_pref = UserPreference(**user_pref_data)
-        else:
-            user_pref = UserPreference(user_id=user_id)
-        
-        # Update preferences based on positive interactions
-        if interaction_type in ["like", "comment", "share"]:
-            # Learn hashtag preferences
-            for hashtag in video.hashtags:
-                if hashtag not in user_pref.preferred_hashtags:
-                    user_pref.preferred_hashtags.append(hashtag)
-                    
-                # Remove from skipped if previously skipped
-                if hashtag in user_pref.skipped_hashtags:
-                    user_pref.skipped_hashtags.remove(hashtag)
+        # Replay events in order so moving averages match the per-event path
+        now = datetime.utcnow()
+        touched = {}
+        for event in events:
+            video = videos.get(event.video_id)
+            if not video:
+                continue
             
-            # Learn user preferences
-            if video.user_id not in user_pref.preferred_users:
-                user_pref.preferred_users.append(video.user_id)
-        
-        elif interaction_type == "watch_time" and value and video.duration:
-            # Learn duration preferences
-            if value / video.duration < 0.3:  # Watched less than 30%
-                # Add hashtags to skipped list
-                for hashtag in video.hashtags:
-                    if hashtag not in user_pref.skipped_hashtags:
-                        user_pref.skipped_hashtags.append(hashtag)
-            else:
-                # Update preferred duration (moving average)
-                if user_pref.preferred_duration:
-                    user_pref.preferred_duration = (user_pref.preferred_duration + video.duration) / 2
-                else:
-                    user_pref.preferred_duration = video.duration
-        
-        # Update timestamp
-        user_pref.updated_at = datetime.utcnow()
+            user_pref = preferences.setdefault(event.user_id, UserPreference(user_id=event.user_id))
+            apply_preference_interaction(user_pref, video, event.interaction_type, event.value)
+            user_pref.updated_at = now
+            touched[event.user_id] = user_pref
         
         # Save preferences
-        await self.db.user_preferences.replace_one(
-            {"user_id": user_id},
-            user_pref.dict(),
-            upsert=True
-        )
\ No newline at end of file
+        operations = [
+            ReplaceOne({"user_id": user_id}, user_pref.dict(), upsert=True)
+            for user_id, user_pref in touched.items()
+        ]
+        if operations:
+            await self.db.user_preferences.bulk_write(operations, ordered=False)
+    
+    async def ingest_interactions(self, interactions: List[VideoInteraction]):
+        """Store raw interactions and fan metric and preference updates out as grouped bulk writes"""
+        if not interactions:
+            return
+        
+        # Interactions are keyed on their id, so a replayed batch only applies what wasn't stored yet
+        try:
+            await self.db.video_interactions.insert_many([interaction.dict() for interaction in interactions], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            duplicates = {error["index"] for error in errors}
+            interactions = [interaction for index, interaction in enumerate(interactions) if index not in duplicates]
+            if not interactions:
+                return
+        
+        await self.apply_metric_updates(collect_metric_updates(interactions))
+        await self.learn_user_preferences_batch(interactions)
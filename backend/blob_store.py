@@ -0,0 +1,160 @@
+# Content-addressed Video Blob Store
+import asyncio
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from models import VideoBlob
+from storage import StorageBackend
+
+# How long a new reference waits for a blob being deleted to go
+BLOB_DELETE_WAIT_ATTEMPTS = 50
+BLOB_DELETE_WAIT_SECONDS = 0.1
+BLOB_STALE_DELETE_SECONDS = 600
+
+class StoredUpload:
+    """A video file streamed to disk"""
+
+    def __init__(
+        self,
+        filename: str,
+        file_path: Path,
+        file_size: int,
+        content_hash: str,
+        content_type: str,
+        storage_key: Optional[str] = None
+    ):
+        self.filename = filename
+        self.file_path = file_path
+        self.file_size = file_size
+        self.content_hash = content_hash
+        self.content_type = content_type
+        self.storage_key = storage_key
+
+async def discard_direct_upload(db, storage: StorageBackend, key: str):
+    """Delete a rejected or abandoned direct upload, unless a blob is stored at its key"""
+    if not await db.video_blobs.find_one({"storage_key": key}, {"_id": 1}):
+        await storage.delete(key)
+
+def blob_key(content_hash: str, suffix: str) -> str:
+    """Shard blobs by hash prefix to keep directories small"""
+    return f"videos/blobs/{content_hash[:2]}/{content_hash}{suffix}"
+
+def blob_storage_key(blob_doc: dict) -> str:
+    # Blobs recorded before storage keys existed live at the same layout on local disk
+    return blob_doc.get("storage_key") or blob_key(blob_doc["content_hash"], Path(blob_doc["file_path"]).suffix)
+
+async def add_blob_reference(db, storage: StorageBackend, upload: StoredUpload, candidate: str) -> dict:
+    """Count one more reference to a blob, creating its record at the candidate key if new"""
+    local_path = storage.local_path(candidate)
+    blob = VideoBlob(
+        content_hash=upload.content_hash,
+        storage_key=candidate,
+        file_path=str(local_path) if local_path else "",
+        file_size=upload.file_size,
+        content_type=upload.content_type
+    )
+
+    for _ in range(BLOB_DELETE_WAIT_ATTEMPTS):
+        try:
+            return await db.video_blobs.find_one_and_update(
+                {"content_hash": upload.content_hash, "deleting_at": None},
+                {
+                    "$inc": {"ref_count": 1},
+                    "$setOnInsert": blob.dict(exclude={"content_hash", "ref_count", "deleting_at"})
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The blob is being deleted; a new record can only be made once its object is gone.
+            # A tombstone left by a process that died mid-delete is cleared after a while.
+            await db.video_blobs.delete_one({
+                "content_hash": upload.content_hash,
+                "deleting_at": {"$lt": datetime.utcnow() - timedelta(seconds=BLOB_STALE_DELETE_SECONDS)}
+            })
+            await asyncio.sleep(BLOB_DELETE_WAIT_SECONDS)
+    raise RuntimeError(f"Blob {upload.content_hash} is still being deleted")
+
+def stored_blob(storage: StorageBackend, upload: StoredUpload, key: str) -> StoredUpload:
+    local_path = storage.local_path(key)
+    return StoredUpload(
+        Path(key).name,
+        local_path or "",
+        upload.file_size,
+        upload.content_hash,
+        upload.content_type,
+        storage_key=key
+    )
+
+async def store_blob(db, storage: StorageBackend, upload: StoredUpload) -> StoredUpload:
+    """Move an upload into the blob store, sharing the object with any identical upload"""
+    blob_doc = await add_blob_reference(db, storage, upload, blob_key(upload.content_hash, Path(upload.filename).suffix))
+    key = blob_storage_key(blob_doc)
+
+    # Skip the transfer when the object is already there; a concurrent first uploader
+    # that hasn't finished yet gets an identical copy written over it, which is harmless
+    if blob_doc["ref_count"] > 1 and await storage.stat(key):
+        os.remove(upload.file_path)
+    else:
+        await storage.put_file(key, Path(upload.file_path), upload.content_type)
+
+    return stored_blob(storage, upload, key)
+
+async def register_blob(db, storage: StorageBackend, upload: StoredUpload) -> StoredUpload:
+    """Move a verified direct upload from its staging key into the blob store, sharing any identical blob"""
+    blob_doc = await add_blob_reference(db, storage, upload, blob_key(upload.content_hash, Path(upload.filename).suffix))
+    key = blob_storage_key(blob_doc)
+
+    # Sessions created before staging keys existed uploaded straight to the blob key
+    if upload.storage_key != key:
+        if blob_doc["ref_count"] > 1 and await storage.stat(key):
+            await discard_direct_upload(db, storage, upload.storage_key)
+        else:
+            await storage.move(upload.storage_key, key)
+
+    return stored_blob(storage, upload, key)
+
+async def release_blob(db, storage: StorageBackend, storage_key: Optional[str] = None, file_path: Optional[str] = None) -> bool:
+    """Drop one reference to a video file, deleting it once nothing points at it"""
+    if storage_key:
+        blob_filter = {"storage_key": storage_key}
+    elif file_path:
+        blob_filter = {"file_path": file_path}
+    else:
+        return False
+
+    blob_doc = await db.video_blobs.find_one_and_update(
+        blob_filter,
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if blob_doc is None:
+        # Legacy file stored outside the blob store
+        if storage_key:
+            await storage.delete(storage_key)
+            return True
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            return True
+        return False
+
+    if blob_doc["ref_count"] > 0:
+        return False
+
+    # Only the caller that tombstones the record removes the object; new references
+    # wait for the record to go, so they never point at an object being deleted
+    result = await db.video_blobs.update_one(
+        {"content_hash": blob_doc["content_hash"], "ref_count": {"$lte": 0}, "deleting_at": None},
+        {"$set": {"deleting_at": datetime.utcnow()}}
+    )
+    if not result.modified_count:
+        return False
+    await storage.delete(blob_storage_key(blob_doc))
+    await db.video_blobs.delete_one({"content_hash": blob_doc["content_hash"], "deleting_at": {"$ne": None}})
+    return True
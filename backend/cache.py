@@ -0,0 +1,61 @@
+# Process-local TTL Cache
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+class TTLCache:
+    """Async-safe in-memory cache whose entries expire on their own"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._generation = 0
+
+    def _lookup(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value (None is a valid cached value)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl_seconds: Optional[float] = None) -> Any:
+        """Get a cached value, loading it once even when many coroutines miss together"""
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another coroutine may have loaded it while we waited
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            generation = self._generation
+            value = await loader()
+
+            # Don't store a value that was invalidated while loading
+            if generation == self._generation:
+                self.set(key, value, ttl_seconds)
+            return value
+
+    def invalidate(self, *keys: str):
+        """Drop the given keys, or every entry when called without keys"""
+        self._generation += 1
+        if not keys:
+            self._entries.clear()
+        for key in keys:
+            self._entries.pop(key, None)
+
+# Shared cache for the current competition round and active competition
+COMPETITION_CACHE_TTL_SECONDS = float(os.environ.get('COMPETITION_CACHE_TTL_SECONDS', '30'))
+competition_cache = TTLCache(COMPETITION_CACHE_TTL_SECONDS)
+
+CURRENT_ROUND_KEY = "current_round"
+ACTIVE_COMPETITION_KEY = "active_competition"
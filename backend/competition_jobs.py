@@ -0,0 +1,478 @@
+# Background Competition Finalization
+import asyncio
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pymongo import ReturnDocument, UpdateOne
+
+from models import AlgorithmConfig, CompetitionJob, FrozenInteraction, ScoreSnapshotEntry, VideoInteraction
+from algorithm import SCORING_FIELDS, build_metric_columns, competition_weights, score_metric_columns
+from cache import TTLCache, competition_cache, ACTIVE_COMPETITION_KEY
+from leases import claim_lease, release_lease
+
+logger = logging.getLogger(__name__)
+
+# Finalization settings
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', '2'))
+SCORING_BATCH_SIZE = int(os.environ.get('SCORING_BATCH_SIZE', '2000'))
+COMPETITION_JOB_POLL_SECONDS = float(os.environ.get('COMPETITION_JOB_POLL_SECONDS', '2'))
+COMPETITION_JOB_LEASE_SECONDS = 120
+COMPETITION_JOB_MAX_ATTEMPTS = 3
+COMPETITION_SNAPSHOT_DIR = Path(os.environ.get('COMPETITION_SNAPSHOT_DIR', str(Path(__file__).parent / "snapshots")))
+
+# Freeze settings: workers re-read the frozen rounds every FROZEN_ROUNDS_TTL_SECONDS,
+# and the snapshot waits FREEZE_SETTLE_SECONDS so writes already in flight land first
+FROZEN_ROUNDS_TTL_SECONDS = float(os.environ.get('FROZEN_ROUNDS_TTL_SECONDS', '2'))
+FREEZE_SETTLE_SECONDS = float(os.environ.get('FREEZE_SETTLE_SECONDS', '5'))
+REPLAY_BATCH_SIZE = 1000
+REPLAY_LEASE = {"type": "frozen_interaction_replay"}
+
+UNFINISHED_JOB_STATUSES = ["queued", "running"]
+METRIC_COLUMNS = tuple(build_metric_columns([]))
+
+frozen_rounds_cache = TTLCache(FROZEN_ROUNDS_TTL_SECONDS)
+FROZEN_ROUNDS_KEY = "frozen_rounds"
+
+def competition_video_filter(competition_id: str) -> Dict:
+    return {"competition_round": competition_id, "is_paid": True, "status": "active"}
+
+def job_status(job: CompetitionJob) -> Dict:
+    """Progress of a job as returned to admins"""
+    return {
+        "job_id": job.id,
+        "competition_id": job.competition_id,
+        "snapshot_id": job.snapshot_id,
+        "status": job.status,
+        "phase": job.phase,
+        "scored_videos": job.scored_videos,
+        "total_videos": job.total_videos,
+        "progress": round(job.scored_videos / job.total_videos, 4) if job.total_videos else (1.0 if job.status == "completed" else 0.0),
+        "replayed_interactions": job.replayed_interactions,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+# Freezing
+async def load_frozen_rounds(db) -> Set[str]:
+    competitions = await db.competitions.find(
+        {"frozen_at": {"$ne": None}, "status": {"$ne": "ended"}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    return {competition["id"] for competition in competitions}
+
+async def frozen_rounds(db) -> Set[str]:
+    return await frozen_rounds_cache.get_or_load(FROZEN_ROUNDS_KEY, lambda: load_frozen_rounds(db))
+
+async def freeze_competition(db, competition_id: str) -> datetime:
+    """Stop a competition's metrics from moving; returns the freeze time"""
+    now = datetime.utcnow()
+    competition = await db.competitions.find_one_and_update(
+        {"id": competition_id, "frozen_at": None},
+        {"$set": {"frozen_at": now}},
+        return_document=ReturnDocument.AFTER
+    ) or await db.competitions.find_one({"id": competition_id}, {"_id": 0, "frozen_at": 1})
+    frozen_rounds_cache.invalidate()
+    return competition["frozen_at"]
+
+async def unfreeze_competition(db, competition_id: str):
+    """Lift a freeze without closing; held interactions are replayed by the job runner"""
+    await db.competitions.update_one({"id": competition_id}, {"$set": {"frozen_at": None}})
+    frozen_rounds_cache.invalidate()
+
+async def hold_frozen_interactions(db, interactions: List[VideoInteraction]) -> List[VideoInteraction]:
+    """Set aside interactions on videos of frozen rounds and return the ones to apply now"""
+    rounds = await frozen_rounds(db)
+    if not rounds or not interactions:
+        return interactions
+
+    videos = await db.videos.find(
+        {"id": {"$in": list({interaction.video_id for interaction in interactions})}, "competition_round": {"$in": list(rounds)}},
+        {"_id": 0, "id": 1, "competition_round": 1}
+    ).to_list(None)
+    frozen_videos = {video["id"]: video["competition_round"] for video in videos}
+    if not frozen_videos:
+        return interactions
+
+    held = [
+        FrozenInteraction(**interaction.dict(), competition_id=frozen_videos[interaction.video_id]).dict()
+        for interaction in interactions
+        if interaction.video_id in frozen_videos
+    ]
+    await db.frozen_interactions.insert_many(held, ordered=False)
+    return [interaction for interaction in interactions if interaction.video_id not in frozen_videos]
+
+# Columnar metric snapshots
+def save_metric_snapshot(path: Path, arrays: Dict[str, np.ndarray], meta: Dict):
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp.npz")
+    try:
+        np.savez_compressed(tmp_path, meta=np.array(json.dumps(meta, default=str)), **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        raise
+
+def load_metric_snapshot(path: Path) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Columns and metadata (weights, config, freeze time) of a snapshot"""
+    with np.load(path, allow_pickle=False) as snapshot:
+        arrays = {name: snapshot[name] for name in snapshot.files if name != "meta"}
+        meta = json.loads(str(snapshot["meta"]))
+    return arrays, meta
+
+def score_metric_snapshot(path: Path) -> Dict[str, np.ndarray]:
+    """Recompute a competition's final scores from its snapshot alone, e.g. to audit a result offline"""
+    arrays, meta = load_metric_snapshot(path)
+    return score_metric_columns(
+        {name: arrays[name] for name in METRIC_COLUMNS},
+        meta["weights"],
+        AlgorithmConfig(**meta["config"]),
+        arrays["user_score"],
+        datetime.fromisoformat(meta["scored_at"])
+    )
+
+async def request_competition_end(db, competition_id: str, requested_by: Optional[str] = None) -> CompetitionJob:
+    """Freeze a competition and queue its finalization, or return the job already doing it"""
+    await freeze_competition(db, competition_id)
+
+    job = CompetitionJob(competition_id=competition_id, requested_by=requested_by)
+    job_doc = await db.competition_jobs.find_one_and_update(
+        {"competition_id": competition_id, "status": {"$in": UNFINISHED_JOB_STATUSES}},
+        {"$setOnInsert": job.dict(exclude={"competition_id"})},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return CompetitionJob(**job_doc)
+
+class CompetitionJobRunner:
+    """Runs competition finalization jobs from Mongo, resuming any a crashed process left behind.
+
+    The round is frozen, its metrics are written to a columnar snapshot, and the
+    snapshot is scored in batches across a process pool. Progress is saved after
+    every write, so a job picks up where it stopped.
+    """
+
+    def __init__(self, db, engine, workers: int = SCORING_WORKERS, batch_size: int = SCORING_BATCH_SIZE):
+        self.db = db
+        self.engine = engine
+        self.workers = workers
+        self.batch_size = batch_size
+        self.owner = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        """Stop the runner; a job in progress is released and resumed later"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def watch(self):
+        while True:
+            try:
+                job = await self.claim()
+                if job:
+                    await self.run(job)
+                    continue
+                await self.replay_unfrozen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Competition job runner failed: {str(e)}")
+            await asyncio.sleep(COMPETITION_JOB_POLL_SECONDS)
+
+    def lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=COMPETITION_JOB_LEASE_SECONDS)
+
+    async def claim(self) -> Optional[CompetitionJob]:
+        """Take a queued job, or a running one whose process stopped renewing its lease"""
+        now = datetime.utcnow()
+        job_doc = await self.db.competition_jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_until": {"$lt": now}}
+                ]
+            },
+            {"$set": {"status": "running", "lease_until": self.lease(), "started_at": now}, "$inc": {"attempts": 1}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return CompetitionJob(**job_doc) if job_doc else None
+
+    async def save(self, job: CompetitionJob, **fields):
+        """Persist progress and renew the lease"""
+        for name, value in fields.items():
+            setattr(job, name, value)
+        await self.db.competition_jobs.update_one(
+            {"id": job.id},
+            {"$set": {**fields, "lease_until": self.lease()}}
+        )
+
+    async def run(self, job: CompetitionJob):
+        try:
+            competition = await self.db.competitions.find_one({"id": job.competition_id})
+            if not competition:
+                raise RuntimeError("Competition not found")
+
+            if job.phase == "freezing":
+                await self.freeze(job)
+            config = AlgorithmConfig(**job.config)
+
+            # The snapshot lives on the disk of the process that wrote it; rebuild it elsewhere
+            if job.phase == "scoring" and not (job.snapshot_path and os.path.exists(job.snapshot_path)):
+                await self.save(job, phase="snapshot", scored_videos=0)
+            if job.phase == "snapshot":
+                await self.snapshot(job, competition, config)
+            if job.phase == "scoring":
+                await self.score(job, config)
+                await self.save(job, phase="ranking")
+            if job.phase == "ranking":
+                await self.rank(job)
+                await self.save(job, phase="finalizing")
+            if job.phase == "finalizing":
+                await self.finalize(job, competition)
+                await self.save(job, phase="replaying")
+
+            replayed = await self.replay(job.competition_id)
+            await self.db.competition_jobs.update_one(
+                {"id": job.id},
+                {
+                    "$set": {"status": "completed", "error": None, "lease_until": None, "finished_at": datetime.utcnow()},
+                    "$inc": {"replayed_interactions": replayed}
+                }
+            )
+
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so the next start resumes it
+            await self.db.competition_jobs.update_one(
+                {"id": job.id},
+                {"$set": {"status": "queued", "lease_until": None}, "$inc": {"attempts": -1}}
+            )
+            raise
+        except Exception as e:
+            logger.error(f"Finalizing competition {job.competition_id} failed (attempt {job.attempts}): {str(e)}")
+            retry = job.attempts < COMPETITION_JOB_MAX_ATTEMPTS
+            await self.db.competition_jobs.update_one(
+                {"id": job.id},
+                {
+                    "$set": {
+                        "status": "queued" if retry else "failed",
+                        "error": str(e),
+                        "lease_until": None,
+                        "finished_at": None if retry else datetime.utcnow()
+                    }
+                }
+            )
+            if not retry and job.phase not in ("finalizing", "replaying"):
+                # Don't hold interactions back forever; ending again re-freezes the round
+                await unfreeze_competition(self.db, job.competition_id)
+
+    async def freeze(self, job: CompetitionJob):
+        """Pin the freeze time and config, then let every worker stop writing to the round"""
+        frozen_at = await freeze_competition(self.db, job.competition_id)
+        config = await self.engine.get_algorithm_config()
+        await self.save(job, config=config.dict(), scored_at=frozen_at)
+        await asyncio.sleep(FREEZE_SETTLE_SECONDS)
+        await self.save(job, phase="snapshot")
+
+    async def snapshot(self, job: CompetitionJob, competition: Dict, config: AlgorithmConfig):
+        """Write the frozen metrics and creator scores of every video to a .npz file"""
+        parts = [build_metric_columns([])]
+        user_scores = [np.zeros(0)]
+        video_ids: List[str] = []
+        user_ids: List[str] = []
+
+        batch = []
+        cursor = self.db.videos.find(competition_video_filter(job.competition_id), SCORING_FIELDS).sort("id", 1).batch_size(self.batch_size)
+        async for video in cursor:
+            batch.append(video)
+            if len(batch) >= self.batch_size:
+                await self.add_snapshot_batch(job, competition, config, batch, parts, user_scores, video_ids, user_ids)
+                batch = []
+        if batch:
+            await self.add_snapshot_batch(job, competition, config, batch, parts, user_scores, video_ids, user_ids)
+
+        arrays = {name: np.concatenate([part[name] for part in parts]) for name in METRIC_COLUMNS}
+        arrays["user_score"] = np.concatenate(user_scores)
+        arrays["video_id"] = np.array(video_ids, dtype=str)
+        arrays["user_id"] = np.array(user_ids, dtype=str)
+        meta = {
+            "competition_id": job.competition_id,
+            "snapshot_id": job.snapshot_id,
+            "scored_at": job.scored_at.isoformat(),
+            "weights": competition_weights(competition),
+            "config": job.config
+        }
+
+        path = COMPETITION_SNAPSHOT_DIR / f"{job.snapshot_id}.npz"
+        await asyncio.to_thread(save_metric_snapshot, path, arrays, meta)
+        await self.save(job, phase="scoring", snapshot_path=str(path), total_videos=len(video_ids), scored_videos=0)
+
+    async def add_snapshot_batch(self, job, competition, config, batch, parts, user_scores, video_ids, user_ids):
+        context = await self.engine.build_scoring_context(
+            job.competition_id,
+            (video["user_id"] for video in batch),
+            competition=competition,
+            config=config
+        )
+        parts.append(build_metric_columns(batch))
+        user_scores.append(context.user_scores(batch))
+        video_ids.extend(video["id"] for video in batch)
+        user_ids.extend(video["user_id"] for video in batch)
+        await self.save(job)
+
+    async def score(self, job: CompetitionJob, config: AlgorithmConfig):
+        """Score the snapshot from the saved row onwards, several batches at a time in worker processes"""
+        arrays, meta = await asyncio.to_thread(load_metric_snapshot, Path(job.snapshot_path))
+        total = len(arrays["video_id"])
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+
+        start = job.scored_videos
+        while start < total:
+            ranges = [
+                (batch_start, min(batch_start + self.batch_size, total))
+                for batch_start in range(start, min(start + self.batch_size * self.workers, total), self.batch_size)
+            ]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self._pool,
+                    score_metric_columns,
+                    {name: arrays[name][batch_start:batch_stop] for name in METRIC_COLUMNS},
+                    meta["weights"],
+                    config,
+                    arrays["user_score"][batch_start:batch_stop],
+                    job.scored_at
+                )
+                for batch_start, batch_stop in ranges
+            ))
+
+            operations = []
+            for (batch_start, _), scores in zip(ranges, results):
+                for index in range(len(scores["total_score"])):
+                    row = batch_start + index
+                    entry = ScoreSnapshotEntry(
+                        snapshot_id=job.snapshot_id,
+                        video_id=str(arrays["video_id"][row]),
+                        competition_id=job.competition_id,
+                        user_id=str(arrays["user_id"][row]),
+                        view_count=int(arrays["view_count"][row]),
+                        calculated_at=job.scored_at,
+                        algorithm_version=config.version,
+                        **{name: float(values[index]) for name, values in scores.items()}
+                    ).dict()
+                    entry_id = entry.pop("id")
+                    # Upserts keep a re-scored batch from duplicating entries after a resume
+                    operations.append(UpdateOne(
+                        {"snapshot_id": job.snapshot_id, "video_id": entry["video_id"]},
+                        {"$set": entry, "$setOnInsert": {"id": entry_id}},
+                        upsert=True
+                    ))
+            await self.db.algorithm_score_snapshots.bulk_write(operations, ordered=False)
+
+            start = ranges[-1][1]
+            await self.save(job, scored_videos=start)
+
+    async def rank(self, job: CompetitionJob):
+        """Number the snapshot by score; ties go to the lower video id so reruns agree"""
+        operations = []
+        rank = 0
+        async for entry in self.db.algorithm_score_snapshots.find(
+            {"snapshot_id": job.snapshot_id},
+            {"_id": 0, "video_id": 1}
+        ).sort([("total_score", -1), ("video_id", 1)]):
+            rank += 1
+            operations.append(UpdateOne(
+                {"snapshot_id": job.snapshot_id, "video_id": entry["video_id"]},
+                {"$set": {"rank_position": rank}}
+            ))
+            if len(operations) >= self.batch_size:
+                await self.db.algorithm_score_snapshots.bulk_write(operations, ordered=False)
+                await self.save(job)
+                operations = []
+        if operations:
+            await self.db.algorithm_score_snapshots.bulk_write(operations, ordered=False)
+
+    async def finalize(self, job: CompetitionJob, competition: Dict):
+        """Copy the winners into the competition and close it, which lifts the freeze"""
+        winner_count = competition.get("winner_count", 1000)
+        special_winner_count = competition.get("special_winner_count", 10)
+        winners = []
+        async for entry in self.db.algorithm_score_snapshots.find(
+            {"snapshot_id": job.snapshot_id, "rank_position": {"$gte": 1, "$lte": winner_count}},
+            {"_id": 0, "video_id": 1, "user_id": 1, "total_score": 1, "rank_position": 1}
+        ).sort("rank_position", 1):
+            winners.append({
+                "rank": entry["rank_position"],
+                "video_id": entry["video_id"],
+                "user_id": entry["user_id"],
+                "score": entry["total_score"],
+                "is_special_winner": entry["rank_position"] <= special_winner_count
+            })
+
+        await self.db.competitions.update_one(
+            {"id": job.competition_id},
+            {
+                "$set": {
+                    "status": "ended",
+                    "end_date": job.scored_at,
+                    "winners": winners,
+                    "snapshot_id": job.snapshot_id
+                }
+            }
+        )
+        competition_cache.invalidate(ACTIVE_COMPETITION_KEY)
+        frozen_rounds_cache.invalidate()
+
+    async def replay(self, competition_id: str) -> int:
+        """Apply interactions held back during the freeze, oldest first"""
+        replayed = 0
+        while True:
+            held = await self.db.frozen_interactions.find(
+                {"competition_id": competition_id},
+                {"_id": 0}
+            ).sort("created_at", 1).limit(REPLAY_BATCH_SIZE).to_list(REPLAY_BATCH_SIZE)
+            if not held:
+                await self.engine.rescore_dirty()
+                return replayed
+
+            # Ingesting is keyed on interaction ids, so a batch replayed again after a
+            # crash before the delete isn't counted twice
+            interactions = [VideoInteraction(**FrozenInteraction(**doc).dict(exclude={"competition_id"})) for doc in held]
+            await self.engine.ingest_interactions(interactions)
+            await self.db.frozen_interactions.delete_many({"id": {"$in": [doc["id"] for doc in held]}})
+            replayed += len(held)
+
+    async def replay_unfrozen(self):
+        """Replay interactions workers held back just after a freeze was lifted, one worker at a time"""
+        held = await self.db.frozen_interactions.find_one({}, {"_id": 0, "competition_id": 1})
+        if not held or held["competition_id"] in await load_frozen_rounds(self.db):
+            return
+        if not await claim_lease(self.db, REPLAY_LEASE, self.owner, COMPETITION_JOB_LEASE_SECONDS):
+            return
+        try:
+            await self.replay(held["competition_id"])
+        finally:
+            await release_lease(self.db, REPLAY_LEASE, self.owner)
@@ -0,0 +1,212 @@
+# MongoDB Index Declarations
+import logging
+import os
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Retention settings; TTL indexes delete documents this long after the indexed date
+PROMPTPAY_SESSION_RETENTION_SECONDS = int(os.environ.get('PROMPTPAY_SESSION_RETENTION_SECONDS', str(24 * 3600)))
+STALE_PAYMENT_SESSION_SECONDS = int(os.environ.get('STALE_PAYMENT_SESSION_SECONDS', str(7 * 24 * 3600)))
+
+INDEX_OPTIONS_CONFLICT = 85
+
+# Indexes every collection needs, shaped after the queries that hit it: equality
+# fields first, then the sort, then range filters. Names are left to MongoDB's
+# defaults so indexes already created by mongo-init.js are recognised.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], sparse=True),
+        IndexModel([("phone", ASCENDING)], sparse=True),
+        IndexModel([("google_id", ASCENDING)], sparse=True),
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("last_active", DESCENDING)]),
+    ],
+    "videos": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # /videos, /leaderboard: round's paid videos by views
+        IndexModel([("competition_round", ASCENDING), ("is_paid", ASCENDING), ("view_count", DESCENDING), ("filename", ASCENDING)]),
+        # Feed candidates: recent uploads of the active round
+        IndexModel([("competition_round", ASCENDING), ("status", ASCENDING), ("is_paid", ASCENDING), ("upload_date", DESCENDING)]),
+        # Score sweeps and finalization walk a round in id order
+        IndexModel([("competition_round", ASCENDING), ("status", ASCENDING), ("is_paid", ASCENDING), ("id", ASCENDING)]),
+        # Leaderboard materialization: videos of a round updated since the last scan
+        IndexModel([("competition_round", ASCENDING), ("is_paid", ASCENDING), ("last_updated", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("competition_round", ASCENDING)]),
+        IndexModel([("upload_date", DESCENDING)]),
+    ],
+    "leaderboard_entries": [
+        IndexModel([("round_id", ASCENDING), ("video_id", ASCENDING)], unique=True),
+        IndexModel([("round_id", ASCENDING), ("seq", ASCENDING)]),
+        IndexModel([("video_id", ASCENDING)]),
+    ],
+    "video_interactions": [
+        # Replays of held interactions insert each one at most once
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("video_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "frozen_interactions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("competition_id", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "user_follows": [
+        IndexModel([("follower_id", ASCENDING), ("following_id", ASCENDING)]),
+    ],
+    "user_preferences": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "phone_otps": [
+        IndexModel([("phone", ASCENDING), ("otp_code", ASCENDING), ("is_used", ASCENDING), ("expires_at", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "algorithm_scores": [
+        IndexModel([("competition_id", ASCENDING), ("video_id", ASCENDING)], unique=True),
+        IndexModel([("competition_id", ASCENDING), ("total_score", DESCENDING)]),
+        IndexModel([("competition_id", ASCENDING), ("calculated_at", ASCENDING)]),
+        IndexModel([("video_id", ASCENDING)]),
+    ],
+    "algorithm_score_snapshots": [
+        IndexModel([("snapshot_id", ASCENDING), ("video_id", ASCENDING)], unique=True),
+        IndexModel([("snapshot_id", ASCENDING), ("total_score", DESCENDING), ("video_id", ASCENDING)]),
+        IndexModel([("snapshot_id", ASCENDING), ("rank_position", ASCENDING)]),
+    ],
+    "algorithm_configs": [
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "competitions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "competition_rounds": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("start_date", ASCENDING), ("end_date", ASCENDING)]),
+        # One active round per start date, however many workers create it at once
+        IndexModel([("start_date", ASCENDING)], unique=True, partialFilterExpression={"is_active": True}),
+    ],
+    "competition_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("competition_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "credit_transactions": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "payment_sessions": [
+        IndexModel([("session_id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        # Checkouts that were never paid; paid ones are archived instead
+        IndexModel(
+            [("created_at", ASCENDING)],
+            expireAfterSeconds=STALE_PAYMENT_SESSION_SECONDS,
+            partialFilterExpression={"status": {"$in": ["initiated", "unpaid"]}}
+        ),
+    ],
+    "promptpay_sessions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        # Kept past expiry for a while so status checks still answer "expired"
+        IndexModel(
+            [("expires_at", ASCENDING)],
+            expireAfterSeconds=PROMPTPAY_SESSION_RETENTION_SECONDS,
+            partialFilterExpression={"status": {"$in": ["pending", "expired"]}}
+        ),
+    ],
+    "upload_sessions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)]),
+        IndexModel([("storage_key", ASCENDING), ("expires_at", ASCENDING)], sparse=True),
+    ],
+    "video_blobs": [
+        IndexModel([("content_hash", ASCENDING)], unique=True),
+        IndexModel([("storage_key", ASCENDING)], sparse=True),
+        IndexModel([("file_path", ASCENDING)], sparse=True),
+    ],
+    "media_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+    ],
+    "admin_users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)]),
+    ],
+    "admin_logs": [
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("action", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("target_type", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "system_settings": [
+        IndexModel([("type", ASCENDING)], unique=True),
+    ],
+}
+
+def index_name(index: IndexModel) -> str:
+    return index.document["name"]
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create missing indexes; existing ones are left alone, so this is safe on every start"""
+    failed: Dict[str, List[str]] = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        # One at a time, so a conflict with an existing index doesn't stop the rest
+        for index in indexes:
+            try:
+                try:
+                    await collection.create_indexes([index])
+                except OperationFailure as e:
+                    if e.code != INDEX_OPTIONS_CONFLICT or "expireAfterSeconds" not in index.document:
+                        raise
+                    # A changed retention setting: update the TTL in place instead of rebuilding
+                    await db.command({
+                        "collMod": collection_name,
+                        "index": {"name": index_name(index), "expireAfterSeconds": index.document["expireAfterSeconds"]}
+                    })
+            except OperationFailure as e:
+                logger.error(f"Creating index {collection_name}.{index_name(index)} failed: {str(e)}")
+                failed.setdefault(collection_name, []).append(index_name(index))
+    return failed
+
+async def index_report(db) -> Dict[str, Dict[str, List[str]]]:
+    """Declared indexes that are missing, and existing ones never used since the server started"""
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = [index["name"] async for index in collection.list_indexes()]
+        declared = {index_name(index) for index in indexes}
+
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+            unused = sorted(
+                stat["name"] for stat in stats
+                if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0
+            )
+        except OperationFailure:
+            unused = []  # $indexStats needs the indexStats privilege
+
+        entry = {
+            "missing": sorted(declared - set(existing)),
+            "undeclared": sorted(set(existing) - declared - {"_id_"}),
+            "unused": unused
+        }
+        if any(entry.values()):
+            report[collection_name] = entry
+    return report
+
+async def check_indexes(db):
+    """Ensure indexes at startup and log what still doesn't match the declarations"""
+    await ensure_indexes(db)
+    for collection_name, entry in (await index_report(db)).items():
+        if entry["missing"]:
+            logger.warning(f"Missing indexes on {collection_name}: {', '.join(entry['missing'])}")
+        if entry["undeclared"]:
+            logger.info(f"Undeclared indexes on {collection_name}: {', '.join(entry['undeclared'])}")
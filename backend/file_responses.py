@@ -0,0 +1,253 @@
+# Conditional and Range File Responses
+import os
+import stat
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+def file_etag(stat_result: os.stat_result, content_hash: Optional[str] = None) -> str:
+    """Strong ETag from the content hash, or from size and mtime for files without one"""
+    if content_hash:
+        return f'"{content_hash}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Check an If-None-Match / If-Range style header against an ETag"""
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single byte range into inclusive (start, end); None means serve the whole file"""
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        # Multiple ranges are allowed to be answered with the full representation
+        return None
+
+    start_text, sep, end_text = ranges.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if start_text == "":
+            # Suffix range: the last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+            if start < 0 or (end_text and end < start):
+                return None
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+class RangeFileResponse(Response):
+    """Send a byte range of a file, zero-copy when the server offers the extension"""
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_header_only: bool = False
+    ):
+        self.path = path
+        self.start = start
+        self.length = max(end - start + 1, 0)
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_header_only = send_header_only
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if self.send_header_only or not self.length:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            # Let the server hand the file to sendfile(2)
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": bool(remaining)})
+            if remaining:
+                # File shrank underneath us; end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def evaluate_conditions(
+    request: Request,
+    size: int,
+    etag: str,
+    modified: datetime,
+    headers: dict
+) -> Tuple[Optional[Response], Optional[Tuple[int, int]]]:
+    """Apply conditional and Range headers: a 304 response to send, or the byte range to serve"""
+    last_modified = formatdate(modified.timestamp(), usegmt=True)
+    headers.update({"accept-ranges": "bytes", "etag": etag, "last-modified": last_modified})
+
+    # Conditional GET: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers=headers), None
+    else:
+        if_modified_since = parse_http_date(request.headers.get("if-modified-since", ""))
+        if if_modified_since and modified.replace(microsecond=0) <= if_modified_since:
+            return Response(status_code=304, headers=headers), None
+
+    # Range, only while the client's copy is still current
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and size:
+        if_range = request.headers.get("if-range")
+        if if_range is None or etag_matches(if_range, etag, weak=False) or if_range.strip() == last_modified:
+            byte_range = parse_range(range_header, size)
+
+    if byte_range:
+        headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+    return None, byte_range
+
+async def conditional_file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    content_hash: Optional[str] = None,
+    filename: Optional[str] = None,
+    extra_headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    """Serve a file honoring If-None-Match, If-Modified-Since, Range and If-Range"""
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video file not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Video file not found")
+
+    size = stat_result.st_size
+    headers = dict(extra_headers or {})
+    if filename:
+        headers["content-disposition"] = f'inline; filename="{filename}"'
+
+    not_modified, byte_range = evaluate_conditions(
+        request, size, file_etag(stat_result, content_hash),
+        datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc), headers
+    )
+    if not_modified:
+        return not_modified
+
+    send_header_only = request.method == "HEAD"
+    if byte_range is None:
+        return RangeFileResponse(path, 0, size - 1, 200, headers, media_type, send_header_only)
+
+    start, end = byte_range
+    return RangeFileResponse(path, start, end, 206, headers, media_type, send_header_only)
+
+async def storage_object_response(
+    request: Request,
+    storage,
+    key: str,
+    media_type: str,
+    content_hash: Optional[str] = None,
+    filename: Optional[str] = None,
+    extra_headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    """Proxy a stored object through the API with the same conditional and Range handling"""
+    stored = await storage.stat(key)
+    if not stored:
+        raise HTTPException(status_code=404, detail="Video file not found")
+
+    headers = dict(extra_headers or {})
+    if filename:
+        headers["content-disposition"] = f'inline; filename="{filename}"'
+
+    etag = f'"{content_hash}"' if content_hash else (stored.etag or f'"{stored.size:x}"')
+    modified = stored.last_modified or datetime.fromtimestamp(0, tz=timezone.utc)
+    not_modified, byte_range = evaluate_conditions(request, stored.size, etag, modified, headers)
+    if not_modified:
+        return not_modified
+
+    start, end = byte_range or (0, stored.size - 1)
+    headers["content-length"] = str(max(end - start + 1, 0))
+    status_code = 206 if byte_range else 200
+
+    if request.method == "HEAD" or not stored.size:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(storage.get_range(key, start, end), status_code=status_code, headers=headers, media_type=media_type)
+
+def accel_redirect_response(
+    path: Path,
+    root: Path,
+    prefix: str,
+    media_type: str,
+    filename: Optional[str] = None
+) -> Optional[Response]:
+    """Hand a file under root off to an internal nginx location, or None if it lives elsewhere"""
+    try:
+        relative = Path(os.path.abspath(path)).relative_to(os.path.abspath(root))
+    except ValueError:
+        return None
+
+    headers = {"x-accel-redirect": f"{prefix.rstrip('/')}/{quote(relative.as_posix())}"}
+    if filename:
+        headers["content-disposition"] = f'inline; filename="{filename}"'
+
+    # nginx serves the bytes, ranges and conditional requests itself
+    return Response(headers=headers, media_type=media_type)
@@ -0,0 +1,140 @@
+# Write-behind Interaction Buffer
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from models import VideoInteraction
+from algorithm import collect_metric_updates
+from competition_jobs import hold_frozen_interactions
+
+logger = logging.getLogger(__name__)
+
+class InteractionBuffer:
+    """Queues interaction events in memory and writes them behind in bulk"""
+
+    def __init__(
+        self,
+        db,
+        engine,
+        flush_interval_seconds: float = 0.25,
+        max_batch_events: int = 500,
+        max_pending_events: int = 10000
+    ):
+        self.db = db
+        self.engine = engine
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_batch_events = max_batch_events
+        self.max_pending_events = max_pending_events
+
+        self._events: List[VideoInteraction] = []
+        self.dropped_events = 0  # Lost because the buffer stayed full while writes failed
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._flush_listeners: List[Callable[[Dict[str, Dict[str, int]]], Awaitable[None]]] = []
+        self._task = None
+        self._stopping = False
+
+    @property
+    def pending_events(self) -> int:
+        return len(self._events)
+
+    def add_flush_listener(self, listener: Callable[[Dict[str, Dict[str, int]]], Awaitable[None]]):
+        """Register a coroutine called with the per-video counter deltas of every flush"""
+        self._flush_listeners.append(listener)
+
+    async def add(self, interaction: VideoInteraction):
+        """Queue an interaction, waiting for a flush when the buffer is full"""
+        # Backpressure: callers wait for the writer instead of growing memory without bound
+        while len(self._events) >= self.max_pending_events:
+            await self.flush()
+            if len(self._events) >= self.max_pending_events:
+                # Writes are failing; wait instead of retrying in a tight loop
+                await asyncio.sleep(self.flush_interval_seconds)
+
+        self._events.append(interaction)
+
+        if len(self._events) >= self.max_batch_events:
+            self._wake.set()
+
+    async def flush(self):
+        """Write all queued interactions and their coalesced metric deltas"""
+        async with self._flush_lock:
+            if not self._events:
+                return
+
+            events, self._events = self._events, []
+            written = 0
+            for batch in self.batches(events):
+                try:
+                    await self.write_batch(batch)
+                except Exception as e:
+                    # Keep the unwritten events for the next flush; the database is likely unavailable
+                    self.requeue(events[written:])
+                    logger.warning(f"Interaction flush failed, {len(events) - written} events requeued: {str(e)}")
+                    return
+                written += len(batch)
+
+    def requeue(self, events: List[VideoInteraction]):
+        """Put unwritten events back at the front, dropping the newest past the pending limit"""
+        events = events + self._events
+        self._events = events[:self.max_pending_events]
+        dropped = len(events) - len(self._events)
+        if dropped:
+            self.dropped_events += dropped
+            logger.error(f"Interaction buffer full, dropped {dropped} events")
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending_events": self.pending_events, "dropped_events": self.dropped_events}
+
+    def batches(self, events: List[VideoInteraction]) -> List[List[VideoInteraction]]:
+        """Split events into bulk writes of at most max_batch_events"""
+        return [events[start:start + self.max_batch_events] for start in range(0, len(events), self.max_batch_events)]
+
+    async def write(self, events: List[VideoInteraction]):
+        """Write interactions straight through, in batches of at most max_batch_events"""
+        for batch in self.batches(events):
+            await self.write_batch(batch)
+
+    async def write_batch(self, events: List[VideoInteraction]):
+        """Write one batch of interactions and notify flush listeners"""
+        # Rounds being closed keep their metrics still; their interactions are replayed once closed
+        events = await hold_frozen_interactions(self.db, events)
+        if not events:
+            return
+
+        updates = collect_metric_updates(events)
+        counter_deltas = {video_id: dict(update["counts"]) for video_id, update in updates.items() if update["counts"]}
+
+        # Raw events, metrics and preferences as grouped bulk writes
+        await self.engine.ingest_interactions(events)
+
+        for listener in self._flush_listeners:
+            try:
+                await listener(counter_deltas)
+            except Exception as e:
+                logger.error(f"Interaction flush listener failed: {str(e)}")
+
+    async def run(self):
+        """Flush every flush interval, or sooner once a batch fills up"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background writer and flush whatever is still queued"""
+        # Let an in-flight flush finish rather than cancelling it halfway
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
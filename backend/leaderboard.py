@@ -0,0 +1,384 @@
+# Materialized Competition Leaderboard
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from algorithm import COUNTER_FIELDS
+from leases import claim_lease
+from ranking import RoundRanking
+
+logger = logging.getLogger(__name__)
+
+# Leaderboard settings
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '1000'))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '15'))
+LEADERBOARD_PAGE_CACHE_SIZE = 64
+LEADERBOARD_LEASE_SECONDS = LEADERBOARD_REFRESH_SECONDS * 3
+# Overlap between the leader's scans, covering clock drift between app servers
+LEADERBOARD_CLOCK_SKEW_SECONDS = 30
+# Leader lease, materialized round, last sequence number and scan watermark
+LEADERBOARD_STATE = {"type": "leaderboard_materializer"}
+
+# Public fields kept per entry; file locations and algorithm internals stay out,
+# and view counts come from the live ranking
+LEADERBOARD_FIELDS = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "description": 1,
+    "hashtags": 1,
+    "user_id": 1,
+    "thumbnail_url": 1,
+    "duration": 1,
+    "like_count": 1,
+    "comment_count": 1,
+    "share_count": 1,
+    "upload_date": 1,
+    "published_at": 1
+}
+RANKING_FIELDS = {"_id": 0, "id": 1, "view_count": 1, "upload_date": 1}
+ENTRY_FIELDS = {"_id": 0, "video_id": 1, "view_count": 1, "upload_date": 1, "removed": 1}
+
+def leaderboard_filter(round_id: str) -> Dict:
+    return {"competition_round": round_id, "is_paid": True, "filename": {"$ne": ""}}
+
+def entry_values(video: Optional[Dict]) -> Optional[Dict]:
+    if video is None:
+        return None
+    return {"view_count": video.get("view_count", 0), "upload_date": video.get("upload_date")}
+
+async def remove_from_leaderboard(db, video_ids: List[str]):
+    """Mark entries of deleted videos for the leader to publish with its next sequence"""
+    await db.leaderboard_entries.update_many(
+        {"video_id": {"$in": video_ids}},
+        {"$set": {"removed": True, "seq": None}}
+    )
+
+def encode_json(value) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+class Leaderboard:
+    """Live ranking of one round plus details of its top videos, with encoded pages cached per version"""
+
+    def __init__(self, round_id: str, ranking: RoundRanking, details: Dict[str, Dict], competition_info: Dict, version: int, token: str, seq: int = 0):
+        self.round_id = round_id
+        self.ranking = ranking
+        self.details = details
+        self.competition_info = competition_info
+        self.version = version
+        self.seq = seq  # Last materialized sequence applied
+        self._token = token
+        self._pages: Dict[Tuple[int, int], bytes] = {}
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.round_id[:8]}-{self._token}-{self.version}"'
+
+    def touch(self):
+        """Start a new version after the ranking or details changed"""
+        self.version += 1
+        self._pages.clear()
+
+    def rank_of(self, video_id: str) -> Optional[Dict]:
+        """Rank of one video and the views it needs to move up a place"""
+        rank = self.ranking.rank(video_id)
+        if rank is None:
+            return None
+        view_count = self.ranking.view_count(video_id)
+        return {
+            "video_id": video_id,
+            "round_id": self.round_id,
+            "rank": rank,
+            "view_count": view_count,
+            "total": len(self.ranking),
+            "views_to_next_rank": self.ranking.at(rank - 1)[1] - view_count + 1 if rank > 1 else 0
+        }
+
+    def cached_page(self, offset: int, limit: int) -> Optional[bytes]:
+        return self._pages.get((offset, limit))
+
+    def encode_page(self, offset: int, limit: int, video_ids: List[str], details: Dict[str, Dict], cache: bool = True) -> bytes:
+        """JSON body of one page, cached until the next version"""
+        entries = [
+            {**details[video_id], "view_count": self.ranking.view_count(video_id), "rank": offset + index + 1}
+            for index, video_id in enumerate(video_ids)
+            if video_id in details
+        ]
+        body = json.dumps(
+            {
+                "leaderboard": entries,
+                "competition_info": self.competition_info,
+                "offset": offset,
+                "limit": limit,
+                "total": len(self.ranking)
+            },
+            default=encode_json
+        ).encode()
+        if cache:
+            if len(self._pages) >= LEADERBOARD_PAGE_CACHE_SIZE:
+                self._pages.clear()
+            self._pages[(offset, limit)] = body
+        return body
+
+class LeaderboardMaterializer:
+    """Keeps the current round's ranking and top video details in memory.
+
+    One worker at a time holds the leader lease and materializes the round into
+    leaderboard_entries, copying over videos updated since its last scan and
+    stamping each batch with a sequence number. Every worker then applies the
+    entries newer than the sequence it has seen; the round is read in full
+    only on a cold start or after the round changes. Interaction flush deltas
+    are applied locally as they happen.
+    """
+
+    def __init__(
+        self,
+        db,
+        round_provider: Callable[[], Awaitable[str]],
+        size: int = LEADERBOARD_SIZE,
+        refresh_interval_seconds: float = LEADERBOARD_REFRESH_SECONDS
+    ):
+        self.db = db
+        self.round_provider = round_provider
+        self.size = size
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.board: Optional[Leaderboard] = None
+        self.owner = uuid.uuid4().hex
+        self._token = uuid.uuid4().hex[:8]  # Keeps ETags from different processes apart
+        self._version = 0
+        self._refresh_lock = asyncio.Lock()
+
+    async def current(self) -> Leaderboard:
+        """Leaderboard of the current round, loading it on first use or after the round changes"""
+        round_id = await self.round_provider()
+        board = self.board
+        if board is None or board.round_id != round_id:
+            async with self._refresh_lock:
+                board = self.board
+                if board is None or board.round_id != round_id:
+                    board = await self.refresh(round_id)
+        return board
+
+    async def fetch_details(self, board: Leaderboard, video_ids: List[str]) -> Dict[str, Dict]:
+        """Details of ranked videos; deleted ones are dropped from the ranking on the way"""
+        if not video_ids:
+            return {}
+        videos = await self.db.videos.find({"id": {"$in": video_ids}}, LEADERBOARD_FIELDS).to_list(None)
+        details = {video["id"]: video for video in videos}
+        deleted = [video_id for video_id in video_ids if video_id not in details]
+        if deleted:
+            for video_id in deleted:
+                board.ranking.remove(video_id)
+            board.touch()
+            await remove_from_leaderboard(self.db, deleted)
+        return details
+
+    async def fetch_competition_info(self, round_id: str) -> Dict:
+        competition = await self.db.competition_rounds.find_one(
+            {"id": round_id},
+            {"_id": 0, "end_date": 1, "prize_pool": 1, "total_videos": 1}
+        ) or {}
+        return {
+            "round_id": round_id,
+            "end_date": competition.get("end_date"),
+            "total_prize_pool": competition.get("prize_pool", 0),
+            "total_videos": competition.get("total_videos", 0)
+        }
+
+    async def lead(self) -> bool:
+        """Take or renew the leader lease; False while another worker holds it"""
+        return await claim_lease(self.db, LEADERBOARD_STATE, self.owner, LEADERBOARD_LEASE_SECONDS)
+
+    async def materialize(self, round_id: str):
+        """Leader only: copy videos updated since the last scan into leaderboard_entries"""
+        started_at = datetime.utcnow()
+        state = await self.db.system_settings.find_one(LEADERBOARD_STATE) or {}
+        seq = state.get("seq", 0) + 1
+
+        if state.get("round_id") != round_id or not state.get("watermark"):
+            # New round: one full read, and entries of earlier rounds are dropped
+            videos = await self.db.videos.find(leaderboard_filter(round_id), RANKING_FIELDS).to_list(None)
+            await self.db.leaderboard_entries.delete_many({"round_id": {"$ne": round_id}})
+            changed = videos
+        else:
+            since = state["watermark"] - timedelta(seconds=LEADERBOARD_CLOCK_SKEW_SECONDS)
+            videos = await self.db.videos.find(
+                {**leaderboard_filter(round_id), "last_updated": {"$gte": since}},
+                RANKING_FIELDS
+            ).to_list(None)
+            # The scans overlap; only entries whose values moved get a new sequence number
+            existing = {}
+            if videos:
+                entries = await self.db.leaderboard_entries.find(
+                    {"round_id": round_id, "video_id": {"$in": [video["id"] for video in videos]}},
+                    ENTRY_FIELDS
+                ).to_list(None)
+                existing = {entry["video_id"]: entry for entry in entries}
+            changed = [video for video in videos if entry_values(video) != entry_values(existing.get(video["id"]))]
+
+        if changed:
+            await self.db.leaderboard_entries.bulk_write(
+                [
+                    UpdateOne(
+                        {"round_id": round_id, "video_id": video["id"]},
+                        {"$set": {**entry_values(video), "removed": False, "seq": seq}},
+                        upsert=True
+                    )
+                    for video in changed
+                ],
+                ordered=False
+            )
+        # Entries other workers marked removed since the last scan
+        removed = await self.db.leaderboard_entries.update_many(
+            {"round_id": round_id, "seq": None},
+            {"$set": {"seq": seq}}
+        )
+
+        update = {"round_id": round_id, "watermark": started_at}
+        if changed or removed.modified_count:
+            update["seq"] = seq
+        # A worker that lost the lease mid-scan leaves the state to the new leader
+        await self.db.system_settings.update_one({**LEADERBOARD_STATE, "owner": self.owner}, {"$set": update})
+
+    async def load(self, round_id: str) -> Leaderboard:
+        """Build the board of a round from its materialized entries"""
+        state = await self.db.system_settings.find_one(LEADERBOARD_STATE) or {}
+        if state.get("round_id") == round_id:
+            seq = state.get("seq", 0)
+            entries = await self.db.leaderboard_entries.find(
+                {"round_id": round_id, "seq": {"$lte": seq}, "removed": {"$ne": True}},
+                ENTRY_FIELDS
+            ).to_list(None)
+            videos = [{**entry, "id": entry["video_id"]} for entry in entries]
+        else:
+            # Not materialized yet; the first sync after the leader catches up
+            # replays every entry of the round
+            seq = 0
+            videos = await self.db.videos.find(leaderboard_filter(round_id), RANKING_FIELDS).to_list(None)
+
+        self._version += 1
+        board = Leaderboard(round_id, RoundRanking(videos), {}, await self.fetch_competition_info(round_id), self._version, self._token, seq)
+        board.details = await self.fetch_details(board, board.ranking.range(0, self.size))
+        self.board = board
+        return board
+
+    async def sync(self, board: Leaderboard):
+        """Apply entries materialized since the board's sequence, keeping the version when nothing changed"""
+        state = await self.db.system_settings.find_one(LEADERBOARD_STATE) or {}
+        seq = state.get("seq", 0) if state.get("round_id") == board.round_id else board.seq
+
+        changed = False
+        updated = set()
+        if seq > board.seq:
+            entries = await self.db.leaderboard_entries.find(
+                {"round_id": board.round_id, "seq": {"$gt": board.seq, "$lte": seq}},
+                ENTRY_FIELDS
+            ).to_list(None)
+            for entry in entries:
+                video_id = entry["video_id"]
+                if entry.get("removed"):
+                    if video_id in board.ranking:
+                        board.ranking.remove(video_id)
+                        changed = True
+                    board.details.pop(video_id, None)
+                    continue
+                changed |= board.ranking.update(video_id, entry.get("view_count", 0), entry.get("upload_date") or datetime.min)
+                updated.add(video_id)
+            board.seq = seq
+
+        # Only videos new to the top, or updated, have their details read again
+        top = board.ranking.range(0, self.size)
+        stale = [video_id for video_id in top if video_id not in board.details or video_id in updated]
+        fetched = await self.fetch_details(board, stale)
+        previous = {video_id: board.details.get(video_id) for video_id in fetched}
+        details = {video_id: board.details[video_id] for video_id in top if video_id in board.details}
+        details.update(fetched)
+        competition_info = await self.fetch_competition_info(board.round_id)
+        if changed or fetched != previous or competition_info != board.competition_info:
+            board.details = details
+            board.competition_info = competition_info
+            board.touch()
+            self._version = max(self._version, board.version)
+        else:
+            # Drop details of videos that fell out of the top
+            board.details = details
+
+    async def refresh(self, round_id: Optional[str] = None) -> Leaderboard:
+        """Materialize the round if this worker leads, then catch the board up"""
+        round_id = round_id or await self.round_provider()
+        if await self.lead():
+            await self.materialize(round_id)
+
+        board = self.board
+        if board is None or board.round_id != round_id:
+            return await self.load(round_id)
+        await self.sync(board)
+        return board
+
+    async def page(self, board: Leaderboard, offset: int, limit: int) -> bytes:
+        """JSON body of a leaderboard page; pages past the top fetch their details on demand"""
+        body = board.cached_page(offset, limit)
+        if body is not None:
+            return body
+
+        version = board.version
+        video_ids = board.ranking.range(offset, limit)
+        missing = [video_id for video_id in video_ids if video_id not in board.details]
+        details = board.details
+        if missing:
+            fetched = await self.fetch_details(board, missing)
+            details = {**board.details, **fetched}
+            # Keep details of videos that climbed into the top
+            if offset < self.size:
+                board.details.update(fetched)
+        return board.encode_page(offset, limit, video_ids, details, cache=board.version == version)
+
+    async def apply_deltas(self, counter_deltas: Dict[str, Dict[str, int]]):
+        """Interaction buffer flush listener: bump counts and re-rank without a full reload"""
+        board = self.board
+        if board is None or not counter_deltas:
+            return
+
+        changed = False
+        unranked = []
+        for video_id, counts in counter_deltas.items():
+            entry = board.details.get(video_id)
+            for field, delta in counts.items():
+                if entry is not None and field in COUNTER_FIELDS.values() and field != "view_count":
+                    entry[field] = entry.get(field, 0) + delta
+                    changed = True
+            if counts.get("view_count"):
+                if board.ranking.add_views(video_id, counts["view_count"]):
+                    changed = True
+                else:
+                    unranked.append(video_id)
+
+        # Videos published since the last refresh; their counts are already written
+        if unranked:
+            query = {**leaderboard_filter(board.round_id), "id": {"$in": unranked}}
+            videos = await self.db.videos.find(query, RANKING_FIELDS).to_list(None)
+            if self.board is not board:
+                return
+            for video in videos:
+                changed |= board.ranking.update(video["id"], video.get("view_count", 0), video.get("upload_date") or datetime.min)
+
+        if changed:
+            # Details of videos that climbed into the top are fetched when a page needs them
+            board.touch()
+            self._version = max(self._version, board.version)
+
+    async def watch(self):
+        """Reconcile with the database on an interval"""
+        while True:
+            try:
+                async with self._refresh_lock:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Leaderboard refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_interval_seconds)
@@ -0,0 +1,21 @@
+# Worker Leases in system_settings
+from datetime import datetime, timedelta
+from typing import Dict
+
+from pymongo.errors import DuplicateKeyError
+
+async def claim_lease(db, lease: Dict, owner: str, seconds: float) -> bool:
+    """Take or renew a lease document in system_settings; False while another worker holds it"""
+    now = datetime.utcnow()
+    try:
+        await db.system_settings.find_one_and_update(
+            {**lease, "$or": [{"owner": owner}, {"lease_until": {"$not": {"$gt": now}}}]},
+            {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # Another worker holds the lease (the upsert hit the unique type index)
+    return True
+
+async def release_lease(db, lease: Dict, owner: str):
+    await db.system_settings.update_one({**lease, "owner": owner}, {"$set": {"lease_until": datetime.utcnow()}})
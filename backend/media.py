@@ -0,0 +1,528 @@
+# Background Transcoding and HLS Packaging
+import asyncio
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from leases import claim_lease
+from models import MediaJob
+from thumbnails import THUMB_KEY_PREFIX, thumbnail_url, thumbnail_version
+
+logger = logging.getLogger(__name__)
+
+# Media settings
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', 'ffprobe')
+# Derived media live in the storage backend; ffmpeg writes into local scratch space first
+HLS_KEY_PREFIX = "hls"
+PREVIEW_KEY_PREFIX = "previews"
+MEDIA_WORK_DIR = Path(__file__).parent / "uploads" / "media_work"
+MEDIA_UPLOAD_CONCURRENCY = 8
+PROBE_WORKERS = int(os.environ.get('PROBE_WORKERS', '2'))
+PROBE_TIMEOUT_SECONDS = 120
+PROBE_MAX_ATTEMPTS = 3
+PROBE_BACKFILL_LOCK = {"type": "media_probe_backfill"}
+PROBE_BACKFILL_LOCK_SECONDS = 3600
+HLS_SEGMENT_SECONDS = int(os.environ.get('HLS_SEGMENT_SECONDS', '4'))
+TRANSCODE_MAX_ATTEMPTS = 3
+MEDIA_JOB_LEASE_SECONDS = 120
+
+# Adaptive bitrate ladder
+RENDITIONS = [
+    {"name": "240p", "height": 240, "video_bitrate": 400_000, "audio_bitrate": 64_000},
+    {"name": "480p", "height": 480, "video_bitrate": 1_000_000, "audio_bitrate": 96_000},
+    {"name": "720p", "height": 720, "video_bitrate": 2_500_000, "audio_bitrate": 128_000},
+]
+
+HLS_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".jpg": "image/jpeg",
+}
+
+# Thumbnail sprite layout for scrubbing previews
+SPRITE_COLUMNS = 5
+SPRITE_ROWS = 5
+SPRITE_TILE_WIDTH = 160
+
+def video_hls_prefix(video_id: str) -> str:
+    return f"{HLS_KEY_PREFIX}/{video_id}"
+
+def preview_key(video_id: str, name: str) -> str:
+    return f"{PREVIEW_KEY_PREFIX}/{video_id}/{name}"
+
+async def remove_video_media(storage, video_id: str):
+    """Delete the transcoded output, previews and rendered thumbnails of a video"""
+    await storage.delete_prefix(video_hls_prefix(video_id))
+    await storage.delete_prefix(f"{PREVIEW_KEY_PREFIX}/{video_id}")
+    await storage.delete_prefix(f"{THUMB_KEY_PREFIX}/{video_id}")
+
+async def put_directory(storage, directory: Path, prefix: str):
+    """Store every file under a local directory at prefix/<relative path>, consuming the files"""
+    files = [path for path in directory.rglob("*") if path.is_file()]
+    semaphore = asyncio.Semaphore(MEDIA_UPLOAD_CONCURRENCY)
+
+    async def put(path: Path):
+        async with semaphore:
+            await storage.put_file(
+                f"{prefix}/{path.relative_to(directory).as_posix()}", path, HLS_MEDIA_TYPES.get(path.suffix)
+            )
+
+    await asyncio.gather(*(put(path) for path in files))
+
+def probe_media(source: str, output_dir: str) -> Dict[str, Any]:
+    """Read stream details with ffprobe and render a thumbnail and sprite into output_dir (runs in a worker process)"""
+    result = subprocess.run(
+        [FFPROBE_BIN, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", source],
+        capture_output=True, check=True, timeout=PROBE_TIMEOUT_SECONDS
+    )
+    info = json.loads(result.stdout)
+
+    video_stream = next((stream for stream in info.get("streams", []) if stream.get("codec_type") == "video"), {})
+    audio_stream = next((stream for stream in info.get("streams", []) if stream.get("codec_type") == "audio"), {})
+    duration = info.get("format", {}).get("duration") or video_stream.get("duration")
+    duration = float(duration) if duration else None
+
+    details = {
+        "duration": duration,
+        "width": video_stream.get("width"),
+        "height": video_stream.get("height"),
+        "video_codec": video_stream.get("codec_name"),
+        "audio_codec": audio_stream.get("codec_name"),
+        "thumbnail_path": None,
+        "sprite": None,
+    }
+    if not video_stream:
+        return details
+
+    os.makedirs(output_dir, exist_ok=True)
+    ffmpeg = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-nostdin", "-y"]
+
+    # Thumbnail from a representative frame near the start
+    thumbnail_path = os.path.join(output_dir, "thumbnail.jpg")
+    subprocess.run(
+        ffmpeg + ["-i", source, "-vf", "thumbnail,scale=-2:720", "-frames:v", "1", thumbnail_path],
+        capture_output=True, check=True, timeout=PROBE_TIMEOUT_SECONDS
+    )
+    details["thumbnail_path"] = thumbnail_path
+
+    # Sprite sheet of evenly spaced frames for scrub previews
+    if duration:
+        tiles = SPRITE_COLUMNS * SPRITE_ROWS
+        sprite_path = os.path.join(output_dir, "sprite.jpg")
+        subprocess.run(
+            ffmpeg + [
+                "-i", source,
+                "-vf", f"fps={tiles}/{duration:.3f},scale={SPRITE_TILE_WIDTH}:-2,tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+                "-frames:v", "1", sprite_path
+            ],
+            capture_output=True, check=True, timeout=PROBE_TIMEOUT_SECONDS
+        )
+        details["sprite"] = {
+            "path": sprite_path,
+            "columns": SPRITE_COLUMNS,
+            "rows": SPRITE_ROWS,
+            "interval": duration / tiles,
+            "tile_width": SPRITE_TILE_WIDTH,
+        }
+
+    return details
+
+async def run_ffmpeg(args: List[str]):
+    """Run ffmpeg, killing it if the calling task is cancelled"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-nostdin", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='replace')[-500:]}")
+
+def rendition_args(source: str, output_dir: Path, rendition: Dict) -> List[str]:
+    """ffmpeg arguments for one HLS rendition with keyframes aligned across the ladder"""
+    video_bitrate = rendition["video_bitrate"]
+    return [
+        "-y", "-i", source,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:{rendition['height']}",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main",
+        "-b:v", str(video_bitrate),
+        "-maxrate", str(int(video_bitrate * 1.07)),
+        "-bufsize", str(int(video_bitrate * 1.5)),
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-c:a", "aac", "-ac", "2", "-b:a", str(rendition["audio_bitrate"]),
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", str(output_dir / "seg_%05d.ts"),
+        str(output_dir / "index.m3u8"),
+    ]
+
+def poster_args(source: str, output_path: Path) -> List[str]:
+    # The thumbnail filter picks a representative frame instead of a black first frame
+    return ["-y", "-i", source, "-vf", "thumbnail,scale=-2:720", "-frames:v", "1", str(output_path)]
+
+def master_playlist(renditions: List[Dict]) -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for rendition in renditions:
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={rendition['bandwidth']},NAME=\"{rendition['name']}\"")
+        lines.append(rendition["playlist"])
+    return "\n".join(lines) + "\n"
+
+class MediaPipeline:
+    """Queue of media jobs persisted in Mongo and run by a local pool of ffmpeg workers"""
+
+    def __init__(self, db, storage, workers: int = 1, probe_workers: int = PROBE_WORKERS):
+        self.db = db
+        self.storage = storage
+        self.workers = workers
+        self.probe_workers = probe_workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._scheduled = set()  # Job ids waiting in the local queue
+        self.owner = uuid.uuid4().hex  # Identifies this process's job leases
+        self._tasks: List[asyncio.Task] = []
+        self._probe_tasks = set()
+        self._probe_pool: Optional[ProcessPoolExecutor] = None
+        self._probe_listeners: List[Callable[[str, Dict[str, Any]], Awaitable[None]]] = []
+
+    def media_source(self, video: Dict) -> Optional[str]:
+        """Local path of the original, or a presigned URL ffmpeg can read when it is stored remotely"""
+        storage_key = video.get("storage_key")
+        if not storage_key:
+            return video.get("file_path") or None
+        local_path = self.storage.local_path(storage_key)
+        if local_path:
+            return str(local_path)
+        return self.storage.presign(storage_key, "GET", expires_in=6 * 3600)
+
+    def add_probe_listener(self, listener: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        """Register a coroutine called with the video id and details after each probe"""
+        self._probe_listeners.append(listener)
+
+    def probe(self, video_id: str, then_transcode: bool = False):
+        """Probe a video in the background without blocking the caller"""
+        task = asyncio.create_task(self.probe_video(video_id, then_transcode))
+        self._probe_tasks.add(task)
+        task.add_done_callback(self._probe_tasks.discard)
+
+    async def probe_video(self, video_id: str, then_transcode: bool = False) -> Optional[Dict[str, Any]]:
+        """Extract duration, resolution, codecs, thumbnail and sprite into the video record"""
+        details = None
+        try:
+            details = await self._probe(video_id)
+        finally:
+            # Transcode after probing so the ladder can skip rungs above the source height
+            if then_transcode:
+                await self.enqueue(video_id)
+        return details
+
+    async def _probe(self, video_id: str) -> Optional[Dict[str, Any]]:
+        # Count the attempt up front, so files ffprobe can't read are given up on
+        video = await self.db.videos.find_one_and_update(
+            {"id": video_id, "probe_attempts": {"$not": {"$gte": PROBE_MAX_ATTEMPTS}}},
+            {"$inc": {"probe_attempts": 1}},
+            projection={"_id": 0, "file_path": 1, "storage_key": 1, "content_hash": 1}
+        )
+        source = video and self.media_source(video)
+        if not source:
+            return None
+
+        if self._probe_pool is None:
+            self._probe_pool = ProcessPoolExecutor(max_workers=self.probe_workers)
+
+        work_dir = MEDIA_WORK_DIR / f"probe-{video_id}-{uuid.uuid4().hex}"
+        try:
+            details = await asyncio.get_running_loop().run_in_executor(
+                self._probe_pool, probe_media, source, str(work_dir)
+            )
+            details = await self.store_previews(video_id, details)
+        except Exception as e:
+            logger.error(f"Probing video {video_id} failed: {str(e)}")
+            await self.db.videos.update_one({"id": video_id}, {"$set": {"probe_error": str(e)[-500:]}})
+            return None
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+        details["probed_at"] = datetime.utcnow()
+        if details["thumbnail_key"]:
+            details["thumbnail_url"] = thumbnail_url(video_id, thumbnail_version({**video, **details}))
+
+        await self.db.videos.update_one(
+            {"id": video_id},
+            {"$set": {**details, "probe_error": None, "last_updated": datetime.utcnow()}}
+        )
+
+        for listener in self._probe_listeners:
+            try:
+                await listener(video_id, details)
+            except Exception as e:
+                logger.error(f"Probe listener failed: {str(e)}")
+        return details
+
+    async def store_previews(self, video_id: str, details: Dict[str, Any]) -> Dict[str, Any]:
+        """Move the probed thumbnail and sprite into storage, swapping their paths for keys"""
+        thumbnail_path = details.pop("thumbnail_path")
+        details["thumbnail_key"] = None
+        if thumbnail_path:
+            details["thumbnail_key"] = preview_key(video_id, "thumbnail.jpg")
+            await self.storage.put_file(details["thumbnail_key"], Path(thumbnail_path), "image/jpeg")
+
+        sprite = details.get("sprite")
+        if sprite:
+            sprite["key"] = preview_key(video_id, "sprite.jpg")
+            await self.storage.put_file(sprite["key"], Path(sprite.pop("path")), "image/jpeg")
+        return details
+
+    async def enqueue(self, video_id: str) -> MediaJob:
+        """Record a transcode job for a video and hand it to the workers"""
+        job = MediaJob(video_id=video_id)
+        await self.db.media_jobs.insert_one(job.dict())
+        await self.db.videos.update_one({"id": video_id}, {"$set": {"transcode_status": "queued"}})
+        self.schedule(job.id)
+        return job
+
+    def schedule(self, job_id: str):
+        """Hand a job to the local workers unless it is already waiting for one"""
+        if job_id not in self._scheduled:
+            self._scheduled.add(job_id)
+            self.queue.put_nowait(job_id)
+
+    async def start(self):
+        """Pick up jobs left queued or abandoned by a stopped process, and start the workers"""
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self.worker()))
+        self._tasks.append(asyncio.create_task(self.watch_leases()))
+
+        if await self.claim_probe_backfill():
+            # Probe uploads that finished before the last shutdown without details
+            async for video in self.db.videos.find(
+                {"is_paid": True, "duration": None, "probed_at": None, "probe_attempts": {"$not": {"$gte": PROBE_MAX_ATTEMPTS}}},
+                {"_id": 0, "id": 1}
+            ).limit(100):
+                self.probe(video["id"])
+
+    async def claim_probe_backfill(self) -> bool:
+        """Let one process per lock period run the probe backfill"""
+        return await claim_lease(self.db, PROBE_BACKFILL_LOCK, self.owner, PROBE_BACKFILL_LOCK_SECONDS)
+
+    def lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=MEDIA_JOB_LEASE_SECONDS)
+
+    async def watch_leases(self):
+        """Queue jobs waiting to run and running jobs whose process stopped renewing the lease"""
+        while True:
+            try:
+                async for job in self.db.media_jobs.find(
+                    {
+                        "$or": [
+                            {"status": "queued"},
+                            {"status": "running", "lease_expires_at": {"$not": {"$gt": datetime.utcnow()}}}
+                        ]
+                    },
+                    {"_id": 0, "id": 1}
+                ).sort("created_at", 1):
+                    self.schedule(job["id"])
+            except Exception as e:
+                logger.error(f"Media job lease sweep failed: {str(e)}")
+            await asyncio.sleep(MEDIA_JOB_LEASE_SECONDS)
+
+    async def stop(self):
+        """Cancel the workers; interrupted jobs are handed back to the queue"""
+        for task in [*self._tasks, *self._probe_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._probe_tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._probe_pool:
+            self._probe_pool.shutdown(wait=False, cancel_futures=True)
+            self._probe_pool = None
+
+    async def worker(self):
+        while True:
+            job_id = await self.queue.get()
+            self._scheduled.discard(job_id)
+            try:
+                await self.run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Media job {job_id} crashed: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def run_job(self, job_id: str):
+        # Claim the job so it runs once even with several app processes
+        now = datetime.utcnow()
+        job_doc = await self.db.media_jobs.find_one_and_update(
+            {
+                "id": job_id,
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_expires_at": {"$not": {"$gt": now}}}
+                ]
+            },
+            {
+                "$set": {"status": "running", "lease_owner": self.owner, "lease_expires_at": self.lease(), "started_at": now},
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not job_doc:
+            return
+        job = MediaJob(**job_doc)
+        owned = {"id": job.id, "lease_owner": self.owner}
+
+        transcode = asyncio.create_task(self.transcode(job.video_id))
+        heartbeat = asyncio.create_task(self.heartbeat(job.id))
+        try:
+            done, _ = await asyncio.wait({transcode, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # Shutting down: stop ffmpeg, then hand the job back so a running process picks it up
+            for task in (transcode, heartbeat):
+                task.cancel()
+            await asyncio.gather(transcode, heartbeat, return_exceptions=True)
+            await self.db.media_jobs.update_one(
+                owned,
+                {"$set": {"status": "queued", "lease_owner": None, "lease_expires_at": None}, "$inc": {"attempts": -1}}
+            )
+            raise
+        finally:
+            for task in (transcode, heartbeat):
+                task.cancel()
+            await asyncio.gather(transcode, heartbeat, return_exceptions=True)
+
+        if transcode not in done:
+            logger.warning(f"Lost the lease on media job {job.id}; leaving it to its new owner")
+            return
+
+        try:
+            transcode.result()
+        except Exception as e:
+            logger.error(f"Transcoding video {job.video_id} failed (attempt {job.attempts}): {str(e)}")
+            retry = job.attempts < TRANSCODE_MAX_ATTEMPTS
+            await self.db.media_jobs.update_one(
+                owned,
+                {
+                    "$set": {
+                        "status": "queued" if retry else "failed",
+                        "error": str(e),
+                        "lease_owner": None,
+                        "lease_expires_at": None,
+                        "finished_at": None if retry else datetime.utcnow()
+                    }
+                }
+            )
+            if retry:
+                self.schedule(job.id)
+            else:
+                await self.db.videos.update_one({"id": job.video_id}, {"$set": {"transcode_status": "failed"}})
+            return
+
+        await self.db.media_jobs.update_one(
+            owned,
+            {"$set": {"status": "completed", "error": None, "lease_owner": None, "lease_expires_at": None, "finished_at": datetime.utcnow()}}
+        )
+
+    async def heartbeat(self, job_id: str):
+        """Renew a running job's lease; returns once another process has taken it over"""
+        while True:
+            await asyncio.sleep(MEDIA_JOB_LEASE_SECONDS / 3)
+            result = await self.db.media_jobs.update_one(
+                {"id": job_id, "lease_owner": self.owner},
+                {"$set": {"lease_expires_at": self.lease()}}
+            )
+            if not result.matched_count:
+                return
+
+    async def transcode(self, video_id: str):
+        """Package a video as HLS renditions plus a poster frame"""
+        video = await self.db.videos.find_one(
+            {"id": video_id}, {"_id": 0, "file_path": 1, "storage_key": 1, "height": 1, "hls_prefix": 1}
+        )
+        source = video and self.media_source(video)
+        if not source:
+            raise RuntimeError("Video or source file not found")
+
+        # Don't upscale: keep rungs up to the source height, and always the lowest
+        source_height = video.get("height")
+        ladder = [rendition for rendition in RENDITIONS if not source_height or rendition["height"] <= source_height]
+        ladder = ladder or RENDITIONS[:1]
+
+        await self.db.videos.update_one({"id": video_id}, {"$set": {"transcode_status": "running"}})
+
+        # Build in scratch space, store under a fresh prefix and switch the video over once it is all there
+        hls_prefix = f"{video_hls_prefix(video_id)}/{uuid.uuid4().hex}"
+        work_dir = MEDIA_WORK_DIR / f"hls-{video_id}-{uuid.uuid4().hex}"
+        os.makedirs(work_dir)
+
+        try:
+            renditions = []
+            for rendition in ladder:
+                output_dir = work_dir / rendition["name"]
+                os.makedirs(output_dir)
+                await run_ffmpeg(rendition_args(source, output_dir, rendition))
+                renditions.append({
+                    "name": rendition["name"],
+                    "height": rendition["height"],
+                    "bandwidth": rendition["video_bitrate"] + rendition["audio_bitrate"],
+                    "playlist": f"{rendition['name']}/index.m3u8"
+                })
+
+            await run_ffmpeg(poster_args(source, work_dir / "poster.jpg"))
+
+            with open(work_dir / "master.m3u8", "w") as f:
+                f.write(master_playlist(renditions))
+
+            await put_directory(self.storage, work_dir, hls_prefix)
+        except BaseException:
+            await self.storage.delete_prefix(hls_prefix)
+            raise
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+        await self.db.videos.update_one(
+            {"id": video_id},
+            {
+                "$set": {
+                    "transcode_status": "ready",
+                    "hls_prefix": hls_prefix,
+                    "hls_master": "master.m3u8",
+                    "renditions": renditions,
+                    "poster_path": "poster.jpg",
+                    "last_updated": datetime.utcnow()
+                }
+            }
+        )
+
+        # Drop the previous transcode once nothing points at it
+        old_prefix = video.get("hls_prefix")
+        if old_prefix and old_prefix != hls_prefix:
+            await self.storage.delete_prefix(old_prefix)
+
+PREVIEW_FILES = {"thumbnail.jpg", "sprite.jpg"}
+
+def resolve_hls_key(hls_prefix: str, path: str) -> Optional[str]:
+    """Storage key of a manifest/segment path inside a video's HLS output, refusing anything outside it"""
+    relative = posixpath.normpath(path)
+    if relative.startswith(("/", "..")) or relative == ".":
+        return None
+    if posixpath.splitext(relative)[1] not in HLS_MEDIA_TYPES:
+        return None
+    return f"{hls_prefix}/{relative}"
@@ -41,11 +41,30 @@ class Video(BaseModel):
     hashtags: List[str] = []
     user_id: str
     filename: str
-    file_path: str
+    file_path: str  # Local path, empty when stored remotely
+    storage_key: Optional[str] = None  # Object key in the storage backend
     thumbnail_url: Optional[str] = None
     duration: Optional[float] = None
     file_size: int
     
+    # Probed media details
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    thumbnail_key: Optional[str] = None  # Storage key of the full-size probed thumbnail
+    sprite: Optional[Dict[str, Any]] = None  # {"key", "columns", "rows", "interval", "tile_width"}
+    probed_at: Optional[datetime] = None
+    content_hash: Optional[str] = None  # SHA-256 of the file contents
+    content_type: Optional[str] = None
+    
+    # Transcoded HLS output (paths relative to the storage prefix of the current transcode)
+    transcode_status: Optional[str] = None  # "queued", "running", "ready", "failed"
+    hls_prefix: Optional[str] = None
+    hls_master: Optional[str] = None
+    renditions: List[Dict[str, Any]] = []  # [{"name", "height", "bandwidth", "playlist"}]
+    poster_path: Optional[str] = None
+    
     # Engagement metrics
     view_count: int = 0
     like_count: int = 0
@@ -72,6 +91,10 @@ class Video(BaseModel):
     published_at: Optional[datetime] = None
     last_updated: datetime = Field(default_factory=datetime.utcnow)
 
+# Server-side file locations and the content hash (which addresses the shared blob)
+# never leave the API
+PRIVATE_VIDEO_FIELDS = {"file_path", "storage_key", "content_hash", "thumbnail_key", "hls_prefix"}
+
 class VideoInteraction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     video_id: str
@@ -82,6 +105,10 @@ class VideoInteraction(BaseModel):
     metadata: Optional[Dict[str, Any]] = {}
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Interaction held back while its competition is frozen, replayed once it has closed
+class FrozenInteraction(VideoInteraction):
+    competition_id: str
+
 class UserFollow(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     follower_id: str
@@ -124,6 +151,10 @@ class Competition(BaseModel):
     share_weight: float = 0.1
     completion_weight: float = 0.1
     
+    # Set while the competition is being closed: metrics stop moving and interactions are held back
+    frozen_at: Optional[datetime] = None
+    snapshot_id: Optional[str] = None  # Final ranking in algorithm_score_snapshots
+    
     created_at: datetime = Field(default_factory=datetime.utcnow)
     created_by: str  # Admin user ID
 
@@ -147,6 +178,12 @@ class AlgorithmScore(BaseModel):
     calculated_at: datetime = Field(default_factory=datetime.utcnow)
     algorithm_version: str = "1.0"
 
+# Frozen final ranking of a competition, written by its end-of-competition job
+class ScoreSnapshotEntry(AlgorithmScore):
+    snapshot_id: str
+    user_id: str
+    view_count: int = 0
+
 class AdminUser(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     username: str
@@ -192,6 +229,11 @@ class AlgorithmConfig(BaseModel):
     max_same_user: int = 2        # Max videos from same user in feed
     max_same_hashtag: int = 3     # Max videos with same hashtag
     
+    # Feed candidates
+    candidate_pool_size: int = 500  # Top precomputed scores read per feed request
+    recent_candidate_count: int = 100  # Newest uploads added to feed candidates
+    follow_candidate_count: int = 100  # Newest videos from followed creators added to candidates
+    
     # Active status
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -290,4 +332,77 @@ class ChatMessage(BaseModel):
 class VideoUploadRequest(BaseModel):
     title: str
     description: Optional[str] = ""
-    hashtags: List[str] = []
\ No newline at end of file
+    hashtags: List[str] = []
+
+# Resumable Upload Models
+class UploadSession(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    video_id: str
+    user_id: str
+    filename: str  # Original client filename
+    content_type: str
+    total_size: int  # Declared size in bytes
+    offset: int = 0  # Bytes received so far
+    part_path: str
+    kind: str = "resumable"  # "resumable" (chunks through the API) or "direct" (client PUTs to storage)
+    storage_key: Optional[str] = None  # Direct uploads: object the client writes to
+    content_hash: Optional[str] = None  # Direct uploads: declared SHA-256
+    status: str = "uploading"  # "uploading", "finalizing", "stored", "finalized"
+    lease_until: Optional[datetime] = None  # Held while a chunk is being written or the upload finalized
+    finalized_path: Optional[str] = None  # Resumable uploads: where finalize moved the partial file
+    stored_upload: Optional[Dict[str, Any]] = None  # Blob the file went into, kept until the video is published
+    expires_at: datetime
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ResumableUploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    total_size: int
+
+# Content-addressed video storage, shared by videos with identical files
+class VideoBlob(BaseModel):
+    content_hash: str  # SHA-256, the blob key
+    storage_key: Optional[str] = None  # Object key in the storage backend
+    file_path: str  # Local path, empty when stored remotely
+    file_size: int
+    content_type: Optional[str] = None
+    ref_count: int = 0  # Number of videos whose file_path points at this blob
+    deleting_at: Optional[datetime] = None  # Set while the last reference's release deletes the object
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Background media processing jobs
+class MediaJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    video_id: str
+    kind: str = "transcode"
+    status: str = "queued"  # "queued", "running", "completed", "failed"
+    attempts: int = 0
+    error: Optional[str] = None
+    lease_owner: Optional[str] = None  # Process running the job
+    lease_expires_at: Optional[datetime] = None  # Renewed while it runs; past it the job is taken over
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# Background finalization of a competition
+class CompetitionJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    competition_id: str
+    snapshot_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"  # "queued", "running", "completed", "failed"
+    phase: str = "freezing"  # "freezing", "snapshot", "scoring", "ranking", "finalizing", "replaying"
+    total_videos: int = 0
+    scored_videos: int = 0  # Resume cursor: rows of the metric snapshot already scored
+    scored_at: Optional[datetime] = None  # Freeze time, used as "now" for recency
+    snapshot_path: Optional[str] = None  # Columnar metric snapshot (.npz)
+    config: Optional[Dict[str, Any]] = None  # Algorithm config captured when the round froze
+    replayed_interactions: int = 0
+    winner_count: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+    requested_by: Optional[str] = None
+    lease_until: Optional[datetime] = None  # Held by the process running the job
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
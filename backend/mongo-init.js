@@ -17,6 +17,8 @@ db.createUser({
 });
 
 // Create indexes for better performance
+// The backend also declares the indexes its queries need in db_indexes.py and
+// creates any that are missing at startup
 db.users.createIndex({ "id": 1 }, { unique: true });
 db.users.createIndex({ "email": 1 }, { sparse: true });
 db.users.createIndex({ "phone": 1 }, { sparse: true });
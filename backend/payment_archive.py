@@ -0,0 +1,56 @@
+# Monthly Archiving of Completed Payment Sessions
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Archive settings
+PAYMENT_ARCHIVE_AFTER_DAYS = int(os.environ.get('PAYMENT_ARCHIVE_AFTER_DAYS', '30'))
+PAYMENT_ARCHIVE_BATCH_SIZE = 500
+
+# Sessions that reached a final paid state, and the field they are looked up by
+COMPLETED_PAYMENT_SESSIONS = {
+    "payment_sessions": ({"status": {"$in": ["paid", "no_payment_required"]}}, "session_id"),
+    "promptpay_sessions": ({"status": "paid"}, "id"),
+}
+
+def archive_collection_name(collection_name: str, created_at: datetime) -> str:
+    return f"{collection_name}_archive_{created_at:%Y_%m}"
+
+async def archive_payment_sessions(db, now: Optional[datetime] = None) -> int:
+    """Move completed sessions past the archive age into per-month archive collections"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=PAYMENT_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    for collection_name, (completed, lookup_field) in COMPLETED_PAYMENT_SESSIONS.items():
+        collection = db[collection_name]
+        indexed = set()
+        while True:
+            sessions = await collection.find(
+                {**completed, "created_at": {"$lt": cutoff}}
+            ).sort("created_at", 1).limit(PAYMENT_ARCHIVE_BATCH_SIZE).to_list(PAYMENT_ARCHIVE_BATCH_SIZE)
+            if not sessions:
+                break
+
+            by_month = defaultdict(list)
+            for session in sessions:
+                by_month[archive_collection_name(collection_name, session["created_at"])].append(session)
+
+            for archive_name, archive_sessions in by_month.items():
+                archive = db[archive_name]
+                if archive_name not in indexed:
+                    await archive.create_index(lookup_field)
+                    indexed.add(archive_name)
+                # Replacing by _id lets a batch interrupted before the delete be archived again
+                await archive.bulk_write(
+                    [ReplaceOne({"_id": session["_id"]}, session, upsert=True) for session in archive_sessions],
+                    ordered=False
+                )
+
+            await collection.delete_many({"_id": {"$in": [session["_id"] for session in sessions]}})
+            archived += len(sessions)
+    return archived
@@ -0,0 +1,220 @@
+# Order-statistics Rankings for Competition Rounds
+import random
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SKIPLIST_MAX_LEVEL = 32
+SKIPLIST_P = 0.25
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.width = [1] * level  # Level-0 steps to the next node on each level
+
+class IndexableSkipList:
+    """Sorted unique keys with O(log n) insert, remove, rank and positional lookups"""
+
+    def __init__(self, keys: Iterable = ()):
+        self._head = _Node(None, SKIPLIST_MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random()
+        self._build(sorted(keys))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < SKIPLIST_MAX_LEVEL and self._random.random() < SKIPLIST_P:
+            level += 1
+        return level
+
+    def _build(self, keys: List):
+        """Link already sorted keys in one pass"""
+        last = [self._head] * SKIPLIST_MAX_LEVEL
+        last_position = [0] * SKIPLIST_MAX_LEVEL
+        for position, key in enumerate(keys, start=1):
+            level = self._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].width[i] = position - last_position[i]
+                last[i] = node
+                last_position[i] = position
+            self._level = max(self._level, level)
+
+        # Links off the end span to a virtual node past the last key
+        self._size = len(keys)
+        for i in range(SKIPLIST_MAX_LEVEL):
+            last[i].width[i] = self._size + 1 - last_position[i]
+
+    def _find(self, key) -> Tuple[List[_Node], List[int]]:
+        """Rightmost node before key on every level, with its position"""
+        update = [self._head] * SKIPLIST_MAX_LEVEL
+        positions = [0] * SKIPLIST_MAX_LEVEL
+        node = self._head
+        position = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            positions[i] = position
+        return update, positions
+
+    def insert(self, key):
+        update, positions = self._find(key)
+        candidate = update[0].next[0]
+        if candidate is not None and candidate.key == key:
+            return
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i] = self._head
+                positions[i] = 0
+                self._head.width[i] = self._size + 1
+            self._level = level
+
+        node = _Node(key, level)
+        position = positions[0] + 1
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.width[i] = positions[i] + update[i].width[i] + 1 - position
+            update[i].width[i] = position - positions[i]
+        for i in range(level, SKIPLIST_MAX_LEVEL):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _ = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+
+        for i in range(SKIPLIST_MAX_LEVEL):
+            if i < len(node.next) and update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        self._size -= 1
+
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    def index(self, key) -> int:
+        """Zero-based position of a key"""
+        update, positions = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def _node_at(self, index: int) -> _Node:
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        target = index + 1
+        node = self._head
+        position = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and position + node.width[i] <= target:
+                position += node.width[i]
+                node = node.next[i]
+        return node
+
+    def __getitem__(self, index: int):
+        return self._node_at(index).key
+
+    def range(self, start: int, stop: int) -> List:
+        """Keys from position start up to (not including) stop"""
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+def rank_key(video_id: str, view_count: int, upload_date: Optional[datetime]) -> Tuple:
+    # Most views first; on a tie the earlier upload ranks higher
+    return (-view_count, upload_date or datetime.min, video_id)
+
+class RoundRanking:
+    """Live ranking of a round's videos by view count"""
+
+    def __init__(self, videos: Iterable[Dict] = ()):
+        self._keys: Dict[str, Tuple] = {
+            video["id"]: rank_key(video["id"], video.get("view_count", 0), video.get("upload_date"))
+            for video in videos
+        }
+        self._list = IndexableSkipList(self._keys.values())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self._keys
+
+    def update(self, video_id: str, view_count: int, upload_date: Optional[datetime] = None) -> bool:
+        """Set a video's view count, adding it if new; returns whether anything moved"""
+        old_key = self._keys.get(video_id)
+        if upload_date is None and old_key is not None:
+            upload_date = old_key[1]
+        key = rank_key(video_id, view_count, upload_date)
+        if key == old_key:
+            return False
+        if old_key is not None:
+            self._list.remove(old_key)
+        self._list.insert(key)
+        self._keys[video_id] = key
+        return True
+
+    def add_views(self, video_id: str, delta: int) -> bool:
+        """Apply a view count delta; False when the video isn't ranked here"""
+        key = self._keys.get(video_id)
+        if key is None:
+            return False
+        return self.update(video_id, -key[0] + delta)
+
+    def remove(self, video_id: str):
+        key = self._keys.pop(video_id, None)
+        if key is not None:
+            self._list.remove(key)
+
+    def sync(self, videos: Iterable[Dict]) -> bool:
+        """Reconcile with a full listing of the round, touching only videos that changed"""
+        changed = False
+        seen = set()
+        for video in videos:
+            seen.add(video["id"])
+            changed |= self.update(video["id"], video.get("view_count", 0), video.get("upload_date") or datetime.min)
+        for video_id in [video_id for video_id in self._keys if video_id not in seen]:
+            self.remove(video_id)
+            changed = True
+        return changed
+
+    def rank(self, video_id: str) -> Optional[int]:
+        """One-based rank of a video, None when it isn't ranked"""
+        key = self._keys.get(video_id)
+        return None if key is None else self._list.index(key) + 1
+
+    def view_count(self, video_id: str) -> Optional[int]:
+        key = self._keys.get(video_id)
+        return None if key is None else -key[0]
+
+    def at(self, rank: int) -> Tuple[str, int]:
+        """(video_id, view_count) at a one-based rank"""
+        key = self._list[rank - 1]
+        return key[2], -key[0]
+
+    def range(self, offset: int, limit: int) -> List[str]:
+        """Video ids of one leaderboard page"""
+        return [key[2] for key in self._list.range(offset, offset + limit)]
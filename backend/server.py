@@ -1,27 +1,49 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, Request, Form, status, Depends
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Form, status, Depends
+from fastapi.responses import StreamingResponse, RedirectResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.sessions import SessionMiddleware
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Optional, Dict
 import uuid
 from datetime import datetime, timedelta
 import asyncio
-import aiofiles
 import shutil
 import json
+import mimetypes
+import re
+import zlib
 
 # Models and Authentication
-from models import Video, User, VideoInteraction, Competition, AlgorithmScore, AdminUser
+from models import PRIVATE_VIDEO_FIELDS, Video, User, VideoInteraction, Competition, AlgorithmScore, AdminUser, UploadSession, ResumableUploadRequest
 from auth import AuthManager, get_current_user, get_current_user_optional
-from algorithm import VideoRecommendationEngine
+from algorithm import VideoRecommendationEngine, AlgorithmConfigProvider, SCORE_SWEEP_LEASE
+from leases import claim_lease
 from admin_routes import admin_router
+from cache import competition_cache, CURRENT_ROUND_KEY
+from interaction_buffer import InteractionBuffer
+from blob_store import StoredUpload, store_blob, register_blob, release_blob
+from storage import LocalStorage, get_storage
+from file_responses import conditional_file_response, accel_redirect_response, storage_object_response, etag_matches
+from leaderboard import LeaderboardMaterializer, LEADERBOARD_SIZE
+from competition_jobs import CompetitionJobRunner
+from db_indexes import check_indexes
+from payment_archive import archive_payment_sessions
+from thumbnails import ThumbnailCache, THUMB_CACHE_DIR, THUMB_SIZES, THUMB_FORMATS, cache_key, thumbnail_version
+from media import MediaPipeline, HLS_MEDIA_TYPES, PREVIEW_FILES, preview_key, resolve_hls_key, video_hls_prefix
+from upload_pipeline import (
+    MAX_UPLOAD_BYTES, stream_video_upload, write_request_body, check_upload_request,
+    create_upload_session, get_upload_session, append_upload_chunk, finalize_upload_session,
+    create_direct_upload_session, finalize_direct_upload, mark_upload_session_finalized, expire_upload_sessions,
+    record_stored_upload, claim_stored_upload, release_upload_session
+)
 
 # Emergent integrations for payments
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
@@ -48,10 +70,26 @@ auth_manager = AuthManager(db)
 def get_database():
     return db
 
-# Create upload directories
-UPLOAD_DIR = ROOT_DIR / "uploads" / "videos"
+# Video storage driver (local disk or S3-compatible, see STORAGE_BACKEND)
+storage = get_storage()
+
+# Create upload directories (local staging for uploads in progress)
+UPLOAD_ROOT = ROOT_DIR / "uploads"
+UPLOAD_DIR = UPLOAD_ROOT / "videos"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Remote storage streaming: redirect to presigned URLs unless proxying is forced
+STORAGE_PROXY_STREAMS = os.environ.get('STORAGE_PROXY_STREAMS', 'false').lower() == 'true'
+STREAM_URL_TTL_SECONDS = int(os.environ.get('STREAM_URL_TTL_SECONDS', '3600'))
+
+# Internal nginx location aliasing UPLOAD_ROOT; empty serves video bytes from Python
+VIDEO_ACCEL_REDIRECT_PREFIX = os.environ.get('VIDEO_ACCEL_REDIRECT_PREFIX', '')
+
+# Lifetime of presigned direct-upload URLs
+DIRECT_UPLOAD_URL_TTL_SECONDS = int(os.environ.get('DIRECT_UPLOAD_URL_TTL_SECONDS', '3600'))
+
 # Create the main app
 app = FastAPI()
 
@@ -66,12 +104,74 @@ api_router = APIRouter(prefix="/api")
 # Initialize Algorithm Engine
 algorithm_engine = None
 
+# Shared algorithm config, hot-reloaded from the database
+config_provider = AlgorithmConfigProvider(
+    db,
+    poll_interval_seconds=float(os.environ.get('ALGORITHM_CONFIG_POLL_SECONDS', '5'))
+)
+
+# Score index sweep interval (recency decays even without new interactions)
+SCORE_SWEEP_INTERVAL_SECONDS = int(os.environ.get('SCORE_SWEEP_INTERVAL_SECONDS', '300'))
+
+# Rescoring of videos whose metrics moved, batched off the interaction path
+SCORE_DIRTY_INTERVAL_SECONDS = float(os.environ.get('SCORE_DIRTY_INTERVAL_SECONDS', '5'))
+
+# Expired resumable upload sweep interval
+UPLOAD_SESSION_SWEEP_INTERVAL_SECONDS = int(os.environ.get('UPLOAD_SESSION_SWEEP_INTERVAL_SECONDS', '600'))
+
+# Completed payment session archiving interval
+PAYMENT_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('PAYMENT_ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+# Transcoding worker pool
+media_pipeline = MediaPipeline(db, storage, workers=int(os.environ.get('TRANSCODE_WORKERS', '1')))
+
+async def reindex_probed_video(video_id: str, details: dict):
+    # Duration feeds the quality score, so rescore once it is known
+    engine = await get_algorithm_engine()
+    await engine.update_score_index([video_id])
+
+async def prerender_thumbnails(video_id: str, details: dict):
+    video = await db.videos.find_one({"id": video_id}, {"_id": 0, "content_hash": 1, "thumbnail_key": 1, "probed_at": 1})
+    version = video and thumbnail_version(video)
+    if version and video.get("thumbnail_key"):
+        await thumbnail_cache.prerender(video_id, version, video["thumbnail_key"])
+
+media_pipeline.add_probe_listener(reindex_probed_video)
+media_pipeline.add_probe_listener(prerender_thumbnails)
+
+# End-of-competition scoring jobs
+competition_job_runner = CompetitionJobRunner(db, VideoRecommendationEngine(db, config_provider))
+
+# Resized thumbnails, stored once and LRU-cached on disk
+thumbnail_cache = ThumbnailCache(storage)
+
+# Long-running background tasks started with the app
+background_tasks = []
+
 async def get_algorithm_engine():
     global algorithm_engine
     if not algorithm_engine:
-        algorithm_engine = VideoRecommendationEngine(db)
+        algorithm_engine = VideoRecommendationEngine(db, config_provider)
     return algorithm_engine
 
+# Write-behind buffer for interaction events
+interaction_buffer = None
+
+async def get_interaction_buffer():
+    global interaction_buffer
+    if not interaction_buffer:
+        interaction_buffer = InteractionBuffer(
+            db,
+            await get_algorithm_engine(),
+            flush_interval_seconds=int(os.environ.get('INTERACTION_FLUSH_INTERVAL_MS', '250')) / 1000,
+            max_batch_events=int(os.environ.get('INTERACTION_FLUSH_BATCH', '500')),
+            max_pending_events=int(os.environ.get('INTERACTION_MAX_PENDING', '10000'))
+        )
+        # Keep the leaderboard current between refreshes
+        interaction_buffer.add_flush_listener(leaderboard.apply_deltas)
+        interaction_buffer.start()
+    return interaction_buffer
+
 # Stripe setup
 stripe_api_key = os.environ.get('STRIPE_API_KEY')
 stripe_checkout = None
@@ -145,6 +245,10 @@ class CompetitionRound(BaseModel):
     winners: List[Dict] = []
 
 # Helper functions
+def public_video(video: dict) -> dict:
+    """Serialize a video for public responses, without server-side file details"""
+    return serialize_doc({key: value for key, value in video.items() if key not in PRIVATE_VIDEO_FIELDS})
+
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable format"""
     if doc is None:
@@ -166,8 +270,8 @@ def serialize_doc(doc):
         return result
     return doc
 
-async def get_current_competition_round():
-    """Get or create the current active competition round"""
+async def load_current_competition_round() -> dict:
+    """Find or create the competition round covering the current time"""
     now = datetime.utcnow()
     current_round = await db.competition_rounds.find_one({
         "is_active": True,
@@ -184,11 +288,36 @@ async def get_current_competition_round():
             start_date=start_date,
             end_date=end_date
         )
-        result = await db.competition_rounds.insert_one(round_data.dict())
-        return round_data.id
+        
+        # Upsert on the start date so concurrent workers end up with the same round
+        # (a partial unique index on start_date makes the losing insert fail, then it reads the winner's)
+        round_filter = {"is_active": True, "start_date": start_date}
+        try:
+            current_round = await db.competition_rounds.find_one_and_update(
+                round_filter,
+                {"$setOnInsert": {k: v for k, v in round_data.dict().items() if k not in round_filter}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            current_round = await db.competition_rounds.find_one(round_filter)
+    
+    return current_round
+
+async def get_current_competition_round():
+    """Get or create the current active competition round"""
+    current_round = await competition_cache.get_or_load(CURRENT_ROUND_KEY, load_current_competition_round)
+    
+    # Never serve a round past its end date from cache
+    if current_round["end_date"] < datetime.utcnow():
+        competition_cache.invalidate(CURRENT_ROUND_KEY)
+        current_round = await competition_cache.get_or_load(CURRENT_ROUND_KEY, load_current_competition_round)
     
     return current_round["id"]
 
+# Current round's leaderboard, kept in memory
+leaderboard = LeaderboardMaterializer(db, get_current_competition_round)
+
 async def init_stripe():
     global stripe_checkout
     if stripe_api_key and not stripe_checkout:
@@ -296,6 +425,21 @@ async def initiate_upload(request: Request, current_user: User = Depends(get_cur
                 detail="Video title is required"
             )
         
+        # Optional direct upload: the client declares the file up front and PUTs it to storage
+        direct_upload = bool(body.get("direct_upload", False))
+        if direct_upload:
+            filename = body.get("filename") or ""
+            content_type = body.get("content_type") or ""
+            file_size = body.get("file_size")
+            content_hash = str(body.get("content_hash") or "").lower()
+            
+            if not isinstance(file_size, int) or not re.fullmatch(r"[0-9a-f]{64}", content_hash):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Direct upload requires file_size and a hex SHA-256 content_hash"
+                )
+            check_upload_request(content_type, file_size, MAX_UPLOAD_BYTES)
+        
         # Check if user has enough credits (30 credits = 1 video)
         user_credits = await auth_manager.get_user_credits(current_user.id)
         required_credits = 30
@@ -325,13 +469,29 @@ async def initiate_upload(request: Request, current_user: User = Depends(get_cur
         result = await db.videos.insert_one(video.dict())
         video_id = video.id
         
-        return {
+        response = {
             "video_id": video_id,
             "user_credits": user_credits,
             "required_credits": required_credits,
             "message": "Video initiated successfully. Ready for file upload."
         }
         
+        if direct_upload:
+            session = await create_direct_upload_session(
+                db,
+                video_id,
+                current_user.id,
+                filename,
+                content_type,
+                file_size,
+                content_hash
+            )
+            response["direct_upload"] = direct_upload_response(session)
+        
+        return response
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Video initiation failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to initiate upload: {str(e)}")
@@ -458,9 +618,13 @@ async def check_stripe_payment_status(session_id: str):
             if video_id:
                 await db.videos.update_one(
                     {"id": video_id},
-                    {"$set": {"is_paid": True}}
+                    {"$set": {"is_paid": True, "last_updated": datetime.utcnow()}}
                 )
                 
+                # Add the video to the score index so it can show up in feeds
+                engine = await get_algorithm_engine()
+                await engine.update_score_index([video_id])
+                
                 # Update competition round stats
                 await db.competition_rounds.update_one(
                     {"id": await get_current_competition_round()},
@@ -552,9 +716,13 @@ async def confirm_promptpay_payment(session_id: str):
         if video_id:
             await db.videos.update_one(
                 {"id": video_id},
-                {"$set": {"is_paid": True}}
+                {"$set": {"is_paid": True, "last_updated": datetime.utcnow()}}
             )
             
+            # Add the video to the score index so it can show up in feeds
+            engine = await get_algorithm_engine()
+            await engine.update_score_index([video_id])
+            
             # Update competition round stats
             await db.competition_rounds.update_one(
                 {"id": await get_current_competition_round()},
@@ -884,103 +1052,353 @@ async def get_payment_methods():
         "currency": "THB"
     }
 
+# Credits charged per uploaded video
+UPLOAD_CREDITS = 30
+
+async def get_pending_upload_video(video_id: str, current_user: User) -> dict:
+    """Get an unpaid video of the current user that is waiting for its file"""
+    # Verify video belongs to current user
+    video_doc = await db.videos.find_one({"id": video_id, "user_id": current_user.id})
+    if not video_doc:
+        raise HTTPException(status_code=404, detail="Video not found or access denied")
+    
+    if video_doc.get("is_paid", False):
+        raise HTTPException(status_code=400, detail="Video already uploaded")
+    
+    return video_doc
+
+async def complete_video_upload(video_doc: dict, upload: StoredUpload, current_user: User, release_on_failure: bool = True) -> dict:
+    """Spend credits for an upload already in the blob store and publish the video"""
+    video_id = video_doc["id"]
+    
+    try:
+        # Spend credits (30 credits per video)
+        required_credits = UPLOAD_CREDITS
+        remaining_credits = await auth_manager.spend_credits(
+            current_user.id,
+            required_credits,
+            f"Video upload: {video_doc['title']}",
+            video_id
+        )
+        
+        # Update video record
+        await db.videos.update_one(
+            {"id": video_id},
+            {
+                "$set": {
+                    "filename": upload.filename,
+                    "file_path": str(upload.file_path),
+                    "storage_key": upload.storage_key,
+                    "file_size": upload.file_size,
+                    "content_hash": upload.content_hash,
+                    "content_type": upload.content_type,
+                    "is_paid": True,
+                    "upload_date": datetime.utcnow(),
+                    "published_at": datetime.utcnow(),
+                    "last_updated": datetime.utcnow()
+                }
+            }
+        )
+        
+    except Exception as e:
+        # Give back the blob reference if something went wrong, unless an upload session keeps it for a retry
+        if release_on_failure:
+            await release_blob(db, storage, upload.storage_key)
+        raise e
+    
+    # Update competition round stats
+    await db.competition_rounds.update_one(
+        {"id": await get_current_competition_round()},
+        {
+            "$inc": {
+                "total_revenue": 30.0,
+                "total_videos": 1,
+                "prize_pool": 21.0  # 70% of 30 THB
+            }
+        }
+    )
+    
+    # Add the video to the score index so it can show up in feeds
+    engine = await get_algorithm_engine()
+    await engine.update_score_index([video_id])
+    
+    # Probe duration, resolution and previews, then package HLS renditions in the background
+    media_pipeline.probe(video_id, then_transcode=True)
+    
+    return {
+        "message": "Video uploaded successfully!",
+        "video_id": video_id,
+        "filename": upload.filename,
+        "file_size": upload.file_size,
+        "credits_spent": required_credits,
+        "remaining_credits": remaining_credits
+    }
+
 @api_router.post("/upload/video/{video_id}")
 async def upload_video_file(
     video_id: str,
-    file: UploadFile = File(...),
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """Upload video file and spend credits"""
     try:
-        # Verify video belongs to current user
-        video_doc = await db.videos.find_one({"id": video_id, "user_id": current_user.id})
-        if not video_doc:
-            raise HTTPException(status_code=404, detail="Video not found or access denied")
+        video_doc = await get_pending_upload_video(video_id, current_user)
         
-        if video_doc.get("is_paid", False):
-            raise HTTPException(status_code=400, detail="Video already uploaded")
+        # Stream the multipart body straight to disk, size-checked and hashed as it arrives
+        upload = await stream_video_upload(request, UPLOAD_DIR)
         
-        # Validate file
-        if not file.content_type.startswith("video/"):
-            raise HTTPException(status_code=400, detail="File must be a video")
+        # Identical files share one blob
+        upload = await store_blob(db, storage, upload)
+        return await complete_video_upload(video_doc, upload, current_user)
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Video upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+# Resumable uploads: create a session, PUT chunks at offsets, then finalize
+def upload_session_response(session: UploadSession) -> dict:
+    return {
+        "session_id": session.id,
+        "video_id": session.video_id,
+        "offset": session.offset,
+        "total_size": session.total_size,
+        "status": session.status,
+        "expires_at": session.expires_at
+    }
+
+@api_router.post("/upload/video/{video_id}/resumable")
+async def create_resumable_upload(
+    video_id: str,
+    upload_request: ResumableUploadRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Start a resumable upload for a video"""
+    try:
+        await get_pending_upload_video(video_id, current_user)
         
-        file_size = 0
-        temp_file_path = None
+        session = await create_upload_session(
+            db,
+            UPLOAD_DIR,
+            video_id,
+            current_user.id,
+            upload_request.filename,
+            upload_request.content_type,
+            upload_request.total_size
+        )
         
-        try:
-            # Save file
-            file_extension = Path(file.filename).suffix
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            file_path = UPLOAD_DIR / unique_filename
-            
-            async with aiofiles.open(file_path, 'wb') as f:
-                while chunk := await file.read(1024 * 1024):  # 1MB chunks
-                    file_size += len(chunk)
-                    await f.write(chunk)
-                    
-                    # Check file size limit (100MB)
-                    if file_size > 100 * 1024 * 1024:
-                        await f.close()
-                        os.remove(file_path)
-                        raise HTTPException(status_code=400, detail="File too large (max 100MB)")
-            
-            # Spend credits (30 credits per video)
-            required_credits = 30
-            remaining_credits = await auth_manager.spend_credits(
-                current_user.id,
-                required_credits,
-                f"Video upload: {video_doc['title']}",
-                video_id
-            )
-            
-            # Update video record
-            await db.videos.update_one(
-                {"id": video_id},
-                {
-                    "$set": {
-                        "filename": unique_filename,
-                        "file_path": str(file_path),
-                        "file_size": file_size,
-                        "is_paid": True,
-                        "upload_date": datetime.utcnow(),
-                        "published_at": datetime.utcnow()
-                    }
-                }
+        return upload_session_response(session)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Resumable upload creation failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create upload: {str(e)}")
+
+@api_router.get("/upload/resumable/{session_id}")
+async def get_resumable_upload(session_id: str, current_user: User = Depends(get_current_user)):
+    """Get the offset a resumable upload should continue from"""
+    try:
+        session = await get_upload_session(db, session_id, current_user.id)
+        return upload_session_response(session)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get upload: {str(e)}")
+
+@api_router.put("/upload/resumable/{session_id}")
+async def append_resumable_upload(
+    session_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Append the request body at the offset given in the Upload-Offset header"""
+    try:
+        offset = request.headers.get("upload-offset", "")
+        if not offset.isdigit():
+            raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+        
+        new_offset = await append_upload_chunk(db, session_id, current_user.id, int(offset), request)
+        
+        return {"session_id": session_id, "offset": new_offset}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Resumable upload chunk failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to store chunk: {str(e)}")
+
+@api_router.post("/upload/resumable/{session_id}/finalize")
+async def finalize_resumable_upload(session_id: str, current_user: User = Depends(get_current_user)):
+    """Finish a resumable upload and spend credits"""
+    try:
+        session = await get_upload_session(db, session_id, current_user.id)
+        video_doc = await get_pending_upload_video(session.video_id, current_user)
+        
+        # Check credits before the partial file is consumed, so the client can top up and retry
+        user_credits = await auth_manager.get_user_credits(current_user.id)
+        if user_credits < UPLOAD_CREDITS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient credits. You have {user_credits} credits, need {UPLOAD_CREDITS}"
             )
-            
-            # Update competition round stats
-            await db.competition_rounds.update_one(
-                {"id": await get_current_competition_round()},
-                {
-                    "$inc": {
-                        "total_revenue": 30.0,
-                        "total_videos": 1,
-                        "prize_pool": 21.0  # 70% of 30 THB
-                    }
-                }
+        
+        # A retry after a failed publish picks up the blob the first attempt stored
+        upload = await claim_stored_upload(db, session_id, current_user.id)
+        if upload is None:
+            upload = await finalize_upload_session(db, session_id, current_user.id, UPLOAD_DIR)
+            upload = await store_blob(db, storage, upload)
+            await record_stored_upload(db, session_id, upload)
+        
+        try:
+            result = await complete_video_upload(video_doc, upload, current_user, release_on_failure=False)
+        except BaseException:
+            await release_upload_session(db, session_id)
+            raise
+        await mark_upload_session_finalized(db, session_id)
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Resumable upload finalize failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+# Direct uploads: initiate returns a presigned PUT URL, the client uploads, then finalizes
+def direct_upload_response(session: UploadSession) -> dict:
+    return {
+        "session_id": session.id,
+        "upload_url": storage.presign(
+            session.storage_key,
+            "PUT",
+            expires_in=DIRECT_UPLOAD_URL_TTL_SECONDS,
+            content_type=session.content_type,
+            content_length=session.total_size,
+            checksum_sha256=session.content_hash
+        ),
+        "method": "PUT",
+        "headers": storage.presign_headers(session.content_type, session.total_size, session.content_hash),
+        "url_expires_at": datetime.utcnow() + timedelta(seconds=DIRECT_UPLOAD_URL_TTL_SECONDS),
+        "expires_at": session.expires_at
+    }
+
+async def get_direct_upload_session(session_id: str, current_user: User) -> UploadSession:
+    session = await get_upload_session(db, session_id, current_user.id)
+    if session.kind != "direct":
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+@api_router.get("/upload/direct/{session_id}")
+async def refresh_direct_upload(session_id: str, current_user: User = Depends(get_current_user)):
+    """Get a fresh upload URL for a direct upload that hasn't been finalized"""
+    try:
+        session = await get_direct_upload_session(session_id, current_user)
+        if session.status != "uploading":
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Upload session is {session.status}")
+        
+        return direct_upload_response(session)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get upload: {str(e)}")
+
+@api_router.post("/upload/direct/{session_id}/finalize")
+async def finalize_direct_video_upload(session_id: str, current_user: User = Depends(get_current_user)):
+    """Verify a file uploaded straight to storage and spend credits"""
+    try:
+        session = await get_direct_upload_session(session_id, current_user)
+        video_doc = await get_pending_upload_video(session.video_id, current_user)
+        
+        # Check credits before the upload is claimed, so the client can top up and retry
+        user_credits = await auth_manager.get_user_credits(current_user.id)
+        if user_credits < UPLOAD_CREDITS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient credits. You have {user_credits} credits, need {UPLOAD_CREDITS}"
             )
+        
+        # A retry after a failed publish picks up the blob the first attempt registered
+        upload = await claim_stored_upload(db, session_id, current_user.id)
+        if upload is None:
+            upload = await finalize_direct_upload(db, storage, session_id, current_user.id)
+            upload = await register_blob(db, storage, upload)
+            await record_stored_upload(db, session_id, upload)
+        
+        try:
+            result = await complete_video_upload(video_doc, upload, current_user, release_on_failure=False)
+        except BaseException:
+            await release_upload_session(db, session_id)
+            raise
+        await mark_upload_session_finalized(db, session_id)
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Direct upload finalize failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+# Signed object URLs for the local storage driver (S3-compatible stores serve their own)
+def verify_storage_url(method: str, key: str, request: Request) -> dict:
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    params = storage.verify_url(method, key, dict(request.query_params))
+    if params is None:
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    return params
+
+@api_router.put("/storage/{key:path}")
+async def put_storage_object(key: str, request: Request):
+    """Accept a presigned upload, checking it against the signed size, type and hash"""
+    try:
+        params = verify_storage_url("PUT", key, request)
+        
+        content_type = request.headers.get("content-type", "")
+        if params.get("content_type") and content_type != params["content_type"]:
+            raise HTTPException(status_code=403, detail="Content-Type does not match the signed upload")
+        
+        max_bytes = int(params.get("content_length", MAX_UPLOAD_BYTES))
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise HTTPException(status_code=413, detail="Body exceeds the signed upload size")
+        
+        # Stage beside the other uploads and only move into place once verified
+        staging_path = UPLOAD_DIR / f"{uuid.uuid4()}.part"
+        size, content_hash = await write_request_body(request, staging_path, max_bytes)
+        try:
+            if "content_length" in params and size != max_bytes:
+                raise HTTPException(status_code=400, detail="Body size does not match the signed upload")
+            if params.get("sha256") and content_hash != params["sha256"]:
+                raise HTTPException(status_code=400, detail="Body SHA-256 does not match the signed upload")
             
-            return {
-                "message": "Video uploaded successfully!",
-                "video_id": video_id,
-                "filename": unique_filename,
-                "file_size": file_size,
-                "credits_spent": required_credits,
-                "remaining_credits": remaining_credits
-            }
-            
-        except Exception as e:
-            # Clean up file if something went wrong
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-            raise e
-            
+            await storage.put_file(key, staging_path, content_type)
+        finally:
+            if staging_path.exists():
+                os.remove(staging_path)
+        
+        return Response(status_code=200, headers={"ETag": f'"{content_hash}"'})
+        
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Video upload failed: {str(e)}")
+        logger.error(f"Storage upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@api_router.api_route("/storage/{key:path}", methods=["GET", "HEAD"])
+async def get_storage_object(key: str, request: Request):
+    """Serve an object through a presigned URL"""
+    verify_storage_url("GET", key, request)
+    path = storage.local_path(key)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Not found")
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return await conditional_file_response(request, path, media_type)
+
 @api_router.get("/videos")
 async def get_videos(limit: int = 50, offset: int = 0):
     """Get videos for current competition round"""
@@ -994,7 +1412,7 @@ async def get_videos(limit: int = 50, offset: int = 0):
         }).sort("view_count", -1).skip(offset).limit(limit).to_list(limit)
         
         # Serialize videos to remove ObjectId issues
-        serialized_videos = [serialize_doc(video) for video in videos]
+        serialized_videos = [public_video(video) for video in videos]
         
         return {"videos": serialized_videos, "total": len(serialized_videos)}
         
@@ -1009,29 +1427,164 @@ async def get_video(video_id: str):
         if not video:
             raise HTTPException(status_code=404, detail="Video not found")
         
-        return serialize_doc(video)
+        return public_video(video)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/video/{video_id}/stream")
-async def stream_video(video_id: str):
-    """Stream video file"""
+async def stored_media_response(
+    request: Request,
+    key: str,
+    media_type: str,
+    extra_headers: Optional[dict] = None,
+    redirect: bool = True
+):
+    """Serve a derived media object from local disk, a presigned redirect, or a proxied stream"""
+    file_path = storage.local_path(key)
+    if file_path:
+        if VIDEO_ACCEL_REDIRECT_PREFIX:
+            response = accel_redirect_response(file_path, UPLOAD_ROOT, VIDEO_ACCEL_REDIRECT_PREFIX, media_type)
+            if response:
+                return response
+        return await conditional_file_response(request, file_path, media_type, extra_headers=extra_headers)
+    
+    if redirect and not STORAGE_PROXY_STREAMS:
+        url = storage.presign(key, "GET", expires_in=STREAM_URL_TTL_SECONDS)
+        if url:
+            return RedirectResponse(url, status_code=302, headers={"cache-control": "private, max-age=60"})
+    return await storage_object_response(request, storage, key, media_type, extra_headers=extra_headers)
+
+@api_router.api_route("/video/{video_id}/stream", methods=["GET", "HEAD"])
+async def stream_video(video_id: str, request: Request):
+    """Stream video file with Range and conditional request support"""
     try:
         video = await db.videos.find_one({"id": video_id})
-        if not video or not video.get("file_path"):
+        if not video or not (video.get("file_path") or video.get("storage_key")):
             raise HTTPException(status_code=404, detail="Video not found")
         
-        file_path = Path(video["file_path"])
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Video file not found")
+        media_type = video.get("content_type") or mimetypes.guess_type(video["filename"])[0] or "video/mp4"
+        
+        storage_key = video.get("storage_key")
+        file_path = storage.local_path(storage_key) if storage_key else Path(video["file_path"])
+        if not file_path:
+            # Remote object: send the client to storage, or proxy when storage isn't reachable by clients
+            if not STORAGE_PROXY_STREAMS:
+                url = storage.presign(storage_key, "GET", expires_in=STREAM_URL_TTL_SECONDS)
+                if url:
+                    return RedirectResponse(url, status_code=302, headers={"cache-control": "private, max-age=60"})
+            return await storage_object_response(
+                request, storage, storage_key, media_type,
+                content_hash=video.get("content_hash"),
+                filename=video["filename"]
+            )
         
-        return FileResponse(
+        # Let nginx send the bytes when it fronts the uploads directory
+        if VIDEO_ACCEL_REDIRECT_PREFIX:
+            response = accel_redirect_response(file_path, UPLOAD_ROOT, VIDEO_ACCEL_REDIRECT_PREFIX, media_type, video["filename"])
+            if response:
+                return response
+        
+        return await conditional_file_response(
+            request,
             file_path,
-            media_type="video/mp4",
+            media_type,
+            content_hash=video.get("content_hash"),
             filename=video["filename"]
         )
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.api_route("/video/{video_id}/hls/{path:path}", methods=["GET", "HEAD"])
+async def stream_video_hls(video_id: str, path: str, request: Request):
+    """Serve HLS manifests, segments and the poster frame of a transcoded video"""
+    try:
+        video = await db.videos.find_one({"id": video_id}, {"_id": 0, "id": 1, "transcode_status": 1, "hls_prefix": 1})
+        if not video or video.get("transcode_status") != "ready":
+            raise HTTPException(status_code=404, detail="Video stream not found")
+        
+        key = resolve_hls_key(video.get("hls_prefix") or video_hls_prefix(video_id), path)
+        if not key:
+            raise HTTPException(status_code=404, detail="Video stream not found")
+        
+        # Playlists reference segments by relative path, so they must come from this URL, not a presigned one
+        media_type = HLS_MEDIA_TYPES[Path(key).suffix]
+        return await stored_media_response(request, key, media_type, redirect=not key.endswith(".m3u8"))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/video/{video_id}/preview/{name}")
+async def get_video_preview(video_id: str, name: str, request: Request):
+    """Serve the probed thumbnail or scrub sprite of a video"""
+    try:
+        video = await db.videos.find_one({"id": video_id}, {"_id": 0, "id": 1})
+        if not video or name not in PREVIEW_FILES:
+            raise HTTPException(status_code=404, detail="Preview not found")
+        
+        return await stored_media_response(
+            request,
+            preview_key(video_id, name),
+            "image/jpeg",
+            extra_headers={"cache-control": "public, max-age=86400"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/video/{video_id}/thumb")
+async def get_video_thumbnail(
+    video_id: str,
+    request: Request,
+    size: str = "medium",
+    format: Optional[str] = None,
+    v: Optional[str] = None
+):
+    """Serve a resized WebP/JPEG thumbnail; versioned URLs are cacheable forever"""
+    try:
+        if size not in THUMB_SIZES:
+            raise HTTPException(status_code=400, detail=f"Unknown size, expected one of {list(THUMB_SIZES)}")
+        if format and format not in THUMB_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format, expected one of {list(THUMB_FORMATS)}")
+        
+        video = await db.videos.find_one({"id": video_id}, {"_id": 0, "content_hash": 1, "thumbnail_key": 1, "probed_at": 1})
+        if not video or not video.get("thumbnail_key"):
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+        
+        version = thumbnail_version(video)
+        if not version:
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+        
+        # Pick WebP for clients that accept it unless a format was asked for
+        headers = {}
+        image_format = format
+        if not image_format:
+            image_format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+            headers["vary"] = "Accept"
+        
+        path = await thumbnail_cache.get(
+            cache_key(video_id, version, size, image_format),
+            video["thumbnail_key"],
+            THUMB_SIZES[size],
+            image_format
+        )
+        
+        # Only a URL carrying the current version may be cached forever
+        if v == version:
+            headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            headers["cache-control"] = "public, max-age=300"
+        
+        return await conditional_file_response(request, path, THUMB_FORMATS[image_format][1], extra_headers=headers)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1044,11 +1597,16 @@ async def get_personalized_feed(
     """Get personalized video feed using recommendation algorithm"""
     try:
         engine = await get_algorithm_engine()
-        feed = await engine.get_personalized_feed(user_id, limit)
+        
+        # Pin one config for the whole request so a hot reload can't mix versions
+        config_revision, config = await config_provider.get_active()
+        feed = await engine.get_personalized_feed(user_id, limit, config=config)
         
         return {
             "feed": feed,
-            "algorithm_version": algorithm_version,
+            "algorithm_version": config.version,
+            "config_id": config.id,
+            "config_revision": config_revision,
             "total_items": len(feed)
         }
         
@@ -1064,59 +1622,155 @@ async def record_interaction(
 ):
     """Record user interaction and update algorithm"""
     try:
-        engine = await get_algorithm_engine()
+        buffer = await get_interaction_buffer()
         
-        # Record interaction
+        # Queue interaction, metrics and preferences are written behind in bulk
         interaction = VideoInteraction(
             video_id=video_id,
             user_id=user_id,
             interaction_type=interaction_type,
             value=value
         )
-        await db.video_interactions.insert_one(interaction.dict())
-        
-        # Update video metrics
-        await engine.update_video_metrics(video_id, interaction_type, value)
-        
-        # Learn user preferences if user is logged in
-        if user_id:
-            await engine.learn_user_preferences(user_id, video_id, interaction_type, value)
+        await buffer.add(interaction)
         
         return {"message": "Interaction recorded successfully"}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to record interaction: {str(e)}")
 
+# Batch interaction ingestion limits
+INTERACTION_BATCH_MAX_EVENTS = int(os.environ.get('INTERACTION_BATCH_MAX_EVENTS', '500'))
+INTERACTION_BATCH_MAX_BYTES = int(os.environ.get('INTERACTION_BATCH_MAX_BYTES', str(1024 * 1024)))
+INTERACTION_TYPES = {"view", "like", "comment", "share", "watch_time"}
+interaction_list_adapter = TypeAdapter(List[VideoInteraction])
+
+async def read_interaction_batch_body(request: Request) -> bytes:
+    """Read a (possibly gzip/deflate compressed) request body within the batch size limit"""
+    encoding = request.headers.get("content-encoding", "identity").strip().lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        decompressor = zlib.decompressobj()
+    elif encoding == "identity":
+        decompressor = None
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content encoding: {encoding}")
+    
+    body = bytearray()
+    try:
+        async for chunk in request.stream():
+            if decompressor:
+                # Bound the output so a small compressed body can't expand without limit
+                chunk = decompressor.decompress(chunk, INTERACTION_BATCH_MAX_BYTES + 1 - len(body))
+                if decompressor.unconsumed_tail:
+                    raise HTTPException(status_code=413, detail="Interaction batch too large")
+            body.extend(chunk)
+            if len(body) > INTERACTION_BATCH_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Interaction batch too large")
+        if decompressor:
+            body.extend(decompressor.flush())
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid compressed body")
+    
+    return bytes(body)
+
+@api_router.post("/interactions/batch")
+async def record_interactions_batch(request: Request):
+    """Record a batch of interactions with one insert and grouped algorithm updates"""
+    try:
+        body = await read_interaction_batch_body(request)
+        
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        
+        # Accept a bare array or {"interactions": [...]}
+        if isinstance(payload, dict):
+            payload = payload.get("interactions")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected an array of interactions")
+        if len(payload) > INTERACTION_BATCH_MAX_EVENTS:
+            raise HTTPException(status_code=413, detail=f"At most {INTERACTION_BATCH_MAX_EVENTS} interactions per batch")
+        
+        # Validate the whole batch in one pass
+        try:
+            interactions = interaction_list_adapter.validate_python(payload)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        
+        invalid = [i for i, interaction in enumerate(interactions) if interaction.interaction_type not in INTERACTION_TYPES]
+        if invalid:
+            raise HTTPException(status_code=422, detail=f"Unknown interaction type at positions {invalid}")
+        
+        if interactions:
+            buffer = await get_interaction_buffer()
+            await buffer.write(interactions)
+        
+        return {"message": "Interactions recorded successfully", "count": len(interactions)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to record interactions: {str(e)}")
+
 @api_router.get("/leaderboard")
-async def get_leaderboard():
-    """Get current competition leaderboard"""
+async def get_leaderboard(request: Request, offset: int = 0, limit: int = 100):
+    """Get current competition leaderboard, served from the in-memory projection"""
     try:
-        round_id = await get_current_competition_round()
+        if offset < 0 or limit < 1:
+            raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+        limit = min(limit, LEADERBOARD_SIZE)
         
-        # Get top 1000 videos by views
-        top_videos = await db.videos.find({
-            "competition_round": round_id,
-            "is_paid": True,
-            "filename": {"$ne": ""}
-        }).sort("view_count", -1).limit(1000).to_list(1000)
+        board = await leaderboard.current()
+        headers = {"ETag": board.etag, "Cache-Control": "public, no-cache"}
         
-        # Get competition round info
-        competition = await db.competition_rounds.find_one({"id": round_id})
+        if etag_matches(request.headers.get("if-none-match", ""), board.etag, weak=True):
+            return Response(status_code=304, headers=headers)
         
-        # Serialize data
-        serialized_videos = [serialize_doc(video) for video in top_videos]
-        serialized_competition = serialize_doc(competition)
+        return Response(await leaderboard.page(board, offset, limit), media_type="application/json", headers=headers)
         
-        return {
-            "leaderboard": serialized_videos,
-            "competition_info": {
-                "round_id": round_id,
-                "end_date": serialized_competition["end_date"] if serialized_competition else None,
-                "total_prize_pool": serialized_competition["prize_pool"] if serialized_competition else 0,
-                "total_videos": serialized_competition["total_videos"] if serialized_competition else 0
-            }
-        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/leaderboard/me")
+async def get_my_leaderboard_ranks(current_user: User = Depends(get_current_user)):
+    """Get the current round's ranks of the current user's videos"""
+    try:
+        board = await leaderboard.current()
+        videos = await db.videos.find(
+            {"user_id": current_user.id, "competition_round": board.round_id, "is_paid": True},
+            {"_id": 0, "id": 1, "title": 1}
+        ).to_list(None)
+        
+        ranks = []
+        for video in videos:
+            entry = board.rank_of(video["id"])
+            if entry:
+                ranks.append({**entry, "title": video.get("title")})
+        ranks.sort(key=lambda entry: entry["rank"])
+        
+        return {"round_id": board.round_id, "total": len(board.ranking), "videos": ranks}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/leaderboard/rank/{video_id}")
+async def get_video_rank(video_id: str):
+    """Get a video's rank in the current round"""
+    try:
+        board = await leaderboard.current()
+        entry = board.rank_of(video_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Video is not ranked in the current round")
+        return entry
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1148,8 +1802,12 @@ async def stripe_webhook(request: Request):
             if video_id:
                 await db.videos.update_one(
                     {"id": video_id},
-                    {"$set": {"is_paid": True}}
+                    {"$set": {"is_paid": True, "last_updated": datetime.utcnow()}}
                 )
+                
+                # Add the video to the score index so it can show up in feeds
+                engine = await get_algorithm_engine()
+                await engine.update_score_index([video_id])
         
         return {"status": "success"}
         
@@ -1179,6 +1837,77 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def score_index_sweeper():
+    """Periodically recompute the score index of the active competition in one worker"""
+    while True:
+        try:
+            competition = await db.competitions.find_one({"status": "active"})
+            engine = await get_algorithm_engine()
+            # One worker sweeps per interval
+            if competition and await claim_lease(db, SCORE_SWEEP_LEASE, engine.owner, SCORE_SWEEP_INTERVAL_SECONDS):
+                await engine.refresh_score_index(competition["id"], competition)
+        except Exception as e:
+            logger.error(f"Score index sweep failed: {str(e)}")
+        
+        await asyncio.sleep(SCORE_SWEEP_INTERVAL_SECONDS)
+
+async def dirty_score_sweeper():
+    """Rescore the videos this worker's interactions touched since the last pass"""
+    while True:
+        await asyncio.sleep(SCORE_DIRTY_INTERVAL_SECONDS)
+        try:
+            engine = await get_algorithm_engine()
+            await engine.rescore_dirty()
+        except Exception as e:
+            logger.error(f"Dirty score sweep failed: {str(e)}")
+
+async def upload_session_sweeper():
+    """Periodically delete resumable uploads left past their TTL"""
+    while True:
+        try:
+            expired = await expire_upload_sessions(db, storage)
+            if expired:
+                logger.info(f"Removed {expired} expired upload sessions")
+        except Exception as e:
+            logger.error(f"Upload session sweep failed: {str(e)}")
+        
+        await asyncio.sleep(UPLOAD_SESSION_SWEEP_INTERVAL_SECONDS)
+
+async def payment_archive_sweeper():
+    """Periodically move completed payment sessions into monthly archives"""
+    while True:
+        try:
+            archived = await archive_payment_sessions(db)
+            if archived:
+                logger.info(f"Archived {archived} completed payment sessions")
+        except Exception as e:
+            logger.error(f"Payment session archiving failed: {str(e)}")
+        
+        await asyncio.sleep(PAYMENT_ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await check_indexes(db)
+    background_tasks.append(asyncio.create_task(score_index_sweeper()))
+    background_tasks.append(asyncio.create_task(dirty_score_sweeper()))
+    background_tasks.append(asyncio.create_task(upload_session_sweeper()))
+    background_tasks.append(asyncio.create_task(payment_archive_sweeper()))
+    await media_pipeline.start()
+    background_tasks.append(asyncio.create_task(config_provider.watch()))
+    background_tasks.append(asyncio.create_task(leaderboard.watch()))
+    competition_job_runner.start()
+    await get_interaction_buffer()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    
+    await media_pipeline.stop()
+    await competition_job_runner.stop()
+    
+    # Write out queued interactions before the connection goes away
+    if interaction_buffer:
+        await interaction_buffer.stop()
+    
     client.close()
\ No newline at end of file
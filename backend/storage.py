@@ -0,0 +1,465 @@
+# Pluggable Video Storage Backends
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import quote, urlencode
+
+import aiofiles
+import httpx
+
+# Storage settings
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+LOCAL_STORAGE_ROOT = Path(os.environ.get('LOCAL_STORAGE_ROOT', str(Path(__file__).parent / "uploads")))
+STORAGE_CHUNK_SIZE = 1024 * 1024
+S3_DELETE_CONCURRENCY = 16
+
+# Signed URLs for the local driver, served by the API's /storage endpoint
+STORAGE_SIGNING_KEY = os.environ.get('STORAGE_SIGNING_KEY', 'pego_storage_signing_key')
+LOCAL_STORAGE_URL_PREFIX = os.environ.get('LOCAL_STORAGE_URL_PREFIX', '/api/storage')
+
+class StorageObject:
+    """Metadata of a stored object"""
+
+    def __init__(
+        self,
+        key: str,
+        size: int,
+        last_modified: Optional[datetime] = None,
+        etag: Optional[str] = None,
+        sha256: Optional[str] = None
+    ):
+        self.key = key
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+        self.sha256 = sha256  # Hex digest when the store verified and reports one
+
+class StorageBackend:
+    """Interface every storage driver implements; keys are relative, slash-separated paths"""
+
+    name = "base"
+
+    async def put_file(self, key: str, path: Path, content_type: Optional[str] = None):
+        """Store a local file under key, consuming the local file"""
+        raise NotImplementedError
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> int:
+        """Store a stream of bytes under key and return its size"""
+        raise NotImplementedError
+
+    async def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield bytes start..end (inclusive) of an object"""
+        raise NotImplementedError
+        yield b""
+
+    async def stat(self, key: str) -> Optional[StorageObject]:
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def move(self, source: str, key: str):
+        """Rename an object within the store, replacing any object at key"""
+        raise NotImplementedError
+
+    async def delete_prefix(self, prefix: str):
+        """Delete every object whose key starts with prefix/"""
+        raise NotImplementedError
+
+    async def get_file(self, key: str, path: Path):
+        """Copy an object to a local file, replacing it atomically"""
+        tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in self.get_range(key):
+                    await f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+
+    def presign(
+        self,
+        key: str,
+        method: str = "GET",
+        expires_in: int = 3600,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        checksum_sha256: Optional[str] = None
+    ) -> Optional[str]:
+        """Time-limited URL for direct client access, or None when the driver can't offer one.
+
+        For PUT, the content type, length and SHA-256 (hex) are bound into the signature.
+        """
+        return None
+
+    def presign_headers(
+        self,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        checksum_sha256: Optional[str] = None
+    ) -> Dict[str, str]:
+        """Headers a client must send with a presigned PUT"""
+        headers = {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        return headers
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path of an object when it lives on this node's disk"""
+        return None
+
+class LocalStorage(StorageBackend):
+    """Objects stored as files under a root directory"""
+
+    name = "local"
+
+    def __init__(self, root: Path = LOCAL_STORAGE_ROOT):
+        self.root = Path(root)
+
+    def local_path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Storage key escapes the storage root: {key}")
+        return path
+
+    async def put_file(self, key: str, path: Path, content_type: Optional[str] = None):
+        target = self.local_path(key)
+        os.makedirs(target.parent, exist_ok=True)
+        # Rename is atomic and, on the same filesystem, copies nothing
+        await asyncio.to_thread(shutil.move, str(path), str(target))
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> int:
+        target = self.local_path(key)
+        os.makedirs(target.parent, exist_ok=True)
+        tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    await f.write(chunk)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+        return size
+
+    async def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self.local_path(key), "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(STORAGE_CHUNK_SIZE if remaining is None else min(STORAGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def stat(self, key: str) -> Optional[StorageObject]:
+        try:
+            stat_result = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        return StorageObject(key, stat_result.st_size, datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc))
+
+    async def delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    async def move(self, source: str, key: str):
+        target = self.local_path(key)
+        os.makedirs(target.parent, exist_ok=True)
+        os.replace(self.local_path(source), target)
+
+    async def delete_prefix(self, prefix: str):
+        await asyncio.to_thread(shutil.rmtree, self.local_path(prefix), True)
+
+    @staticmethod
+    def _url_signature(method: str, key: str, params: Dict[str, str]) -> str:
+        message = "\n".join([method, key] + [f"{name}={params[name]}" for name in sorted(params)])
+        return hmac.new(STORAGE_SIGNING_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    def presign(
+        self,
+        key: str,
+        method: str = "GET",
+        expires_in: int = 3600,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        checksum_sha256: Optional[str] = None
+    ) -> str:
+        params = {"expires": str(int(time.time()) + expires_in)}
+        if content_type:
+            params["content_type"] = content_type
+        if content_length is not None:
+            params["content_length"] = str(content_length)
+        if checksum_sha256:
+            params["sha256"] = checksum_sha256
+        params["signature"] = self._url_signature(method, key, params)
+        return f"{LOCAL_STORAGE_URL_PREFIX}/{quote(key)}?{urlencode(params)}"
+
+    def verify_url(self, method: str, key: str, query: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Signed parameters of a URL made by presign, or None if it is forged or expired"""
+        params = {name: value for name, value in query.items() if name in ("expires", "content_type", "content_length", "sha256")}
+        signature = query.get("signature", "")
+        if not hmac.compare_digest(signature, self._url_signature(method, key, params)):
+            return None
+        if not params.get("expires", "").isdigit() or int(params["expires"]) < time.time():
+            return None
+        return params
+
+# AWS Signature Version 4
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, R2...), signed with SigV4 over httpx"""
+
+    name = "s3"
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        access_key_id: str,
+        secret_access_key: str,
+        region: str = "us-east-1",
+        public_endpoint_url: Optional[str] = None
+    ):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.public_endpoint_url = (public_endpoint_url or endpoint_url).rstrip("/")
+        self.bucket = bucket
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=300.0, write=300.0))
+        return self._client
+
+    def _canonical_path(self, key: str) -> str:
+        # Path-style addressing works with every S3-compatible server
+        return f"/{_uri_encode(self.bucket)}/{_uri_encode(key, safe='-_.~/')}"
+
+    def _signing_key(self, date_stamp: str) -> bytes:
+        key = _hmac(f"AWS4{self.secret_access_key}".encode(), date_stamp)
+        key = _hmac(key, self.region)
+        key = _hmac(key, "s3")
+        return _hmac(key, "aws4_request")
+
+    def _signature(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], payload_hash: str, amz_date: str) -> str:
+        canonical_query = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items()))
+        signed_headers = ";".join(sorted(headers))
+        canonical_headers = "".join(f"{name}:{headers[name].strip()}\n" for name in sorted(headers))
+        canonical_request = "\n".join([method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+
+        date_stamp = amz_date[:8]
+        scope = f"{date_stamp}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        return hmac.new(self._signing_key(date_stamp), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _signed_headers(
+        self,
+        method: str,
+        key: str,
+        extra_headers: Optional[Dict[str, str]] = None,
+        query: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        host = httpx.URL(self.endpoint_url).netloc.decode()
+        headers = {
+            "host": host,
+            "x-amz-content-sha256": "UNSIGNED-PAYLOAD",
+            "x-amz-date": amz_date,
+            **{name.lower(): value for name, value in (extra_headers or {}).items()}
+        }
+        signature = self._signature(method, self._canonical_path(key), query or {}, headers, "UNSIGNED-PAYLOAD", amz_date)
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{amz_date[:8]}/{self.region}/s3/aws4_request, "
+            f"SignedHeaders={';'.join(sorted(headers))}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    def _url(self, key: str, base: Optional[str] = None) -> str:
+        return f"{base or self.endpoint_url}{self._canonical_path(key)}"
+
+    async def put_file(self, key: str, path: Path, content_type: Optional[str] = None):
+        size = os.path.getsize(path)
+
+        async def body():
+            async with aiofiles.open(path, "rb") as f:
+                while chunk := await f.read(STORAGE_CHUNK_SIZE):
+                    yield chunk
+
+        headers = {"content-length": str(size)}
+        if content_type:
+            headers["content-type"] = content_type
+        response = await self.client.put(self._url(key), content=body(), headers=self._signed_headers("PUT", key, headers))
+        response.raise_for_status()
+        os.remove(path)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> int:
+        # A single PUT needs a Content-Length, so spool the stream locally first
+        fd, tmp_name = tempfile.mkstemp(suffix=".upload")
+        os.close(fd)
+        size = 0
+        try:
+            async with aiofiles.open(tmp_name, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    await f.write(chunk)
+            await self.put_file(key, Path(tmp_name), content_type)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        return size
+
+    async def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        headers = {"range": f"bytes={start}-{'' if end is None else end}"}
+        async with self.client.stream("GET", self._url(key), headers=self._signed_headers("GET", key, headers)) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(STORAGE_CHUNK_SIZE):
+                yield chunk
+
+    async def stat(self, key: str) -> Optional[StorageObject]:
+        headers = self._signed_headers("HEAD", key, {"x-amz-checksum-mode": "ENABLED"})
+        response = await self.client.head(self._url(key), headers=headers)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        last_modified = response.headers.get("last-modified")
+        checksum = response.headers.get("x-amz-checksum-sha256")
+        return StorageObject(
+            key,
+            int(response.headers.get("content-length", 0)),
+            parsedate_to_datetime(last_modified) if last_modified else None,
+            response.headers.get("etag"),
+            base64.b64decode(checksum).hex() if checksum else None
+        )
+
+    async def delete(self, key: str):
+        response = await self.client.delete(self._url(key), headers=self._signed_headers("DELETE", key))
+        if response.status_code not in (200, 204, 404):
+            response.raise_for_status()
+
+    async def move(self, source: str, key: str):
+        # S3 has no rename: copy server-side, then delete the source
+        headers = self._signed_headers("PUT", key, {"x-amz-copy-source": self._canonical_path(source)})
+        response = await self.client.put(self._url(key), headers=headers)
+        response.raise_for_status()
+        # A copy can fail after the 200 status line has been sent
+        if b"<Error>" in response.content:
+            raise RuntimeError(f"Copying {source} to {key} failed: {response.text}")
+        await self.delete(source)
+
+    async def list_keys(self, prefix: str) -> AsyncIterator[str]:
+        """Yield the keys starting with prefix, a page of ListObjectsV2 at a time"""
+        namespace = {"s3": "http://s3.amazonaws.com/doc/2006-03-01/"}
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            query_string = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items()))
+            response = await self.client.get(
+                f"{self._url('')}?{query_string}",
+                headers=self._signed_headers("GET", "", query=query)
+            )
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            for element in root.findall("s3:Contents/s3:Key", namespace):
+                yield element.text
+            token = root.findtext("s3:NextContinuationToken", namespaces=namespace)
+            if root.findtext("s3:IsTruncated", namespaces=namespace) != "true" or not token:
+                return
+            query["continuation-token"] = token
+
+    async def delete_prefix(self, prefix: str):
+        keys = [key async for key in self.list_keys(f"{prefix.rstrip('/')}/")]
+        for start in range(0, len(keys), S3_DELETE_CONCURRENCY):
+            await asyncio.gather(*(self.delete(key) for key in keys[start:start + S3_DELETE_CONCURRENCY]))
+
+    def presign_headers(
+        self,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        checksum_sha256: Optional[str] = None
+    ) -> Dict[str, str]:
+        headers = super().presign_headers(content_type, content_length)
+        if checksum_sha256:
+            headers["x-amz-checksum-sha256"] = base64.b64encode(bytes.fromhex(checksum_sha256)).decode()
+        return headers
+
+    def presign(
+        self,
+        key: str,
+        method: str = "GET",
+        expires_in: int = 3600,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        checksum_sha256: Optional[str] = None
+    ) -> str:
+        amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        # Presigned URLs are used by clients, so sign for the public endpoint's host
+        host = httpx.URL(self.public_endpoint_url).netloc.decode()
+        headers = {"host": host}
+        # Bind the upload's headers into the signature; the store rejects a body whose SHA-256 doesn't match
+        for name, value in self.presign_headers(content_type, content_length, checksum_sha256).items():
+            headers[name.lower()] = value
+
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key_id}/{amz_date[:8]}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_in),
+            "X-Amz-SignedHeaders": ";".join(sorted(headers)),
+        }
+        signature = self._signature(method, self._canonical_path(key), query, headers, "UNSIGNED-PAYLOAD", amz_date)
+        query["X-Amz-Signature"] = signature
+        query_string = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items()))
+        return f"{self._url(key, self.public_endpoint_url)}?{query_string}"
+
+_storage: Optional[StorageBackend] = None
+
+def get_storage() -> StorageBackend:
+    """Storage driver selected by STORAGE_BACKEND ("local" or "s3")"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage(
+                endpoint_url=os.environ.get('S3_ENDPOINT_URL') or 'https://s3.amazonaws.com',
+                bucket=os.environ['S3_BUCKET'],
+                access_key_id=os.environ['S3_ACCESS_KEY_ID'],
+                secret_access_key=os.environ['S3_SECRET_ACCESS_KEY'],
+                region=os.environ.get('S3_REGION') or 'us-east-1',
+                public_endpoint_url=os.environ.get('S3_PUBLIC_ENDPOINT_URL') or None
+            )
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
@@ -0,0 +1,186 @@
+# Thumbnail Rendering with an On-disk LRU Cache
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image
+
+# Thumbnail settings; renders are stored under THUMB_KEY_PREFIX, the local directory only caches them
+THUMB_KEY_PREFIX = "thumbs"
+THUMB_CACHE_DIR = Path(__file__).parent / "uploads" / "thumb_cache"
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+THUMB_WORKERS = int(os.environ.get('THUMB_WORKERS', '4'))
+
+# Every worker process shares the cache directory, so recency lives in file mtimes and eviction
+# scans the directory under a lock file; each process rescans after writing this share of the budget
+THUMB_EVICT_FRACTION = 16
+THUMB_TOUCH_SECONDS = 60
+THUMB_STALE_TMP_SECONDS = 3600
+
+# Target widths; height follows the source aspect ratio
+THUMB_SIZES = {"small": 160, "medium": 320, "large": 640}
+THUMB_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+def thumbnail_version(video: Dict) -> Optional[str]:
+    """Version tag for thumbnail URLs, changing whenever the source file changes"""
+    if video.get("content_hash"):
+        return video["content_hash"][:16]
+    if video.get("probed_at"):
+        return f"{int(video['probed_at'].timestamp() * 1000):x}"
+    return None
+
+def thumbnail_url(video_id: str, version: Optional[str], size: str = "medium") -> str:
+    url = f"/api/video/{video_id}/thumb?size={size}"
+    return f"{url}&v={version}" if version else url
+
+def render_thumbnail(source: str, output_path: str, width: int, image_format: str):
+    """Resize an image to the target width (runs in a worker thread)"""
+    pil_format, _, options = THUMB_FORMATS[image_format]
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        if image.width > width:
+            height = max(round(image.height * width / image.width), 1)
+            image = image.resize((width, height), Image.LANCZOS)
+
+        # Write beside the target and rename so readers never see a partial file
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        image.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, output_path)
+
+class ThumbnailCache:
+    """Thumbnails rendered once into storage, with copies of remote ones kept on local disk in LRU order"""
+
+    def __init__(
+        self,
+        storage,
+        root: Path = THUMB_CACHE_DIR,
+        max_bytes: int = THUMB_CACHE_MAX_BYTES,
+        workers: int = THUMB_WORKERS
+    ):
+        self.storage = storage
+        self.root = root
+        self.max_bytes = max_bytes
+        self._written_bytes = max_bytes  # Scan once on the first write, for files left by earlier runs
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        os.makedirs(root, exist_ok=True)
+
+    def _touch(self, path: Path):
+        """Mark a cached file as recently used; mtime is the LRU clock since atime is rarely kept"""
+        try:
+            if time.time() - path.stat().st_mtime > THUMB_TOUCH_SECONDS:
+                os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Delete the least recently used files until the directory fits the byte budget"""
+        with open(self.root / ".lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another process is already evicting
+
+            now = time.time()
+            files = []
+            total_bytes = 0
+            for entry in os.scandir(self.root):
+                if not entry.is_file() or entry.name == ".lock":
+                    continue
+                try:
+                    stat_result = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # Only clear partial files abandoned by a dead process, not ones being written
+                    if now - stat_result.st_mtime > THUMB_STALE_TMP_SECONDS:
+                        os.remove(entry.path)
+                    continue
+                files.append((stat_result.st_mtime, entry.path, stat_result.st_size))
+                total_bytes += stat_result.st_size
+
+            files.sort()
+            for _, path, size in files[:-1]:
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+    async def _added(self, path: Path):
+        """Count a newly cached file, evicting once this process has written enough since its last scan"""
+        self._written_bytes += os.path.getsize(path)
+        if self._written_bytes >= self.max_bytes // THUMB_EVICT_FRACTION:
+            self._written_bytes = 0
+            await asyncio.get_running_loop().run_in_executor(self._pool, self._evict)
+
+    async def render(self, source_key: str, output_path: Path, width: int, image_format: str):
+        """Render a thumbnail of a stored image, fetching the image first when it is remote"""
+        os.makedirs(output_path.parent, exist_ok=True)
+        source = self.storage.local_path(source_key)
+        download = None
+        if not source:
+            download = source = self.root / f"{uuid.uuid4().hex}.source.tmp"
+            await self.storage.get_file(source_key, download)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool, render_thumbnail, str(source), str(output_path), width, image_format
+            )
+        finally:
+            if download and download.exists():
+                os.remove(download)
+
+    async def get(self, key: str, source_key: str, width: int, image_format: str) -> Path:
+        """Local path of a rendered thumbnail, rendering it into storage once on a miss"""
+        stored_key = f"{THUMB_KEY_PREFIX}/{key}"
+        stored_path = self.storage.local_path(stored_key)
+        name = key.replace("/", "-")
+        path = stored_path or self.root / name
+        if path.exists():
+            if not stored_path:
+                self._touch(path)
+            return path
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if stored_path:
+                # Storage is this node's disk, so serve the stored render directly
+                if not path.exists():
+                    await self.render(source_key, path, width, image_format)
+            elif not path.exists():
+                if await self.storage.stat(stored_key):
+                    await self.storage.get_file(stored_key, path)
+                else:
+                    await self.render(source_key, path, width, image_format)
+                    copy = self.root / f"{name}.{uuid.uuid4().hex}.tmp"
+                    try:
+                        await asyncio.to_thread(shutil.copyfile, path, copy)
+                        await self.storage.put_file(stored_key, copy, THUMB_FORMATS[image_format][1])
+                    finally:
+                        if copy.exists():
+                            os.remove(copy)
+                await self._added(path)
+        self._locks.pop(key, None)
+        return path
+
+    async def prerender(self, video_id: str, version: str, source_key: str):
+        """Render every size and format ahead of the first request"""
+        for size, width in THUMB_SIZES.items():
+            for image_format in THUMB_FORMATS:
+                await self.get(cache_key(video_id, version, size, image_format), source_key, width, image_format)
+
+def cache_key(video_id: str, version: str, size: str, image_format: str) -> str:
+    """Key of a rendered thumbnail, grouped per video so deleting the video can drop them all"""
+    return f"{video_id}/{version}-{size}.{image_format}"
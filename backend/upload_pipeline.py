@@ -0,0 +1,527 @@
+# Streaming Video Upload Pipeline
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+import aiofiles
+from fastapi import HTTPException, Request, status
+from multipart.multipart import MultipartParser, parse_options_header
+from pymongo import ReturnDocument
+
+from blob_store import StoredUpload, discard_direct_upload, release_blob
+from models import UploadSession
+from storage import StorageBackend
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # Boundaries, part headers and small form fields
+
+# Resumable upload settings
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))
+UPLOAD_CHUNK_LEASE_SECONDS = int(os.environ.get('UPLOAD_CHUNK_LEASE_SECONDS', '300'))
+
+def too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large (max {max_bytes // (1024 * 1024)}MB)"
+    )
+
+class VideoPartWriter:
+    """Multipart callbacks that pick out the video file part and queue its bytes"""
+
+    def __init__(self):
+        self.headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.in_file_part = False
+        self.file_parts = 0
+        self.pending: List[bytes] = []
+        self.finished = False
+
+    def on_part_begin(self):
+        self.headers = {}
+        self.in_file_part = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self._header_field.decode("latin-1").lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get("content-disposition", b""))
+        if options.get(b"name") != b"file" or b"filename" not in options:
+            return
+
+        self.file_parts += 1
+        if self.file_parts > 1:
+            raise HTTPException(status_code=400, detail="Only one file may be uploaded")
+
+        content_type, _ = parse_options_header(self.headers.get("content-type", b""))
+        self.filename = options[b"filename"].decode("utf-8", "replace")
+        self.content_type = content_type.decode("latin-1")
+        if not self.content_type.startswith("video/"):
+            raise HTTPException(status_code=400, detail="File must be a video")
+
+        self.in_file_part = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.in_file_part:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self):
+        self.in_file_part = False
+
+    def on_end(self):
+        self.finished = True
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_end": self.on_end,
+        }
+
+async def stream_video_upload(request: Request, upload_dir: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """Parse a multipart upload incrementally, hashing and writing the file part as it arrives"""
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    # Reject oversized uploads before reading a single byte
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise too_large(max_bytes)
+
+    writer = VideoPartWriter()
+    parser = MultipartParser(boundary, writer.callbacks(), max_size=max_bytes + MULTIPART_OVERHEAD_BYTES)
+    digest = hashlib.sha256()
+    file_size = 0
+    body_size = 0
+
+    stem = str(uuid.uuid4())
+    part_path = upload_dir / f"{stem}.part"
+    f = None
+
+    try:
+        async for chunk in request.stream():
+            body_size += len(chunk)
+            if body_size > max_bytes + MULTIPART_OVERHEAD_BYTES:
+                raise too_large(max_bytes)
+
+            parser.write(chunk)
+
+            if writer.pending:
+                if f is None:
+                    f = await aiofiles.open(part_path, "wb")
+                for data in writer.pending:
+                    file_size += len(data)
+                    if file_size > max_bytes:
+                        raise too_large(max_bytes)
+                    digest.update(data)
+                    await f.write(data)
+                writer.pending = []
+
+        if not writer.finished:
+            raise HTTPException(status_code=400, detail="Incomplete multipart body")
+        if not writer.file_parts:
+            raise HTTPException(status_code=400, detail="No video file in upload")
+
+        if f is None:
+            f = await aiofiles.open(part_path, "wb")
+        await f.close()
+        f = None
+
+        # One atomic rename into the final location
+        filename = f"{stem}{Path(writer.filename).suffix}"
+        file_path = upload_dir / filename
+        os.replace(part_path, file_path)
+
+        return StoredUpload(filename, file_path, file_size, digest.hexdigest(), writer.content_type)
+
+    except BaseException:
+        if f is not None:
+            await f.close()
+        if part_path.exists():
+            os.remove(part_path)
+        raise
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file on disk"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def write_request_body(request: Request, path: Path, max_bytes: int) -> tuple:
+    """Stream a raw request body to a file, returning its size and SHA-256"""
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large(max_bytes)
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        if path.exists():
+            os.remove(path)
+        raise
+    return size, digest.hexdigest()
+
+async def hash_storage_object(storage: StorageBackend, key: str) -> str:
+    """SHA-256 of a stored object, read from disk when local or streamed otherwise"""
+    local_path = storage.local_path(key)
+    if local_path:
+        return await asyncio.to_thread(hash_file, local_path)
+
+    digest = hashlib.sha256()
+    async for chunk in storage.get_range(key):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def offset_conflict(detail: str, offset: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"message": detail, "offset": offset},
+        headers={"Upload-Offset": str(offset)}
+    )
+
+def check_upload_request(content_type: str, total_size: int, max_bytes: int):
+    if not content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="File must be a video")
+    if total_size <= 0:
+        raise HTTPException(status_code=400, detail="Upload size must be positive")
+    if total_size > max_bytes:
+        raise too_large(max_bytes)
+
+# Resumable uploads
+async def create_upload_session(
+    db,
+    upload_dir: Path,
+    video_id: str,
+    user_id: str,
+    filename: str,
+    content_type: str,
+    total_size: int,
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> UploadSession:
+    """Start a resumable upload backed by an empty partial file"""
+    check_upload_request(content_type, total_size, max_bytes)
+
+    session_id = str(uuid.uuid4())
+    part_path = upload_dir / f"{session_id}.part"
+    async with aiofiles.open(part_path, "wb"):
+        pass
+
+    session = UploadSession(
+        id=session_id,
+        video_id=video_id,
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        part_path=str(part_path),
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    )
+    await db.upload_sessions.insert_one(session.dict())
+    return session
+
+async def get_upload_session(db, session_id: str, user_id: str) -> UploadSession:
+    session_doc = await db.upload_sessions.find_one({"id": session_id, "user_id": user_id})
+    if not session_doc:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return UploadSession(**session_doc)
+
+async def claim_upload_session(db, session_id: str, user_id: str, offset: int, updates: dict, statuses: tuple = ("uploading",)) -> UploadSession:
+    """Atomically take an idle upload session that is at the expected offset"""
+    now = datetime.utcnow()
+    session_doc = await db.upload_sessions.find_one_and_update(
+        {
+            "id": session_id,
+            "user_id": user_id,
+            "status": {"$in": list(statuses)},
+            "offset": offset,
+            "expires_at": {"$gt": now},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": updates},
+        return_document=ReturnDocument.AFTER
+    )
+    if session_doc:
+        return UploadSession(**session_doc)
+
+    # Explain why the claim failed
+    session = await get_upload_session(db, session_id, user_id)
+    if session.status not in statuses or session.expires_at <= now:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Upload session is {session.status if session.expires_at > now else 'expired'}")
+    if session.offset != offset:
+        raise offset_conflict("Offset mismatch", session.offset)
+    if session.status != "uploading":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload session is being finalized")
+    raise offset_conflict("Another chunk is being written", session.offset)
+
+async def append_upload_chunk(db, session_id: str, user_id: str, offset: int, request: Request) -> int:
+    """Append the request body to a partial upload at the given offset and return the new offset"""
+    now = datetime.utcnow()
+    session = await claim_upload_session(
+        db, session_id, user_id, offset,
+        {"lease_until": now + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS)}
+    )
+
+    written = 0
+    accepted = True
+    try:
+        async with aiofiles.open(session.part_path, "r+b") as f:
+            # Drop any bytes past the committed offset left by an earlier failed chunk
+            await f.seek(offset)
+            await f.truncate()
+
+            async for chunk in request.stream():
+                if offset + written + len(chunk) > session.total_size:
+                    accepted = False
+                    raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload size")
+                await f.write(chunk)
+                written += len(chunk)
+    finally:
+        # Keep whatever arrived before a dropped connection so the client can resume from there
+        new_offset = offset + written if accepted else offset
+        now = datetime.utcnow()
+        await db.upload_sessions.update_one(
+            {"id": session_id},
+            {
+                "$set": {
+                    "offset": new_offset,
+                    "lease_until": None,
+                    "updated_at": now,
+                    "expires_at": now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+                }
+            }
+        )
+
+    return new_offset
+
+async def finalize_upload_session(db, session_id: str, user_id: str, upload_dir: Path) -> StoredUpload:
+    """Verify a complete partial upload, hash it and move it into place"""
+    session = await get_upload_session(db, session_id, user_id)
+    if session.offset != session.total_size:
+        raise offset_conflict("Upload is incomplete", session.offset)
+
+    # A finalize that failed after moving the file left the session finalizing
+    now = datetime.utcnow()
+    session = await claim_upload_session(
+        db, session_id, user_id, session.total_size,
+        {"status": "finalizing", "lease_until": now + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS), "updated_at": now},
+        statuses=("uploading", "finalizing")
+    )
+
+    moved = False
+    try:
+        if session.finalized_path and os.path.exists(session.finalized_path):
+            file_path = Path(session.finalized_path)
+            moved = True
+        else:
+            part_path = Path(session.part_path)
+            if os.path.getsize(part_path) != session.total_size:
+                raise HTTPException(status_code=400, detail="Stored upload size does not match")
+
+            # Recorded before the move so a retry can find the file
+            file_path = upload_dir / f"{uuid.uuid4()}{Path(session.filename).suffix}"
+            await db.upload_sessions.update_one({"id": session_id}, {"$set": {"finalized_path": str(file_path)}})
+            os.replace(part_path, file_path)
+            moved = True
+
+        file_size = os.path.getsize(file_path)
+        if file_size != session.total_size:
+            raise HTTPException(status_code=400, detail="Stored upload size does not match")
+        content_hash = await asyncio.to_thread(hash_file, file_path)
+    except BaseException:
+        # Until the file is moved the client can keep uploading; after that only finalize is retried
+        await db.upload_sessions.update_one(
+            {"id": session_id},
+            {"$set": {"status": "finalizing" if moved else "uploading", "lease_until": None}}
+        )
+        raise
+
+    return StoredUpload(file_path.name, file_path, file_size, content_hash, session.content_type)
+
+# Direct uploads: the client PUTs the whole file to a presigned storage URL
+def direct_upload_key(session_id: str) -> str:
+    return f"uploads/staging/{session_id}"
+
+async def create_direct_upload_session(
+    db,
+    video_id: str,
+    user_id: str,
+    filename: str,
+    content_type: str,
+    total_size: int,
+    content_hash: str,
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> UploadSession:
+    """Record a direct upload of a file with a declared size and hash"""
+    check_upload_request(content_type, total_size, max_bytes)
+
+    session = UploadSession(
+        video_id=video_id,
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        part_path="",
+        kind="direct",
+        content_hash=content_hash,
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    )
+    # The client only ever writes to its own session's key; the declared hash
+    # is trusted once the bytes there have been checked against it
+    session.storage_key = direct_upload_key(session.id)
+    await db.upload_sessions.insert_one(session.dict())
+    return session
+
+async def finalize_direct_upload(db, storage: StorageBackend, session_id: str, user_id: str) -> StoredUpload:
+    """Check that the object the client uploaded has the declared size and hash"""
+    # Sessions left finalizing by a worker that died mid-check are taken over once the lease runs out
+    now = datetime.utcnow()
+    session = await claim_upload_session(
+        db, session_id, user_id, 0,
+        {"status": "finalizing", "lease_until": now + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS), "updated_at": now},
+        statuses=("uploading", "finalizing")
+    )
+
+    try:
+        stored = await storage.stat(session.storage_key)
+        if stored is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="File has not been uploaded yet")
+
+        if stored.size != session.total_size:
+            await discard_direct_upload(db, storage, session.storage_key)
+            raise HTTPException(status_code=400, detail="Stored upload size does not match")
+
+        # Stores that verified the signed checksum report it; otherwise hash the object
+        content_hash = stored.sha256 or await hash_storage_object(storage, session.storage_key)
+        if content_hash != session.content_hash:
+            await discard_direct_upload(db, storage, session.storage_key)
+            raise HTTPException(status_code=400, detail="Stored upload hash does not match")
+    except BaseException:
+        await db.upload_sessions.update_one({"id": session_id}, {"$set": {"status": "uploading", "lease_until": None}})
+        raise
+
+    local_path = storage.local_path(session.storage_key)
+    return StoredUpload(
+        f"{uuid.uuid4()}{Path(session.filename).suffix}",
+        local_path or "",
+        session.total_size,
+        content_hash,
+        session.content_type,
+        storage_key=session.storage_key
+    )
+
+async def record_stored_upload(db, session_id: str, upload: StoredUpload):
+    """Remember the blob a session's file went into, so a failed publish can be retried from it"""
+    await db.upload_sessions.update_one(
+        {"id": session_id},
+        {
+            "$set": {
+                "status": "stored",
+                "stored_upload": {
+                    "filename": upload.filename,
+                    "file_path": str(upload.file_path),
+                    "file_size": upload.file_size,
+                    "content_hash": upload.content_hash,
+                    "content_type": upload.content_type,
+                    "storage_key": upload.storage_key
+                },
+                "updated_at": datetime.utcnow()
+            }
+        }
+    )
+
+async def claim_stored_upload(db, session_id: str, user_id: str) -> Optional[StoredUpload]:
+    """Take a session whose file is already in the blob store, left there by a failed publish"""
+    now = datetime.utcnow()
+    session_doc = await db.upload_sessions.find_one_and_update(
+        {
+            "id": session_id,
+            "user_id": user_id,
+            "status": "stored",
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": {"lease_until": now + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS), "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not session_doc:
+        return None
+    stored = session_doc["stored_upload"]
+    return StoredUpload(
+        stored["filename"],
+        Path(stored["file_path"]) if stored["file_path"] else "",
+        stored["file_size"],
+        stored["content_hash"],
+        stored["content_type"],
+        storage_key=stored["storage_key"]
+    )
+
+async def release_upload_session(db, session_id: str):
+    """Let the client retry a finalize that failed"""
+    await db.upload_sessions.update_one({"id": session_id}, {"$set": {"lease_until": None}})
+
+async def mark_upload_session_finalized(db, session_id: str):
+    await db.upload_sessions.update_one(
+        {"id": session_id},
+        {"$set": {"status": "finalized", "lease_until": None, "updated_at": datetime.utcnow()}}
+    )
+
+async def expire_upload_sessions(db, storage: Optional[StorageBackend] = None) -> int:
+    """Delete upload sessions past their TTL along with their partial files"""
+    now = datetime.utcnow()
+    expired = await db.upload_sessions.find(
+        {"expires_at": {"$lt": now}},
+        {"_id": 0, "id": 1, "video_id": 1, "part_path": 1, "kind": 1, "status": 1, "storage_key": 1, "finalized_path": 1, "stored_upload": 1}
+    ).to_list(None)
+
+    for session in expired:
+        if session.get("status") == "stored":
+            # Never published: give back the blob reference the session held for a retry
+            stored_key = session["stored_upload"]["storage_key"]
+            if storage and not await db.videos.find_one({"id": session["video_id"], "storage_key": stored_key}, {"_id": 1}):
+                await release_blob(db, storage, stored_key)
+        elif session.get("finalized_path") and os.path.exists(session["finalized_path"]):
+            os.remove(session["finalized_path"])
+        elif session.get("kind") == "direct":
+            # Abandoned direct uploads may have left an object that no blob references
+            if (
+                storage
+                and session.get("status") != "finalized"
+                and not await db.upload_sessions.find_one(
+                    {"storage_key": session["storage_key"], "expires_at": {"$gte": now}}, {"_id": 1}
+                )
+            ):
+                await discard_direct_upload(db, storage, session["storage_key"])
+        elif os.path.exists(session["part_path"]):
+            os.remove(session["part_path"])
+
+    if expired:
+        await db.upload_sessions.delete_many({"id": {"$in": [session["id"] for session in expired]}})
+    return len(expired)
@@ -0,0 +1,88 @@
+import asyncio
+
+from cache import TTLCache
+
+def test_concurrent_misses_load_once():
+    async def run():
+        cache = TTLCache(60)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "round-1"
+
+        values = await asyncio.gather(*(cache.get_or_load("round", loader) for _ in range(10)))
+        assert values == ["round-1"] * 10
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+def test_none_is_cached():
+    async def run():
+        cache = TTLCache(60)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            return None
+
+        assert await cache.get_or_load("competition", loader) is None
+        assert await cache.get_or_load("competition", loader) is None
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+def test_entries_expire():
+    async def run():
+        cache = TTLCache(60)
+        values = iter(["old", "new"])
+
+        async def loader():
+            return next(values)
+
+        assert await cache.get_or_load("round", loader, ttl_seconds=0) == "old"
+        assert await cache.get_or_load("round", loader) == "new"
+
+    asyncio.run(run())
+
+def test_invalidation_during_load_discards_stale_value():
+    async def run():
+        cache = TTLCache(60)
+        loading = asyncio.Event()
+        release = asyncio.Event()
+        values = iter(["stale", "fresh"])
+
+        async def loader():
+            value = next(values)
+            if value == "stale":
+                loading.set()
+                await release.wait()
+            return value
+
+        first = asyncio.create_task(cache.get_or_load("round", loader))
+        await loading.wait()
+        cache.invalidate("round")
+        release.set()
+
+        # The caller that started before the invalidation still gets its value, but it isn't cached
+        assert await first == "stale"
+        assert await cache.get_or_load("round", loader) == "fresh"
+
+    asyncio.run(run())
+
+def test_invalidate_without_keys_clears_everything():
+    cache = TTLCache(60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate()
+    assert cache._lookup("a") == (False, None)
+    assert cache._lookup("b") == (False, None)
+
+def test_invalidate_some_keys():
+    cache = TTLCache(60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache._lookup("a") == (False, None)
+    assert cache._lookup("b") == (True, 2)
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from file_responses import etag_matches, evaluate_conditions, parse_range
+
+ETAG = '"abc123"'
+MODIFIED = datetime(2026, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+LAST_MODIFIED = formatdate(MODIFIED.timestamp(), usegmt=True)
+
+def make_request(**headers) -> Request:
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("BYTES=0-0", (0, 0)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=5-1", None),
+    ("bytes=abc", None),
+    ("bytes=-0", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+def test_parse_range_past_the_end_is_unsatisfiable():
+    with pytest.raises(HTTPException) as error:
+        parse_range("bytes=1000-", 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+def test_etag_matches_weak_and_strong():
+    assert etag_matches('W/"abc123", "other"', ETAG, weak=True)
+    assert not etag_matches('W/"abc123"', ETAG, weak=False)
+    assert etag_matches("*", ETAG, weak=False)
+
+def evaluate(**headers):
+    response_headers = {}
+    not_modified, byte_range = evaluate_conditions(make_request(**headers), 1000, ETAG, MODIFIED, response_headers)
+    return not_modified, byte_range, response_headers
+
+def test_plain_request_sets_validators():
+    not_modified, byte_range, headers = evaluate()
+    assert not_modified is None and byte_range is None
+    assert headers == {"accept-ranges": "bytes", "etag": ETAG, "last-modified": LAST_MODIFIED}
+
+def test_if_none_match_returns_304():
+    not_modified, _, _ = evaluate(if_none_match=f"W/{ETAG}")
+    assert not_modified.status_code == 304
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    not_modified, _, _ = evaluate(if_none_match='"stale"', if_modified_since=LAST_MODIFIED)
+    assert not_modified is None
+
+def test_if_modified_since():
+    assert evaluate(if_modified_since=LAST_MODIFIED)[0].status_code == 304
+    assert evaluate(if_modified_since="Sat, 28 Feb 2026 12:00:00 GMT")[0] is None
+
+def test_range_sets_content_range():
+    _, byte_range, headers = evaluate(range="bytes=10-19")
+    assert byte_range == (10, 19)
+    assert headers["content-range"] == "bytes 10-19/1000"
+
+def test_if_range_must_match_current_representation():
+    assert evaluate(range="bytes=10-19", if_range=ETAG)[1] == (10, 19)
+    assert evaluate(range="bytes=10-19", if_range=LAST_MODIFIED)[1] == (10, 19)
+    assert evaluate(range="bytes=10-19", if_range='"stale"')[1] is None
+    assert evaluate(range="bytes=10-19", if_range=f"W/{ETAG}")[1] is None
+
+def test_range_ignored_for_empty_file():
+    _, byte_range = evaluate_conditions(make_request(range="bytes=0-1"), 0, ETAG, MODIFIED, {})
+    assert byte_range is None
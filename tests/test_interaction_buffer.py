@@ -0,0 +1,69 @@
+import asyncio
+
+from interaction_buffer import InteractionBuffer
+from models import VideoInteraction
+
+class RecordingBuffer(InteractionBuffer):
+    """Buffer whose batch writes are recorded, failing while the database is marked down"""
+
+    def __init__(self, **kwargs):
+        super().__init__(db=None, engine=None, flush_interval_seconds=0.01, **kwargs)
+        self.written = []
+        self.fail_after_batches = None
+
+    async def write_batch(self, events):
+        if self.fail_after_batches is not None and len(self.written) >= self.fail_after_batches:
+            raise ConnectionError("database unavailable")
+        self.written.append([event.video_id for event in events])
+
+def events(*video_ids):
+    return [VideoInteraction(video_id=video_id, interaction_type="view") for video_id in video_ids]
+
+def pending(buffer):
+    return [event.video_id for event in buffer._events]
+
+def test_failed_flush_requeues_unwritten_batches_in_order():
+    async def run():
+        buffer = RecordingBuffer(max_batch_events=2)
+        for event in events("a", "b", "c", "d", "e"):
+            await buffer.add(event)
+
+        buffer.fail_after_batches = 1
+        await buffer.flush()
+        assert buffer.written == [["a", "b"]]
+        assert pending(buffer) == ["c", "d", "e"]
+
+        await buffer.add(events("f")[0])
+        buffer.fail_after_batches = None
+        await buffer.flush()
+        assert buffer.written == [["a", "b"], ["c", "d"], ["e", "f"]]
+        assert buffer.stats() == {"pending_events": 0, "dropped_events": 0}
+
+    asyncio.run(run())
+
+def test_requeue_drops_newest_past_the_pending_limit():
+    buffer = RecordingBuffer(max_pending_events=4)
+    buffer._events = events("new1", "new2", "new3")
+    buffer.requeue(events("old1", "old2"))
+    assert pending(buffer) == ["old1", "old2", "new1", "new2"]
+    assert buffer.stats() == {"pending_events": 4, "dropped_events": 1}
+
+def test_full_buffer_applies_backpressure_until_writes_recover():
+    async def run():
+        buffer = RecordingBuffer(max_batch_events=10, max_pending_events=2)
+        buffer.fail_after_batches = 0
+        for event in events("a", "b"):
+            await buffer.add(event)
+
+        blocked = asyncio.create_task(buffer.add(events("c")[0]))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert pending(buffer) == ["a", "b"]
+
+        buffer.fail_after_batches = None
+        await asyncio.wait_for(blocked, 1)
+        assert buffer.written == [["a", "b"]]
+        assert pending(buffer) == ["c"]
+        assert buffer.dropped_events == 0
+
+    asyncio.run(run())
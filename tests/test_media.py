@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from media import master_playlist, put_directory, remove_video_media, resolve_hls_key
+from storage import LocalStorage
+
+@pytest.mark.parametrize("path, expected", [
+    ("master.m3u8", "hls/video-1/abc/master.m3u8"),
+    ("480p/seg_00001.ts", "hls/video-1/abc/480p/seg_00001.ts"),
+    ("480p/../poster.jpg", "hls/video-1/abc/poster.jpg"),
+    ("../other/master.m3u8", None),
+    ("480p/../../x.ts", None),
+    ("/etc/master.m3u8", None),
+    ("480p/index.txt", None),
+    (".", None),
+])
+def test_resolve_hls_key_stays_inside_the_prefix(path, expected):
+    assert resolve_hls_key("hls/video-1/abc", path) == expected
+
+def test_master_playlist_lists_renditions():
+    playlist = master_playlist([
+        {"name": "240p", "bandwidth": 464000, "playlist": "240p/index.m3u8"},
+        {"name": "480p", "bandwidth": 1096000, "playlist": "480p/index.m3u8"},
+    ])
+    assert playlist.splitlines() == [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        '#EXT-X-STREAM-INF:BANDWIDTH=464000,NAME="240p"',
+        "240p/index.m3u8",
+        '#EXT-X-STREAM-INF:BANDWIDTH=1096000,NAME="480p"',
+        "480p/index.m3u8",
+    ]
+
+def test_derived_media_stored_and_removed_by_prefix(tmp_path):
+    async def run():
+        storage = LocalStorage(tmp_path / "store")
+        work_dir = tmp_path / "work"
+        (work_dir / "240p").mkdir(parents=True)
+        (work_dir / "master.m3u8").write_text("#EXTM3U\n")
+        (work_dir / "240p" / "seg_00000.ts").write_bytes(b"ts")
+
+        await put_directory(storage, work_dir, "hls/video-1/abc")
+        assert (await storage.stat("hls/video-1/abc/240p/seg_00000.ts")).size == 2
+        assert not (work_dir / "master.m3u8").exists()
+
+        for key in ("previews/video-1/sprite.jpg", "thumbs/video-1/v1-small.webp", "thumbs/video-10/v1-small.webp"):
+            source = tmp_path / "file"
+            source.write_bytes(b"x")
+            await storage.put_file(key, source)
+
+        await remove_video_media(storage, "video-1")
+        assert await storage.stat("hls/video-1/abc/master.m3u8") is None
+        assert await storage.stat("previews/video-1/sprite.jpg") is None
+        assert await storage.stat("thumbs/video-1/v1-small.webp") is None
+        assert await storage.stat("thumbs/video-10/v1-small.webp") is not None
+
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from ranking import IndexableSkipList, RoundRanking
+
+def check_matches(skiplist: IndexableSkipList, expected: list):
+    assert len(skiplist) == len(expected)
+    assert skiplist.range(0, len(expected) + 5) == expected
+    for position, key in enumerate(expected):
+        assert skiplist[position] == key
+        assert skiplist.index(key) == position
+
+def test_skiplist_build_sorts_and_indexes():
+    keys = random.Random(1).sample(range(10_000), 500)
+    check_matches(IndexableSkipList(keys), sorted(keys))
+
+def test_skiplist_random_operations_match_sorted_list():
+    rng = random.Random(7)
+    skiplist = IndexableSkipList(range(0, 200, 2))
+    expected = list(range(0, 200, 2))
+    for _ in range(2000):
+        key = rng.randrange(400)
+        if key in expected:
+            skiplist.remove(key)
+            expected.remove(key)
+        else:
+            skiplist.insert(key)
+            expected.append(key)
+            expected.sort()
+    check_matches(skiplist, expected)
+
+def test_skiplist_ignores_duplicate_insert():
+    skiplist = IndexableSkipList([1, 2, 3])
+    skiplist.insert(2)
+    check_matches(skiplist, [1, 2, 3])
+
+def test_skiplist_range_slices():
+    skiplist = IndexableSkipList(range(10))
+    assert skiplist.range(3, 6) == [3, 4, 5]
+    assert skiplist.range(8, 20) == [8, 9]
+    assert skiplist.range(6, 3) == []
+    assert skiplist.range(10, 12) == []
+
+def test_skiplist_missing_keys_and_positions():
+    skiplist = IndexableSkipList([1, 3])
+    with pytest.raises(KeyError):
+        skiplist.index(2)
+    with pytest.raises(KeyError):
+        skiplist.remove(2)
+    with pytest.raises(IndexError):
+        skiplist[2]
+
+def test_skiplist_empties_out():
+    skiplist = IndexableSkipList(range(50))
+    for key in range(50):
+        skiplist.remove(key)
+    check_matches(skiplist, [])
+    skiplist.insert(5)
+    check_matches(skiplist, [5])
+
+def make_ranking():
+    start = datetime(2026, 1, 1)
+    return RoundRanking([
+        {"id": "a", "view_count": 10, "upload_date": start},
+        {"id": "b", "view_count": 30, "upload_date": start + timedelta(hours=1)},
+        {"id": "c", "view_count": 10, "upload_date": start - timedelta(hours=1)},
+    ])
+
+def test_round_ranking_orders_by_views_then_upload_date():
+    ranking = make_ranking()
+    assert ranking.range(0, 10) == ["b", "c", "a"]
+    assert [ranking.rank(video_id) for video_id in "bca"] == [1, 2, 3]
+    assert ranking.at(1) == ("b", 30)
+    assert ranking.rank("missing") is None
+
+def test_round_ranking_add_views_moves_video():
+    ranking = make_ranking()
+    assert ranking.add_views("a", 25)
+    assert ranking.range(0, 10) == ["a", "b", "c"]
+    assert ranking.view_count("a") == 35
+    assert not ranking.add_views("missing", 1)
+
+def test_round_ranking_update_keeps_upload_date():
+    ranking = make_ranking()
+    ranking.update("a", 10)
+    assert ranking.range(0, 10) == ["b", "c", "a"]
+    assert not ranking.update("a", 10)
+
+def test_round_ranking_sync_adds_moves_and_removes():
+    ranking = make_ranking()
+    listing = [
+        {"id": "a", "view_count": 50, "upload_date": datetime(2026, 1, 1)},
+        {"id": "d", "view_count": 5, "upload_date": datetime(2026, 1, 2)},
+    ]
+    assert ranking.sync(listing)
+    assert ranking.range(0, 10) == ["a", "d"]
+    assert "b" not in ranking and len(ranking) == 2
+    assert not ranking.sync(listing)
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+
+from PIL import Image
+
+from storage import LocalStorage, StorageBackend
+from thumbnails import ThumbnailCache, cache_key
+
+SOURCE_KEY = "previews/video-1/thumbnail.jpg"
+
+class RemoteStorage(StorageBackend):
+    """A store with no local paths, kept in a directory so the test can look inside"""
+
+    def __init__(self, root):
+        self.disk = LocalStorage(root)
+        self.rendered = []
+
+    async def put_file(self, key, path, content_type=None):
+        if key.startswith("thumbs/"):
+            self.rendered.append(key)
+        await self.disk.put_file(key, path, content_type)
+
+    async def get_range(self, key, start=0, end=None):
+        async for chunk in self.disk.get_range(key, start, end):
+            yield chunk
+
+    async def stat(self, key):
+        return await self.disk.stat(key)
+
+def store_source(storage, tmp_path, key=SOURCE_KEY):
+    source = tmp_path / "source.jpg"
+    Image.effect_noise((800, 450), 64).convert("RGB").save(source)
+    asyncio.run(storage.put_file(key, source))
+
+def get(cache, video_id="video-1", size="large", width=640):
+    return asyncio.run(cache.get(cache_key(video_id, "v1", size, "jpeg"), f"previews/{video_id}/thumbnail.jpg", width, "jpeg"))
+
+def test_local_storage_renders_into_the_store(tmp_path):
+    storage = LocalStorage(tmp_path / "store")
+    store_source(storage, tmp_path)
+    path = get(ThumbnailCache(storage, root=tmp_path / "cache"), size="small", width=160)
+    assert path == tmp_path / "store" / "thumbs" / "video-1" / "v1-small.jpeg"
+    assert Image.open(path).size == (160, 90)
+    assert list((tmp_path / "cache").iterdir()) == []
+
+def test_remote_renders_are_stored_once_and_shared(tmp_path):
+    storage = RemoteStorage(tmp_path / "store")
+    store_source(storage, tmp_path)
+
+    first = get(ThumbnailCache(storage, root=tmp_path / "node-a"))
+    second = get(ThumbnailCache(storage, root=tmp_path / "node-b"))
+    assert storage.rendered == ["thumbs/video-1/v1-large.jpeg"]
+    assert first.read_bytes() == second.read_bytes()
+    assert (tmp_path / "store" / "thumbs" / "video-1" / "v1-large.jpeg").read_bytes() == first.read_bytes()
+
+def test_workers_sharing_a_directory_share_one_budget(tmp_path):
+    storage = RemoteStorage(tmp_path / "store")
+    for index in range(4):
+        store_source(storage, tmp_path, f"previews/video-{index}/thumbnail.jpg")
+
+    # Two worker processes' caches over one directory; each thumbnail is well over 1/16 of the
+    # budget, so every write rescans the directory
+    size = os.path.getsize(get(ThumbnailCache(storage, root=tmp_path / "probe"), "video-0"))
+    workers = [ThumbnailCache(storage, root=tmp_path / "cache", max_bytes=int(size * 2.5)) for _ in range(2)]
+    for index in range(4):
+        get(workers[index % 2], f"video-{index}")
+        time.sleep(0.01)
+
+    cached = sorted(path.name for path in (tmp_path / "cache").glob("*.jpeg"))
+    assert len(cached) <= 3
+    assert "video-3-v1-large.jpeg" in cached and "video-0-v1-large.jpeg" not in cached
+
+def test_hits_refresh_recency(tmp_path):
+    storage = RemoteStorage(tmp_path / "store")
+    store_source(storage, tmp_path)
+    cache = ThumbnailCache(storage, root=tmp_path / "cache")
+    path = get(cache)
+    os.utime(path, (0, 0))
+    assert get(cache) == path
+    assert time.time() - path.stat().st_mtime < 60
+
+def test_eviction_only_clears_abandoned_partial_files(tmp_path):
+    cache = ThumbnailCache(RemoteStorage(tmp_path / "store"), root=tmp_path / "cache")
+    abandoned = tmp_path / "cache" / "a.jpeg.1.tmp"
+    in_progress = tmp_path / "cache" / "b.jpeg.2.tmp"
+    abandoned.write_bytes(b"x")
+    in_progress.write_bytes(b"x")
+    os.utime(abandoned, (0, 0))
+
+    cache._evict()
+    assert not abandoned.exists() and in_progress.exists()
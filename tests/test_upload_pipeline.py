@@ -0,0 +1,171 @@
+import asyncio
+import copy
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from upload_pipeline import (
+    append_upload_chunk, create_upload_session, finalize_upload_session, get_upload_session, stream_video_upload
+)
+
+BOUNDARY = "pegoboundary"
+
+class FakeRequest:
+    """Just enough of a Starlette request for the upload helpers: headers and a body stream"""
+
+    def __init__(self, chunks, headers=None, fail_after: bool = False):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.fail_after = fail_after
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.fail_after:
+            raise ConnectionResetError("client went away")
+
+def multipart_body(data: bytes, content_type: str = "video/mp4", filename: str = "clip.mp4") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="title"\r\n\r\n'
+        "My clip\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def multipart_request(body: bytes, chunk_size: int = 7, **headers) -> FakeRequest:
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    return FakeRequest(chunks, {"content-type": f"multipart/form-data; boundary={BOUNDARY}", **headers})
+
+def test_multipart_upload_streams_file_part(tmp_path):
+    data = bytes(range(256)) * 40 + f"--{BOUNDARY}".encode()[:-1]
+    upload = asyncio.run(stream_video_upload(multipart_request(multipart_body(data)), tmp_path))
+
+    assert upload.file_path.read_bytes() == data
+    assert upload.file_size == len(data)
+    assert upload.content_hash == hashlib.sha256(data).hexdigest()
+    assert upload.content_type == "video/mp4"
+    assert upload.filename.endswith(".mp4")
+    assert [path.name for path in tmp_path.iterdir()] == [upload.filename]
+
+@pytest.mark.parametrize("body, status_code", [
+    (multipart_body(b"x" * 2000), 413),
+    (multipart_body(b"video", content_type="image/png"), 400),
+    (multipart_body(b"video")[:-20], 400),
+    (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"title\"\r\n\r\nx\r\n--{BOUNDARY}--\r\n".encode(), 400),
+])
+def test_multipart_upload_rejections_leave_no_files(tmp_path, body, status_code):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(stream_video_upload(multipart_request(body), tmp_path, max_bytes=1000))
+    assert error.value.status_code == status_code
+    assert list(tmp_path.iterdir()) == []
+
+def test_multipart_upload_checks_content_length_first(tmp_path):
+    request = multipart_request(b"", **{"content-length": str(10 * 1024 * 1024)})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(stream_video_upload(request, tmp_path, max_bytes=1000))
+    assert error.value.status_code == 413
+
+# Resumable uploads
+
+def matches(doc: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$gt" and not (value is not None and value > operand):
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+class FakeCollection:
+    """In-memory stand-in for the few upload_sessions queries the resumable upload code makes"""
+
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(copy.deepcopy(doc))
+
+    async def find_one(self, query):
+        return next((copy.deepcopy(doc) for doc in self.docs if matches(doc, query)), None)
+
+    async def find_one_and_update(self, query, update, return_document=None):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(copy.deepcopy(update["$set"]))
+                return copy.deepcopy(doc)
+        return None
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(copy.deepcopy(update["$set"]))
+                return
+
+def new_session(tmp_path, total_size: int = 10):
+    db = SimpleNamespace(upload_sessions=FakeCollection())
+    session = asyncio.run(create_upload_session(db, tmp_path, "video-1", "user-1", "clip.mp4", "video/mp4", total_size))
+    return db, session
+
+def append(db, session, offset: int, *chunks: bytes, fail_after: bool = False) -> int:
+    return asyncio.run(append_upload_chunk(db, session.id, "user-1", offset, FakeRequest(list(chunks), fail_after=fail_after)))
+
+def conflict_offset(call) -> int:
+    with pytest.raises(HTTPException) as error:
+        call()
+    assert error.value.status_code == 409
+    return int(error.value.headers["Upload-Offset"])
+
+def test_resumable_chunks_append_at_offsets(tmp_path):
+    db, session = new_session(tmp_path)
+    assert append(db, session, 0, b"0123") == 4
+    assert append(db, session, 4, b"45", b"6789") == 10
+
+    upload = asyncio.run(finalize_upload_session(db, session.id, "user-1", tmp_path))
+    assert upload.file_path.read_bytes() == b"0123456789"
+    assert upload.content_hash == hashlib.sha256(b"0123456789").hexdigest()
+
+def test_resumable_offset_mismatch_reports_current_offset(tmp_path):
+    db, session = new_session(tmp_path)
+    append(db, session, 0, b"0123")
+    assert conflict_offset(lambda: append(db, session, 0, b"0123")) == 4
+    assert conflict_offset(lambda: append(db, session, 6, b"67")) == 4
+
+def test_resumable_dropped_connection_keeps_received_bytes(tmp_path):
+    db, session = new_session(tmp_path)
+    with pytest.raises(ConnectionResetError):
+        append(db, session, 0, b"012", fail_after=True)
+
+    stored = asyncio.run(get_upload_session(db, session.id, "user-1"))
+    assert stored.offset == 3 and stored.lease_until is None
+    assert append(db, session, 3, b"3456789") == 10
+
+def test_resumable_oversized_chunk_is_discarded(tmp_path):
+    db, session = new_session(tmp_path)
+    append(db, session, 0, b"0123")
+    with pytest.raises(HTTPException) as error:
+        append(db, session, 4, b"456", b"789abc")
+    assert error.value.status_code == 413
+
+    # The rejected chunk's bytes are dropped on the next write at the committed offset
+    assert asyncio.run(get_upload_session(db, session.id, "user-1")).offset == 4
+    assert append(db, session, 4, b"456789") == 10
+    upload = asyncio.run(finalize_upload_session(db, session.id, "user-1", tmp_path))
+    assert upload.file_path.read_bytes() == b"0123456789"
+
+def test_resumable_finalize_requires_every_byte(tmp_path):
+    db, session = new_session(tmp_path)
+    append(db, session, 0, b"01234")
+    assert conflict_offset(lambda: asyncio.run(finalize_upload_session(db, session.id, "user-1", tmp_path))) == 5